@@ -0,0 +1,149 @@
+# python -m benchmarks.bench_chat [--quick] [--recordings FILE]
+#
+# Offline benchmark of Chat, Messages and the stream parsers against
+# StubBedrockRuntime. No network access or AWS credentials are needed.
+#
+# Reports, per scenario:
+#   ttfc_ms      time from calling generate_stream to the first text chunk
+#   chunks/s     chunks delivered per second after the first one
+#   cpu_ms/turn  process CPU time per turn (sequential runs only)
+#   peak_kb      peak memory allocated during the turn (sequential runs only)
+#
+# Scenarios cover history length, image size and concurrency. Sequential runs
+# reuse one conversation across turns, as a live session would. The stub adds
+# no latency in the sequential runs, so times are the client-side overhead;
+# the concurrent runs add first-chunk and inter-chunk latency to show how
+# the async path overlaps streams. Their CPU time includes the event loop
+# waking up for every simulated chunk delay, so compare it across runs of
+# this script rather than with the sequential figures.
+
+import argparse
+import asyncio
+import base64
+import os
+import time
+import tracemalloc
+
+from src.chat import Chat
+from src.llm_bedrock_claude import ClaudeLLM
+from src.llm_bedrock_mistral import MistralLLM
+from src.stub_runtime import StubBedrockRuntime, load_recordings
+
+RESPONSE = "Arr, matey! " * 200
+
+
+def make_chat(llm_class, runtime, history_turns, image_bytes):
+    llm = llm_class()
+    llm.bedrock_runtime = runtime
+    llm.async_transport = runtime.as_async_transport()
+    chat = Chat(llm=llm, system_prompt="Talk like a pirate.")
+
+    image = base64.b64encode(os.urandom(image_bytes)).decode() if image_bytes else None
+    for turn in range(history_turns):
+        content = [{"type": "text", "text": f"Question number {turn}?"}]
+        if image:
+            content.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": image}})
+        chat.messages.add({"role": "user", "content": content})
+        chat.messages.add({"role": "assistant", "content": [{"type": "text", "text": RESPONSE}]})
+    return chat
+
+
+def run_turn(chat):
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    for chunk in chat.generate_stream("And what next?"):
+        if first is None and chunk:
+            first = time.perf_counter()
+        chunks += 1
+    return first - start, chunks / max(time.perf_counter() - first, 1e-9)
+
+
+def sequential(llm_class, history_turns, image_bytes, recordings, turns=5):
+    runtime = StubBedrockRuntime(text=RESPONSE, recordings=recordings)
+    chat = make_chat(llm_class, runtime, history_turns, image_bytes)
+    run_turn(chat)
+
+    ttfc, rates = [], []
+    cpu_start = time.process_time()
+    for _ in range(turns):
+        first, rate = run_turn(chat)
+        ttfc.append(first)
+        rates.append(rate)
+    cpu = (time.process_time() - cpu_start) / turns
+
+    # Memory is traced in a separate turn, as tracing slows everything down.
+    tracemalloc.start()
+    run_turn(chat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "ttfc_ms": 1e3 * sorted(ttfc)[len(ttfc) // 2],
+        "chunks/s": sorted(rates)[len(rates) // 2],
+        "cpu_ms/turn": 1e3 * cpu,
+        "peak_kb": peak / 1024,
+    }
+
+
+async def concurrent(llm_class, history_turns, image_bytes, recordings, concurrency):
+    runtime = StubBedrockRuntime(
+        text=RESPONSE, recordings=recordings, first_chunk_latency=0.2, chunk_latency=0.005
+    )
+    chats = [make_chat(llm_class, runtime, history_turns, image_bytes) for _ in range(concurrency)]
+
+    async def one(chat):
+        start = time.perf_counter()
+        first = None
+        chunks = 0
+        async for chunk in chat.agenerate_stream("And what next?"):
+            if first is None and chunk:
+                first = time.perf_counter()
+            chunks += 1
+        return first - start, chunks
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(chat) for chat in chats))
+    wall = time.perf_counter() - start
+    ttfc = sorted(r[0] for r in results)
+    return {
+        "ttfc_ms": 1e3 * ttfc[len(ttfc) // 2],
+        "chunks/s": sum(r[1] for r in results) / wall,
+        "cpu_ms/turn": 1e3 * (time.process_time() - cpu_start) / concurrency,
+        "peak_kb": float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true", help="fewer scenarios")
+    parser.add_argument("--recordings", help="replay a RecordingBedrockRuntime file instead of synthetic streams")
+    args = parser.parse_args()
+
+    histories = [0, 10] if args.quick else [0, 10, 50]
+    image_sizes = [0, 256 * 1024] if args.quick else [0, 256 * 1024, 1024 * 1024]
+    concurrency = [1, 16] if args.quick else [1, 16, 64, 256]
+
+    print(f"{'model':8} {'scenario':34} {'ttfc_ms':>9} {'chunks/s':>10} {'cpu_ms/turn':>12} {'peak_kb':>10}")
+
+    def report(model, scenario, result):
+        print(f"{model:8} {scenario:34} {result['ttfc_ms']:9.2f} {result['chunks/s']:10.0f} "
+              f"{result['cpu_ms/turn']:12.2f} {result['peak_kb']:10.0f}")
+
+    for model, llm_class in [("claude", ClaudeLLM), ("mistral", MistralLLM)]:
+        recordings = None
+        if args.recordings:
+            recordings = load_recordings(args.recordings, llm_class.model_fields["modelId"].default)
+        for turns in histories:
+            # The Mistral prompt template only renders text.
+            for image_bytes in image_sizes if model == "claude" else [0]:
+                scenario = f"history={turns} image={image_bytes // 1024}KB"
+                report(model, scenario, sequential(llm_class, turns, image_bytes, recordings))
+        for n in concurrency:
+            scenario = f"concurrent={n} history=10"
+            report(model, scenario, asyncio.run(concurrent(llm_class, 10, 0, recordings, n)))
+
+
+if __name__ == "__main__":
+    main()
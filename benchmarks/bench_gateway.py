@@ -0,0 +1,111 @@
+# python -m benchmarks.bench_gateway [--clients 50 200 500] [--seconds 10]
+#
+# Load test of src.gateway against StubBedrockRuntime. The gateway runs in
+# its own process on one event loop; each simulated client owns a session
+# and sends a prompt as soon as its previous response has finished.
+#
+# Reports, per number of clients:
+#   streams/s        responses completed per second
+#   ttfc p50/p95 ms  time from sending the prompt to the first chunk event
+#   gateway cpu      share of one core used by the gateway process
+#   streams/core     average concurrent streams divided by the gateway's
+#                    cores in use: the streams one core could sustain
+#
+# The stub waits FIRST_CHUNK_LATENCY before the first chunk and
+# CHUNK_LATENCY between chunks, so each response takes about 1.5 s.
+
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+
+FIRST_CHUNK_LATENCY = 0.3
+CHUNK_LATENCY = 0.02
+
+
+async def request(port, method, path, body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    return reader, writer
+
+
+async def stats(port):
+    reader, writer = await request(port, "GET", "/stats")
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+
+async def client(port, session, deadline, results):
+    turn = 0
+    while time.perf_counter() < deadline:
+        turn += 1
+        start = time.perf_counter()
+        reader, writer = await request(port, "POST", f"/sessions/{session}/messages", json.dumps({"prompt": f"Question {turn}"}).encode())
+        first = None
+        async for line in reader:
+            if first is None and line.startswith(b"event: chunk"):
+                first = time.perf_counter()
+            if line.startswith(b"event: done") or line.startswith(b"event: error"):
+                break
+        writer.close()
+        end = time.perf_counter()
+        if first is not None:
+            results.append((first - start, end - start))
+        # Keep the history short, so every run measures the same work.
+        if turn % 10 == 0:
+            _, writer = await request(port, "DELETE", f"/sessions/{session}")
+            writer.close()
+
+
+async def load(port, clients, seconds):
+    before = await stats(port)
+    started = time.perf_counter()
+    results = []
+    await asyncio.gather(*(client(port, f"s{clients}-{i}", started + seconds, results) for i in range(clients)))
+    wall = time.perf_counter() - started
+    after = await stats(port)
+    return results, wall, after["cpu_seconds"] - before["cpu_seconds"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "src.gateway", "--stub", "--port", str(port), "--max-concurrent", str(max(args.clients)),
+         "--stub-first-chunk-latency", str(FIRST_CHUNK_LATENCY), "--stub-chunk-latency", str(CHUNK_LATENCY)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        server.stdout.readline()
+        print(f"{'clients':>8} {'streams/s':>10} {'ttfc p50 ms':>12} {'ttfc p95 ms':>12} {'gateway cpu':>12} {'streams/core':>13}")
+        for clients in args.clients:
+            results, wall, cpu = asyncio.run(load(port, clients, args.seconds))
+            ttfc = sorted(first for first, _ in results)
+            concurrent = sum(total for _, total in results) / wall
+            utilisation = cpu / wall
+            print(
+                f"{clients:8} {len(results) / wall:10.1f} {ttfc[len(ttfc) // 2] * 1e3:12.1f} {ttfc[int(len(ttfc) * 0.95)] * 1e3:12.1f}"
+                f" {utilisation * 100:11.0f}% {concurrent / utilisation:13.0f}"
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
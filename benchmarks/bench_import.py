@@ -0,0 +1,63 @@
+# python -m benchmarks.bench_import
+#
+# Cold start cost of the package: the import time of each module, measured
+# with `python -X importtime` in a fresh interpreter (best of RUNS), and the
+# heavy third-party modules each import loaded. Chat and Messages must not
+# load boto3, botocore or jinja2, and the LLM modules only load botocore's
+# exception classes until their first request creates the client.
+#
+# Budgets are in milliseconds, set on a small cloud VM where importing
+# pydantic and building the message models take most of the Chat figure and
+# boto3 alone takes over 200 ms, so an LLM module that imported boto3 again
+# (about 400 ms before it was deferred) would be over budget.
+# Exits with status 1 if a module is over its budget or loads a module it
+# should not.
+
+import subprocess
+import sys
+
+RUNS = 5
+HEAVY = ("boto3", "botocore", "jinja2", "PIL")
+
+# module: (budget_ms, heavy modules it may load)
+BUDGETS = {
+    "src.messages": (300, ()),
+    "src.chat": (325, ()),
+    "src.llm_bedrock_claude": (350, ("botocore",)),
+    "src.llm_bedrock_mistral": (350, ("botocore",)),
+}
+
+FIRST_CLIENT = "import time; from src.llm_bedrock_claude import ClaudeLLM; s = time.perf_counter(); ClaudeLLM().bedrock_runtime; print(time.perf_counter() - s)"
+
+
+def import_ms(module):
+    """Cumulative import time of `module` in a fresh interpreter, and the heavy modules loaded."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys, {module}; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"],
+        capture_output=True, text=True, check=True,
+    )
+    total = next(
+        int(line.split("|")[1])
+        for line in result.stderr.splitlines()
+        if line.split("|")[-1].strip() == module
+    )
+    return total / 1e3, result.stdout.split()
+
+
+def main():
+    failed = False
+    print(f"{'module':26} {'import ms':>10} {'budget ms':>10}  heavy modules loaded")
+    for module, (budget, allowed) in BUDGETS.items():
+        ms, loaded = min(import_ms(module) for _ in range(RUNS))
+        over = ms > budget or any(name not in allowed for name in loaded)
+        failed |= over
+        print(f"{module:26} {ms:10.1f} {budget:10}  {', '.join(loaded) or '-'}{'  OVER BUDGET' if over else ''}")
+
+    # Creating the client imports boto3; it happens on the first request.
+    seconds = subprocess.run([sys.executable, "-c", FIRST_CLIENT], capture_output=True, text=True, check=True).stdout
+    print(f"{'first client (boto3)':26} {float(seconds) * 1e3:10.1f} {'-':>10}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# python -m benchmarks.bench_messages
+#
+# Per-message cost of adding messages to a history and serialising them,
+# before and after the trusted fast path:
+#
+#   add response     Message(**payload) (validated) vs Message.trusted(payload)
+#   stream commit    update_stream of a validated vs a trusted message
+#   add + to_json    a new message encoded for a request body:
+#                    json.dumps(Message(**payload).model_dump()) vs
+#                    Message.trusted(payload).to_json()
+#   prompt           model_dump() of every message vs Messages.to_prompt(),
+#                    which reuses each message's cached dict and JSON
+
+import json
+import timeit
+
+from src.messages import Message, Messages
+
+TURNS = 50
+RESPONSE = {"role": "assistant", "content": [{"type": "text", "text": "Arr, matey! " * 40}]}
+USER = {"role": "user", "content": [{"type": "text", "text": "And what next?"}]}
+
+
+def per_call(fn, number):
+    fn()
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main():
+    history = Messages()
+    for _ in range(TURNS):
+        history.add(USER)
+        history.add(RESPONSE)
+
+    def stream_commit(trusted):
+        streamed = Messages(messages=[Message(**USER), Message(**RESPONSE)])
+        return lambda: streamed.update_stream(RESPONSE, trusted=trusted)
+
+    rows = [
+        ("add response", lambda: Message(**RESPONSE), lambda: Message.trusted(RESPONSE), 1),
+        ("stream commit", stream_commit(False), stream_commit(True), 1),
+        ("add + to_json",
+         lambda: json.dumps(Message(**RESPONSE).model_dump()),
+         lambda: Message.trusted(RESPONSE).to_json(),
+         1),
+        (f"prompt ({2 * TURNS} messages)",
+         lambda: {"messages": [m.model_dump() for m in history.messages]},
+         lambda: history.to_prompt(),
+         2 * TURNS),
+    ]
+
+    print(f"{'operation':24} {'before us/msg':>14} {'after us/msg':>13} {'speedup':>8}")
+    for name, before, after, messages in rows:
+        b = per_call(before, 2000) / messages * 1e6
+        a = per_call(after, 2000) / messages * 1e6
+        print(f"{name:24} {b:14.2f} {a:13.2f} {b / a:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
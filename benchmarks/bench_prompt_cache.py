@@ -0,0 +1,52 @@
+# python -m benchmarks.bench_prompt_cache
+#
+# Time to first chunk and input token usage through a session with a long
+# system prompt, with ClaudeLLM prompt caching off and "auto", against
+# StubBedrockRuntime simulating Bedrock's prompt cache. The stub charges
+# INPUT_TOKEN_LATENCY of prefill time per input token not read from the cache.
+# Relative input cost weighs cache writes at 1.25 and reads at 0.1 of an
+# uncached input token, as Bedrock prices them.
+
+from src.chat import Chat
+from src.instrumentation import HistogramInstrumentation
+from src.llm_bedrock_claude import ClaudeLLM
+from src.stub_runtime import StubBedrockRuntime
+
+MODEL_ID = "anthropic.claude-3-5-haiku-20241022-v1:0"
+TURNS = 20
+INPUT_TOKEN_LATENCY = 20e-6
+SYSTEM_PROMPT = "You are a support agent for a large product catalogue. Follow these rules. " * 300
+RESPONSE = "Here is a detailed answer to your question. " * 20
+
+
+def run(prompt_caching: str):
+    runtime = StubBedrockRuntime(text=RESPONSE, chunk_size=40, prompt_cache=True, input_token_latency=INPUT_TOKEN_LATENCY)
+    llm = ClaudeLLM(modelId=MODEL_ID, prompt_caching=prompt_caching)
+    llm.bedrock_runtime = runtime
+    llm.instrumentation = instrumentation = HistogramInstrumentation()
+    chat = Chat(llm=llm, system_prompt=SYSTEM_PROMPT)
+    for turn in range(1, TURNS + 1):
+        for _ in chat.generate_stream(f"Question {turn}: how do I fix problem number {turn}?"):
+            pass
+
+    summary = {name.split("[")[0]: row for name, row in instrumentation.summary().items()}
+    tokens = {name: summary[name]["mean"] * TURNS for name in ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")}
+    cost = tokens["input_tokens"] + 1.25 * tokens["cache_creation_input_tokens"] + 0.1 * tokens["cache_read_input_tokens"]
+    return summary["ttfc_seconds"], tokens, cost
+
+
+def main():
+    print(f"{TURNS} turns, {len(SYSTEM_PROMPT) // 4} token system prompt")
+    print(f"{'prompt_caching':15} {'ttfc p50 ms':>12} {'ttfc p95 ms':>12} {'uncached':>9} {'written':>8} {'read':>8} {'input cost':>11}")
+    baseline = None
+    for mode in ("off", "auto"):
+        ttfc, tokens, cost = run(mode)
+        baseline = baseline or cost
+        print(
+            f"{mode:15} {ttfc['p50'] * 1e3:12.2f} {ttfc['p95'] * 1e3:12.2f} {tokens['input_tokens']:9.0f}"
+            f" {tokens['cache_creation_input_tokens']:8.0f} {tokens['cache_read_input_tokens']:8.0f} {cost / baseline:10.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# python -m benchmarks.bench_render
+#
+# Client-side cost of one Streamlit rerun of the image demo, before the
+# elements reach Streamlit, for growing image-heavy histories:
+#
+#   before     model_dump() of the history and base64 decoding every image
+#   new turn   HistoryRenderer.parts() of every message and the decoded
+#              bytes of its images, after the previous rerun prepared all
+#              but the newest turn
+#   no change  the same on a rerun with no new message, such as a keystroke
+#
+# Streamlit itself is not needed; its own cost per element is not included.
+
+import base64
+import os
+import time
+
+from src.messages import Messages
+from src.render import HistoryRenderer
+
+IMAGE_BYTES = 256 * 1024
+
+
+def add_turn(messages, turn):
+    messages.add({
+        "role": "user",
+        "content": [
+            {"type": "text", "text": f"What is in picture {turn}?"},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": base64.b64encode(os.urandom(IMAGE_BYTES)).decode()}},
+        ],
+    })
+    messages.add({"role": "assistant", "content": [{"type": "text", "text": "A cat. " * 50}]}, trusted=True)
+
+
+def before(messages):
+    for message in messages.model_dump()["messages"]:
+        for content in message["content"]:
+            if content["type"] == "image":
+                base64.b64decode(content["source"]["data"])
+
+
+def after(renderer, messages):
+    for message in messages.messages:
+        for kind, value in renderer.parts(message):
+            if kind == "image":
+                renderer.image(value.data)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    messages = Messages()
+    renderer = HistoryRenderer()
+    print(f"{'turns':>6} {'before ms':>10} {'new turn ms':>12} {'no change ms':>13}")
+    for turn in range(1, 101):
+        add_turn(messages, turn)
+        # Every rerun prepares the new turn; the cached ones are only looked up.
+        new = timed(lambda: after(renderer, messages))
+        if turn in (1, 10, 25, 50, 100):
+            old = min(timed(lambda: before(messages)) for _ in range(3))
+            unchanged = min(timed(lambda: after(renderer, messages)) for _ in range(3))
+            print(f"{turn:6} {old * 1e3:10.2f} {new * 1e3:12.2f} {unchanged * 1e3:13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# python -m benchmarks.bench_serialization
+#
+# Per-turn cost of building the Claude request body for a 50-turn history in
+# which every user turn carries an image. Compares encoding the whole history
+# on each turn with joining the cached per-message encodings.
+
+import base64
+import json
+import os
+import time
+
+from src.messages import Messages
+from src.llm_bedrock_claude import ClaudeLLM
+
+TURNS = 50
+IMAGE_BYTES = 256 * 1024
+
+
+def build_history(turns, image_bytes):
+    messages = Messages()
+    for turn in range(turns):
+        messages.add({
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"What is in picture {turn}?"},
+                {"type": "image", "source": {
+                    "type": "base64",
+                    "media_type": "image/jpeg",
+                    "data": base64.b64encode(os.urandom(image_bytes)).decode(),
+                }},
+            ],
+        })
+        messages.add({"role": "assistant", "content": [{"type": "text", "text": "A cat. " * 50}]})
+    messages.add("And what about this one?")
+    return messages
+
+
+def per_turn(fn, repeat=20):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    llm = ClaudeLLM()
+    messages = build_history(TURNS, IMAGE_BYTES)
+
+    full = per_turn(lambda: llm._prepare_kwargs(messages.model_dump(), "Talk like a pirate."))
+    cached = per_turn(lambda: llm._prepare_kwargs(messages.to_prompt(), "Talk like a pirate."))
+
+    body = llm._prepare_kwargs(messages.to_prompt(), "Talk like a pirate.")["body"]
+    assert body == llm._prepare_kwargs(messages.model_dump(), "Talk like a pirate.")["body"]
+
+    print(f"history: {TURNS} turns, {len(body) / 1e6:.1f} MB request body")
+    print(f"json.dumps whole history: {full * 1e3:8.2f} ms/turn")
+    print(f"cached fragments:         {cached * 1e3:8.2f} ms/turn")
+    print(f"speedup:                  {full / cached:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
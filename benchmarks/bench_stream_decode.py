@@ -0,0 +1,62 @@
+# python -m benchmarks.bench_stream_decode [--recordings FILE]
+#
+# CPU time per stream event spent decoding response streams, with the stdlib
+# StreamDecoder and with FastStreamDecoder, which reads text deltas straight
+# from the payload bytes and decodes the other events with orjson when it is
+# installed, or json otherwise. The events come from recordings made with
+# RecordingBedrockRuntime, or are synthesised by StubBedrockRuntime, encoded
+# as Bedrock sends them.
+
+import argparse
+import json
+import timeit
+
+from src.llm_bedrock_claude import ClaudeLLM
+from src.llm_bedrock_mistral import MistralLLM
+from src.stream_decoder import FastStreamDecoder, StreamDecoder
+from src.stub_runtime import StubBedrockRuntime, load_recordings
+
+RESPONSE = ("Arr, matey! Here be the treasure ye seek, buried under the old oak tree. " * 4 + "\n\n") * 25
+
+
+def streams(llm_class, recordings):
+    llm = llm_class()
+    runtime = StubBedrockRuntime(text=RESPONSE, chunk_size=12, recordings=recordings)
+    events = []
+    for count in range(1, len(recordings or [None]) + 1):
+        events += [event for _, event, _ in runtime._stream_events({"modelId": llm.modelId}, count)]
+    return llm, events
+
+
+def per_event(llm, events, decoder):
+    def decode():
+        for event in events:
+            llm._handle_event(event, None, decoder)
+    return min(timeit.repeat(decode, number=20, repeat=5)) / 20 / len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recordings", help="JSON lines file written by RecordingBedrockRuntime")
+    args = parser.parse_args()
+
+    decoders = [("json", StreamDecoder()), ("fast + json", FastStreamDecoder(json.loads))]
+    fast = FastStreamDecoder()
+    if fast.loads is not json.loads:
+        decoders.append(("fast + orjson", fast))
+
+    print(f"{'model':8} {'decoder':15} {'events':>7} {'us/event':>9} {'speedup':>8}")
+    for llm_class in (ClaudeLLM, MistralLLM):
+        recordings = None
+        if args.recordings:
+            recordings = load_recordings(args.recordings, llm_class().modelId) or None
+        llm, events = streams(llm_class, recordings)
+        baseline = None
+        for name, decoder in decoders:
+            cost = per_event(llm, events, decoder)
+            baseline = baseline or cost
+            print(f"{llm_class.__name__[:-3]:8} {name:15} {len(events):7} {cost * 1e6:9.3f} {baseline / cost:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
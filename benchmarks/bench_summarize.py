@@ -0,0 +1,54 @@
+# python -m benchmarks.bench_summarize
+#
+# Request size, and the median client-side time per turn over each window of
+# turns, through a long session with and without a HistorySummarizer, against
+# StubBedrockRuntime. The summariser runs between turns, as it would while
+# the user reads and types; the benchmark waits for it so every run is
+# deterministic.
+
+import time
+
+from src.chat import Chat
+from src.llm_bedrock_claude import ClaudeLLM
+from src.stub_runtime import StubBedrockRuntime
+from src.summarize import HistorySummarizer
+
+TURNS = 60
+REPORT_EVERY = 10
+RESPONSE = "Here is a detailed answer to your question. " * 30
+SUMMARY = "The user asked a series of support questions, all answered. " * 10
+
+
+def run(summarize: bool):
+    runtime = StubBedrockRuntime(text=RESPONSE)
+    llm = ClaudeLLM()
+    llm.bedrock_runtime = runtime
+    chat = Chat(llm=llm, system_prompt="You are a helpful support agent.")
+    if summarize:
+        cheap = ClaudeLLM(modelId="anthropic.claude-3-haiku-20240307-v1:0")
+        cheap.bedrock_runtime = StubBedrockRuntime(text=SUMMARY)
+        chat.summarizer = HistorySummarizer(llm=cheap, max_tokens=4000, keep_last_turns=4)
+
+    rows, times = [], []
+    for turn in range(1, TURNS + 1):
+        start = time.perf_counter()
+        for _ in chat.generate_stream(f"Question {turn}: how do I fix problem number {turn}?"):
+            pass
+        times.append(time.perf_counter() - start)
+        if chat.summarizer is not None:
+            chat.summarizer.wait()
+        if turn % REPORT_EVERY == 0:
+            rows.append((turn, len(runtime.requests[-1]["body"]), sorted(times)[len(times) // 2]))
+            times = []
+    return rows
+
+
+def main():
+    full, summarized = run(False), run(True)
+    print(f"{'turn':>5} {'body_kb full':>13} {'body_kb summarized':>19} {'ms full':>8} {'ms summarized':>14}")
+    for (turn, body, ms), (_, body_s, ms_s) in zip(full, summarized):
+        print(f"{turn:5} {body / 1024:13.1f} {body_s / 1024:19.1f} {ms * 1e3:8.2f} {ms_s * 1e3:14.2f}")
+
+
+if __name__ == "__main__":
+    main()
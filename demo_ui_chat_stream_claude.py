@@ -1,9 +1,9 @@
 # streamlit run demo_ui_chat_stream.py
 
 import streamlit as st
-import base64
 from src.chat import Chat
 from src.llm_bedrock_claude import ClaudeLLM
+from src.render import HistoryRenderer
 
 default_system_prompt = "Talk like a pirate."
 
@@ -28,26 +28,14 @@ with st.expander("System Prompt", expanded=False):
     st.markdown("**Try**: `Talk like a pirate.` or `Talk like a tree.` or something much longer.")
     st.button("Save", on_click=change_system_prompt())
 
+# One history renderer per process: it keeps each message ready to draw, so
+# a rerun does not copy the whole history
+@st.cache_resource
+def get_renderer():
+    return HistoryRenderer(avatars={"assistant": "./img/claude.png"})
+
 # Display chat messages from history on app rerun
-messages = st.session_state.chat.messages.dict()['messages']
-for message in messages:
-
-    # Set the avatar depending on who is talking. 
-    if message["role"] == "assistant":
-        avatar="./img/claude.png"
-    else:
-        avatar=None
-
-    with st.chat_message(message["role"], avatar=avatar):
-        for content in message["content"]:
-            # handle a text message
-            if "text" in content:
-                st.markdown(message["content"][0]["text"])
-            # handle an image
-            if "source" in content:
-                image_data = message["content"][0]["source"]["data"]
-                st.image(base64.b64decode(image_data))
-                break
+get_renderer().render(st.session_state.chat.messages)
 
 # Accept user input
 if prompt := st.chat_input("What is up?"):
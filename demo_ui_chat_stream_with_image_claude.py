@@ -1,9 +1,10 @@
 # streamlit run demo_ui_chat_stream_with_image.py
 
 import streamlit as st
-import base64, json
 from src.chat import Chat
 from src.llm_bedrock_claude import ClaudeLLM
+from src.messages import ImageIngestor
+from src.render import HistoryRenderer
 
 default_system_prompt = "Talk like a pirate."
 
@@ -11,28 +12,23 @@ default_system_prompt = "Talk like a pirate."
 if 'chat' not in st.session_state:
     st.session_state['chat'] = Chat(llm=ClaudeLLM(), system_prompt=default_system_prompt)
 
+# One image ingestor per process, so identical uploads are stored once
+@st.cache_resource
+def get_image_ingestor():
+    return ImageIngestor()
+
 # Function to change the system prompt
 def change_system_prompt():
     st.session_state['chat'].system_prompt = system_prompt_input
 
-# Display chat messages
-messages = st.session_state.chat.messages.dict()['messages']
-for message in messages:
-    if message["role"] == "assistant":
-        avatar="./img/claude.png"
-    else:
-        avatar=None
-
-    with st.chat_message(message["role"], avatar=avatar):
-        for content in message["content"]:
+# One history renderer per process: it keeps each message ready to draw and
+# each image decoded, so a rerun does not copy or decode the whole history
+@st.cache_resource
+def get_renderer():
+    return HistoryRenderer(avatars={"assistant": "./img/claude.png"})
 
-            if "text" == content['type']:
-                st.markdown(content["text"])
-
-            elif "image" == content['type']:
-                image_data = content["source"]["data"]
-                st.image(base64.b64decode(image_data))
-                break
+# Display chat messages
+get_renderer().render(st.session_state.chat.messages)
 
 
 # with st.popover("Open popover"):
@@ -69,27 +65,21 @@ if prompt:
     }
 
     # Check if an image was uploaded
-    image_base64 = ""
+    image_content = None
     if uploaded_file is not None:
-        # Convert to base64
-        mime_type = uploaded_file.type
-        bytes_data = uploaded_file.getvalue()
-        image_base64 = base64.b64encode(bytes_data).decode()
-
-        message['content'].append({
-            "source": {
-                "type": "base64",
-                "media_type": mime_type,
-                "data": image_base64
-            }
-        })
+        # Downscale, recompress and base64 encode (once per distinct image)
+        image_content = get_image_ingestor().ingest(uploaded_file.getvalue(), media_type=uploaded_file.type)
+        message['content'].append(image_content)
 
     with st.chat_message("user"):
         st.markdown(prompt)
-        if image_base64:
-            st.image(base64.b64decode(image_base64))
+        if image_content:
+            st.image(get_renderer().image(image_content.source.data))
 
     # Generate and display response
     with st.chat_message("assistant", avatar="./img/claude.png"):
         response = st.write_stream(st.session_state['chat'].generate_stream(message))
 
+    with st.sidebar:
+        st.caption(f"Image bytes saved this request: {st.session_state['chat'].messages.image_bytes_saved():,}")
+
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pydantic import BaseModel
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from .cache import request_key
+from .messages import Message, Messages, Prompt
+from .resilience import ResilientLLM
+
+# A conversation is a single user prompt, a list of message dicts or a
+# Messages history.
+Conversation = Union[str, List[Dict], Messages]
+
+
+class BatchResult(BaseModel):
+    """
+    The outcome of one conversation of a batch.
+
+    Attributes:
+        index (int): Position of the conversation in the input.
+        response (Optional[Dict]): The assistant message, None on error.
+        text (Optional[str]): The response text, None on error.
+        error (Optional[str]): The error, None on success.
+        resumed (bool): True if the result was read from the checkpoint.
+    """
+    index: int
+    response: Optional[Dict] = None
+    text: Optional[str] = None
+    error: Optional[str] = None
+    resumed: bool = False
+
+
+def to_prompt(conversation: Conversation) -> Prompt:
+    """Build the prompt for a conversation. Invalid messages raise a ValidationError."""
+    if isinstance(conversation, Messages):
+        return conversation.to_prompt()
+    if isinstance(conversation, str):
+        conversation = [{"role": "user", "content": [{"type": "text", "text": conversation}]}]
+    return Prompt([Message(**message) for message in conversation])
+
+
+def _response_text(response: Dict) -> str:
+    return "".join(content.get("text", "") for content in response.get("content", []))
+
+
+class BatchCheckpoint:
+    """
+    Append-only JSON lines record of finished conversations, so an
+    interrupted batch resumes where it stopped. Each line holds the index, a
+    key of the request and the result; failed conversations are run again on
+    resume, as are conversations whose request has changed since.
+
+    Attributes:
+        path (str): The checkpoint file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.results: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.results[record["index"]] = record
+
+    def get(self, index: int, key: str) -> Optional[BatchResult]:
+        record = self.results.get(index)
+        if record is None or record["key"] != key or record.get("error") is not None:
+            return None
+        return BatchResult(index=index, response=record["response"], text=record["text"], resumed=True)
+
+    def save(self, result: BatchResult, key: str):
+        record = {"index": result.index, "key": key, **result.model_dump(exclude={"index", "resumed"})}
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.results[result.index] = record
+
+
+class _Batch:
+    """State shared by the sync and async runners."""
+
+    def __init__(self, llm, system_prompt, checkpoint, requests_per_minute, tokens_per_minute):
+        if not isinstance(llm, ResilientLLM):
+            llm = ResilientLLM(llm=llm, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+        self.llm = llm
+        self.system_prompt = system_prompt
+        self.checkpoint = BatchCheckpoint(checkpoint) if checkpoint else None
+
+    def prepare(self, index: int, conversation: Conversation):
+        """
+        Returns (prompt, key, result). The result is set, and needs no request,
+        when the conversation finished in the checkpoint or cannot be built.
+        """
+        try:
+            prompt = to_prompt(conversation)
+        except Exception as e:
+            return None, None, BatchResult(index=index, error=str(e))
+        if self.checkpoint is None:
+            return prompt, None, None
+        key = request_key(self.llm, prompt, self.system_prompt)
+        return prompt, key, self.checkpoint.get(index, key)
+
+    def finish(self, index: int, key: Optional[str], response=None, error: Exception = None) -> BatchResult:
+        if error is not None:
+            result = BatchResult(index=index, error=f"{type(error).__name__}: {error}")
+        else:
+            result = BatchResult(index=index, response=response, text=_response_text(response))
+        if self.checkpoint:
+            self.checkpoint.save(result, key)
+        return result
+
+
+def batch_generate(
+    llm: Any,
+    conversations: Iterable[Conversation],
+    system_prompt: Optional[str] = None,
+    concurrency: int = 8,
+    checkpoint: Optional[str] = None,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+) -> Iterator[BatchResult]:
+    """
+    Generate a response for each of many independent conversations.
+
+    At most `concurrency` requests are in flight at once. Requests go through
+    a ResilientLLM, so throttling is retried and the request and token quotas
+    (shared with every other ResilientLLM for the model) are respected; pass a
+    ResilientLLM to configure it yourself. Conversations are read from the
+    iterable as capacity frees up.
+
+    Parameters:
+        llm: The ClaudeLLM, MistralLLM or wrapper to use.
+        conversations (Iterable[Conversation]): User prompts, lists of message
+            dicts or Messages histories.
+        system_prompt (Optional[str]): System prompt for every conversation.
+        concurrency (int): Maximum requests in flight.
+        checkpoint (Optional[str]): JSON lines file recording finished
+            conversations. Conversations already finished in it are not run
+            again; their saved results are yielded, marked `resumed`.
+        requests_per_minute (Optional[float]): Request quota, when `llm` is
+            not already a ResilientLLM.
+        tokens_per_minute (Optional[float]): Token quota, likewise.
+
+    Yields:
+        BatchResult: Results in completion order. A failed conversation yields
+            a result with `error` set rather than stopping the batch.
+    """
+    batch = _Batch(llm, system_prompt, checkpoint, requests_per_minute, tokens_per_minute)
+
+    def run(index, prompt, key):
+        try:
+            response = batch.llm.generate(prompt, system_prompt=system_prompt)
+        except Exception as e:
+            return batch.finish(index, key, error=e)
+        return batch.finish(index, key, response=response)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    try:
+        for index, conversation in enumerate(conversations):
+            prompt, key, result = batch.prepare(index, conversation)
+            if result is not None:
+                yield result
+                continue
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(run, index, prompt, key))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+async def abatch_generate(
+    llm: Any,
+    conversations: Iterable[Conversation],
+    system_prompt: Optional[str] = None,
+    concurrency: int = 8,
+    checkpoint: Optional[str] = None,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+):
+    """
+    Async version of batch_generate, running the requests as tasks on the
+    event loop through the LLM's async methods. Parameters and results are
+    the same.
+    """
+    batch = _Batch(llm, system_prompt, checkpoint, requests_per_minute, tokens_per_minute)
+
+    async def run(index, prompt, key):
+        try:
+            response = await batch.llm.agenerate(prompt, system_prompt=system_prompt)
+        except Exception as e:
+            return batch.finish(index, key, error=e)
+        return batch.finish(index, key, response=response)
+
+    pending = set()
+    try:
+        for index, conversation in enumerate(conversations):
+            prompt, key, result = batch.prepare(index, conversation)
+            if result is not None:
+                yield result
+                continue
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(run(index, prompt, key)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _unwrap(llm):
+    while hasattr(llm, "llm"):
+        llm = llm.llm
+    return llm
+
+
+def write_batch_input(
+    llm: Any,
+    conversations: Iterable[Conversation],
+    path: str,
+    system_prompt: Optional[str] = None,
+) -> int:
+    """
+    Write conversations as a Bedrock batch inference input file, one
+    {"recordId", "modelInput"} line per conversation, with the request body
+    the LLM would send. The record id is the conversation's index, so
+    read_batch_output can match the results up with the input.
+
+    Parameters:
+        llm: The ClaudeLLM or MistralLLM (or a wrapper of one) whose request
+            format and settings to use.
+        conversations (Iterable[Conversation]): The conversations.
+        path (str): The JSON lines file to write.
+        system_prompt (Optional[str]): System prompt for every conversation.
+
+    Returns:
+        int: The number of records written.
+    """
+    llm = _unwrap(llm)
+    count = 0
+    with open(path, "w") as f:
+        for index, conversation in enumerate(conversations):
+            body = llm._prepare_request(to_prompt(conversation), system_prompt)["body"]
+            # The body is already JSON; write it as is rather than encoding it again.
+            f.write(f'{{"recordId": "{index:011d}", "modelInput": {body}}}\n')
+            count += 1
+    return count
+
+
+def read_batch_output(llm: Any, path: str) -> Iterator[BatchResult]:
+    """
+    Read a Bedrock batch inference output file for an input written by
+    write_batch_input.
+
+    Parameters:
+        llm: The LLM the input was written for, to parse its responses.
+        path (str): The .jsonl.out file.
+
+    Yields:
+        BatchResult: One result per record, in file order.
+    """
+    llm = _unwrap(llm)
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            index = int(record["recordId"])
+            if "modelOutput" not in record:
+                yield BatchResult(index=index, error=json.dumps(record.get("error")))
+                continue
+            response = llm._parse_response(record["modelOutput"])
+            yield BatchResult(index=index, response=response, text=_response_text(response))
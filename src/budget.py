@@ -0,0 +1,134 @@
+import math
+from pydantic import BaseModel
+from typing import Dict, List, Literal, Optional
+
+from .messages import Message, TextContent
+
+# Context window, in tokens, of each supported model.
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "anthropic.claude-instant-v1": 100000,
+    "anthropic.claude-v2": 100000,
+    "anthropic.claude-v2:1": 200000,
+    "anthropic.claude-3-sonnet-20240229-v1:0": 200000,
+    "anthropic.claude-3-haiku-20240307-v1:0": 200000,
+    "anthropic.claude-3-5-haiku-20241022-v1:0": 200000,
+    "us.anthropic.claude-3-5-haiku-20241022-v1:0": 200000,
+    "us.anthropic.claude-3-7-sonnet-20250219-v1:0": 200000,
+    "mistral.mistral-7b-instruct-v0:2": 32000,
+    "mistral.mixtral-8x7b-instruct-v0:1": 32000,
+    "mistral.mistral-large-2402-v1:0": 32000,
+}
+DEFAULT_CONTEXT_WINDOW = 32000
+
+# Claude bills an image at roughly (width * height) / 750 tokens and downscales
+# anything above ~1.15 megapixels, so a full size image costs about 1600 tokens.
+IMAGE_TOKENS = 1600
+
+IMAGE_PLACEHOLDER = "[image omitted]"
+
+
+class ContextBudget(BaseModel):
+    """
+    Keeps the history sent to the model within the model's context window.
+
+    Token counts are estimated locally from the text length, which is fast
+    and errs on the high side for English text.
+
+    Attributes:
+        max_context (Optional[int]): Context window in tokens. Defaults to the
+            window of the model in use, see MODEL_CONTEXT_WINDOWS.
+        chars_per_token (float): Characters per token used by the estimator.
+        image_tokens (int): Estimated tokens per image.
+        policy (Literal): How to make room when the history is over budget.
+            "drop_oldest" drops the oldest turns. "keep_first" keeps the first
+            `keep_first_turns` turns and drops the oldest turns after them.
+            "drop_images" replaces the oldest images with a placeholder first,
+            then drops the oldest turns.
+        keep_first_turns (int): Number of user/assistant turns "keep_first" keeps.
+    """
+    max_context: Optional[int] = None
+    chars_per_token: float = 3.5
+    image_tokens: int = IMAGE_TOKENS
+    policy: Literal["drop_oldest", "keep_first", "drop_images"] = "drop_oldest"
+    keep_first_turns: int = 1
+
+    def estimate_tokens(self, text: Optional[str]) -> int:
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def estimate_message_tokens(self, message: Message) -> int:
+        tokens = 0
+        for content in message.content:
+            if content.type == "image":
+                tokens += self.image_tokens
+            else:
+                tokens += self.estimate_tokens(content.text)
+        return tokens
+
+    def estimate_prompt_tokens(self, prompt: Dict, system_prompt: Optional[str] = None) -> int:
+        """Estimated input tokens of a {"messages": [...]} prompt of plain dicts."""
+        tokens = self.estimate_tokens(system_prompt)
+        for message in prompt["messages"]:
+            for content in message["content"]:
+                if content.get("type") == "image" or "source" in content:
+                    tokens += self.image_tokens
+                else:
+                    tokens += self.estimate_tokens(content.get("text"))
+        return tokens
+
+    def limit_for(self, model_id: Optional[str], system_prompt: Optional[str] = None, max_output_tokens: int = 0) -> int:
+        """
+        Tokens left for the messages once the system prompt and the response
+        have been accounted for.
+        """
+        window = self.max_context or MODEL_CONTEXT_WINDOWS.get(model_id, DEFAULT_CONTEXT_WINDOW)
+        return window - max_output_tokens - self.estimate_tokens(system_prompt)
+
+    def fit(self, messages: List[Message], limit: int) -> List[Message]:
+        """
+        Trim a history to an estimated `limit` tokens according to the policy.
+
+        Turns are dropped in user/assistant pairs so the result still starts
+        with a user message and alternates roles. The last message, normally
+        the new prompt, is always kept. The stored history is not modified.
+
+        Parameters:
+            messages (List[Message]): The full history.
+            limit (int): Token budget for the messages.
+
+        Returns:
+            List[Message]: The messages to send.
+        """
+        messages = list(messages)
+        costs = [self.estimate_message_tokens(message) for message in messages]
+        total = sum(costs)
+        if total <= limit:
+            return messages
+
+        if self.policy == "drop_images":
+            for index, message in enumerate(messages[:-1]):
+                if total <= limit:
+                    break
+                if not any(content.type == "image" for content in message.content):
+                    continue
+                content = [
+                    TextContent(text=IMAGE_PLACEHOLDER) if c.type == "image" else c
+                    for c in message.content
+                ]
+                messages[index] = Message(role=message.role, content=content)
+                cost = self.estimate_message_tokens(messages[index])
+                total -= costs[index] - cost
+                costs[index] = cost
+
+        keep = 0
+        if self.policy == "keep_first":
+            keep = 2 * self.keep_first_turns
+
+        # Drop whole turns from just after the kept head until the rest fits.
+        start = keep
+        while total > limit and start + 2 < len(messages):
+            total -= costs[start] + costs[start + 1]
+            start += 2
+
+        return messages[:keep] + messages[start:] if start > keep else messages
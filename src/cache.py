@@ -0,0 +1,255 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+from .llm_bedrock import BedrockLLM
+from .messages import Message
+
+# Model parameters that change the response, for LLMs other than BedrockLLM
+# that have them.
+SAMPLING_PARAMS = ("max_tokens", "temperature", "top_p", "top_k")
+
+# BedrockLLM fields that only change how a request is sent or how fast its
+# body is built, not what it asks the model. Every other field is in the key.
+TRANSPORT_FIELDS = frozenset((
+    "region_name",
+    "content_type",
+    "accept_type",
+    "max_pool_connections",
+    "tcp_keepalive",
+    "client_max_attempts",
+    "incremental_prompt",
+))
+
+
+def request_key(llm, prompt: Dict, system_prompt: Optional[str] = None) -> str:
+    """
+    Stable hash of a request: model id, system prompt, the model's settings
+    and messages. For a BedrockLLM every field that goes into the request
+    body is part of the key, such as the sampling parameters, Mistral's
+    prompt template and tokens, or Claude's anthropic_version and prompt
+    caching. Messages are hashed in their normalised JSON encoding, which
+    for a Prompt built by Messages.to_prompt is already cached per message.
+
+    Parameters:
+        llm: The LLM the request is for, or a wrapper around it.
+        prompt (Dict): The {"messages": [...]} prompt.
+        system_prompt (Optional[str]): The system prompt.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    # Wrappers such as ResilientLLM hold the model in `llm`; the settings
+    # are the model's own.
+    while hasattr(llm, "llm"):
+        llm = llm.llm
+    if isinstance(llm, BedrockLLM):
+        params = {name: getattr(llm, name) for name in type(llm).model_fields if name not in TRANSPORT_FIELDS}
+    else:
+        params = {name: getattr(llm, name) for name in SAMPLING_PARAMS if hasattr(llm, name)}
+    header = {
+        "modelId": getattr(llm, "modelId", type(llm).__name__),
+        "system": system_prompt,
+        "params": params,
+    }
+    digest = hashlib.sha256(json.dumps(header, sort_keys=True).encode())
+
+    fragments = getattr(prompt, "message_fragments", None)
+    if fragments is None:
+        fragments = [Message(**message).to_json() for message in prompt["messages"]]
+    for fragment in fragments:
+        digest.update(b"\x00")
+        digest.update(fragment.encode())
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with an optional time to live.
+
+    Attributes:
+        maxsize (int): Maximum number of entries.
+        ttl (Optional[float]): Seconds an entry stays valid. None never expires.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteCache:
+    """
+    On-disk cache in a sqlite database, shareable between processes.
+
+    Attributes:
+        path (str): Path of the database file.
+        ttl (Optional[float]): Seconds an entry stays valid. None never expires.
+    """
+
+    def __init__(self, path: str = "bedrock_cache.sqlite", ttl: Optional[float] = None):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, value TEXT)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT created, value FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        created, value = row
+        if self.ttl is not None and time.time() - created > self.ttl:
+            with self._connection() as db:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Dict):
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, created, value) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(value)),
+            )
+
+    def clear(self):
+        with self._connection() as db:
+            db.execute("DELETE FROM responses")
+
+
+def _cumulative(chunks: List[str], chunk: str) -> Dict:
+    chunks.append(chunk)
+    return {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+
+
+class CachedLLM(BaseModel):
+    """
+    Wraps an LLM and answers repeated requests from a cache.
+
+    A cached entry holds the response message and, when it came from a stream,
+    the original chunks. Cache hits on the streaming methods replay those
+    chunks, or the text split into `replay_chunk_size` character chunks, so
+    streaming UIs behave the same on hits. Only streams that run to completion
+    are stored.
+
+    Attributes:
+        llm: The wrapped ClaudeLLM or MistralLLM.
+        cache: A MemoryCache, SqliteCache or any object with get/set.
+        replay_chunk_size (int): Chunk size when replaying a non-streamed entry.
+    """
+    llm: Any
+    cache: Any = Field(default_factory=MemoryCache)
+    replay_chunk_size: int = 16
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def modelId(self):
+        return self.llm.modelId
+
+    @property
+    def max_tokens(self):
+        return self.llm.max_tokens
+
+    def _replay(self, entry: Dict) -> List[str]:
+        if entry.get("chunks") is not None:
+            return entry["chunks"]
+        text = "".join(c.get("text", "") for c in entry["message"]["content"])
+        size = self.replay_chunk_size
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def _store(self, key: str, chunks: List[str]):
+        message = {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+        self.cache.set(key, {"message": message, "chunks": chunks})
+
+    def generate(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry["message"]
+        response = self.llm.generate(prompt, system_prompt=system_prompt)
+        self.cache.set(key, {"message": response})
+        return response
+
+    def generate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        entry = self.cache.get(key)
+        if entry is not None:
+            yield from self._replay(entry)
+            return
+        chunks = []
+        for chunk in self.llm.generate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, chunks)
+
+    def generate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        for chunk in self.generate_stream_deltas(prompt, system_prompt=system_prompt):
+            yield chunk, _cumulative(chunks, chunk)
+
+    async def agenerate(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry["message"]
+        response = await self.llm.agenerate(prompt, system_prompt=system_prompt)
+        self.cache.set(key, {"message": response})
+        return response
+
+    async def agenerate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        entry = self.cache.get(key)
+        if entry is not None:
+            for chunk in self._replay(entry):
+                yield chunk
+            return
+        chunks = []
+        async for chunk in self.llm.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, chunks)
+
+    async def agenerate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        async for chunk in self.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+            yield chunk, _cumulative(chunks, chunk)
@@ -1,7 +1,11 @@
 import json
+import time
 from pydantic import BaseModel, Field
-from typing import Optional, Any
+from typing import Dict, Optional, Any
 from .messages import Messages
+from .budget import ContextBudget
+from .stream_control import StreamControl
+from .summarize import HistorySummarizer
     
 
 class Chat(BaseModel):
@@ -12,6 +16,22 @@ class Chat(BaseModel):
 
     llm: Any
 
+    # Number of streamed chunks between interim writes of the partial response
+    # to the history. None writes the response once, when the stream ends.
+    stream_checkpoint_interval: Optional[int] = None
+
+    # Trims the history sent to the model to fit its context window.
+    # None sends the whole history.
+    context_budget: Optional[ContextBudget] = None
+
+    # Summarises older turns in the background once the history grows past
+    # its threshold. None always sends every turn.
+    summarizer: Optional[HistorySummarizer] = None
+
+    # Receives post-processing timings, see src/instrumentation.py. Request
+    # timings are emitted by the LLM's own `instrumentation`.
+    instrumentation: Optional[Any] = None
+
     class Config:
         arbitrary_types_allowed = True
 
@@ -23,12 +43,55 @@ class Chat(BaseModel):
         self.messages.add(prompt)
         
         response = self.llm.generate(
-            self.messages.dict(), 
-            system_prompt=self.system_prompt
+            self._prompt(), 
+            system_prompt=self._system_prompt()
+        )
+
+        self._post_process(self.messages.add, response, True)
+        self._turn_done()
+
+        return self._response_text(response)
+
+    def _prompt(self):
+        """The history to send to the model, summarised and within the context budget if set."""
+        messages = None
+        if self.summarizer is not None:
+            messages = self.summarizer.compact(self.messages.messages)
+        if self.context_budget is None:
+            return self.messages.to_prompt(messages)
+
+        limit = self.context_budget.limit_for(
+            getattr(self.llm, "modelId", None),
+            system_prompt=self._system_prompt(),
+            max_output_tokens=getattr(self.llm, "max_tokens", 0),
         )
+        if messages is None:
+            messages = self.messages.messages
+        return self.messages.to_prompt(self.context_budget.fit(messages, limit))
 
-        self.messages.add(response)
+    def _system_prompt(self):
+        if self.summarizer is None:
+            return self.system_prompt
+        return self.summarizer.system_prompt(self.system_prompt, self.messages.messages)
 
+    def _turn_done(self):
+        """Start background work for the next turn once this one is in the history."""
+        if self.summarizer is not None:
+            self.summarizer.schedule(self.messages.messages)
+
+    def _post_process(self, commit, *args):
+        """Write a response to the history, timing it if instrumentation is set."""
+        if self.instrumentation is None:
+            return commit(*args)
+        start = time.perf_counter()
+        result = commit(*args)
+        self.instrumentation.emit(
+            "post_process_seconds", time.perf_counter() - start,
+            model_id=getattr(self.llm, "modelId", None)
+        )
+        return result
+
+    def _response_text(self, response):
         if len(response.get('content')) > 0:
             if "text" in response.get('content')[0]:
                 return response.get('content')[0]['text']
@@ -39,14 +102,116 @@ class Chat(BaseModel):
         self.messages.add(prompt)
         
         yield from self.llm.generate_stream(
-            self.messages.dict(), 
-            system_prompt=self.system_prompt
+            self._prompt(), 
+            system_prompt=self._system_prompt()
+        )
+
+    def generate_stream(self, prompt, control: Optional[StreamControl] = None):
+        """
+        Stream the response to a prompt, text delta by text delta.
+
+        Parameters:
+            prompt: The user message.
+            control (Optional[StreamControl]): Stop sequences, time limits and
+                a cancel handle for this turn, and what to keep of the
+                response if it is interrupted.
+        """
+        self.messages.add(prompt)
+
+        buffer = self.messages.stream_buffer(checkpoint_interval=self.stream_checkpoint_interval)
+        stream = self.llm.generate_stream_deltas(
+            self._prompt(),
+            system_prompt=self._system_prompt()
         )
+        if control is not None:
+            stream = control.iterate(stream)
+        try:
+            for chunk in stream:
+                buffer.append(chunk)
+                yield chunk
+        finally:
+            stream.close()
+            self._post_process(self._commit_stream, buffer, control)
+            self._turn_done()
 
-    def generate_stream(self, prompt):
-        for chunk, message in (x for x in self.stream(prompt)):
-            yield chunk
-            self.messages.update_stream(message)
+    def _commit_stream(self, buffer, control: Optional[StreamControl]):
+        """Write a streamed response to the history, applying the control's policy if it was interrupted."""
+        if control is None or not control.interrupted or (control.partial == "keep" and buffer.text):
+            return buffer.commit()
+        # Drop the partial response, if a checkpoint wrote it, and the unanswered user turn.
+        if buffer.written:
+            self.messages.pop()
+        if self.messages.messages and self.messages.messages[-1].role == "user":
+            self.messages.pop()
+
+    async def agenerate(self, prompt):
+        self.messages.add(prompt)
+
+        response = await self.llm.agenerate(
+            self._prompt(),
+            system_prompt=self._system_prompt()
+        )
+
+        self._post_process(self.messages.add, response, True)
+        self._turn_done()
+
+        return self._response_text(response)
+
+    async def astream(self, prompt):
+        self.messages.add(prompt)
+
+        async for chunk, message in self.llm.agenerate_stream(
+            self._prompt(),
+            system_prompt=self._system_prompt()
+        ):
+            yield chunk, message
+
+    async def agenerate_stream(self, prompt, control: Optional[StreamControl] = None):
+        """
+        Stream the response on the running event loop. See generate_stream.
+        """
+        self.messages.add(prompt)
+
+        buffer = self.messages.stream_buffer(checkpoint_interval=self.stream_checkpoint_interval)
+        stream = self.llm.agenerate_stream_deltas(
+            self._prompt(),
+            system_prompt=self._system_prompt()
+        )
+        if control is not None:
+            stream = control.aiterate(stream)
+        try:
+            async for chunk in stream:
+                buffer.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+            self._post_process(self._commit_stream, buffer, control)
+            self._turn_done()
+
+    def fan_out(self, llms: Dict[str, Any]):
+        """
+        Compare several LLMs on this conversation. Each gets its own Chat,
+        starting from a copy of this history and with this chat's settings,
+        and every prompt is sent to all of them at once. The summarizer, which
+        follows a single history, is not copied.
+
+        Parameters:
+            llms (Dict[str, Any]): The LLM of each backend, by name. Include
+                this chat's own llm to continue it alongside the others.
+
+        Returns:
+            FanOutChat: See src/fanout.py.
+        """
+        from .fanout import FanOutChat
+        return FanOutChat.from_llms(
+            llms,
+            system_prompt=self.system_prompt,
+            messages=self.messages,
+            stream_checkpoint_interval=self.stream_checkpoint_interval,
+            context_budget=self.context_budget,
+            instrumentation=self.instrumentation,
+        )
 
     def reset(self):
-        self.messages = Messages()
\ No newline at end of file
+        # Cleared in place so a history opened from a SessionStore stays persisted.
+        self.messages.clear()
\ No newline at end of file
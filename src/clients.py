@@ -0,0 +1,82 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+# Clients are shared by every LLM instance in the process, keyed by region and
+# connection settings. boto3 clients are thread safe once created, but creating
+# them is not, so creation happens under a lock on a dedicated session.
+# boto3 is only imported then, as importing it takes longer than everything
+# else in a cold start.
+_clients: Dict[Tuple, object] = {}
+_lock = threading.Lock()
+_session = None
+
+
+def client_retries(max_attempts: Optional[int]) -> Optional[Dict]:
+    """The botocore `retries` setting for max_attempts, see get_bedrock_runtime."""
+    if max_attempts is None:
+        return None
+    return {"mode": "standard", "total_max_attempts": max_attempts}
+
+
+def get_bedrock_runtime(
+    region_name: str,
+    max_pool_connections: int = 50,
+    tcp_keepalive: bool = True,
+    connect_timeout: float = 5,
+    read_timeout: float = 120,
+    max_attempts: Optional[int] = None,
+):
+    """
+    Return the shared Bedrock Runtime client for the given settings, creating it
+    on first use.
+
+    Parameters:
+        region_name (str): AWS region where the Bedrock Runtime is available.
+        max_pool_connections (int): Size of the client's HTTP connection pool.
+        tcp_keepalive (bool): Keep idle pooled connections alive.
+        connect_timeout (float): Seconds to wait when opening a connection.
+        read_timeout (float): Seconds to wait for data on an open connection.
+        max_attempts (Optional[int]): Attempts botocore makes per request,
+            retries included, in its "standard" retry mode. None keeps
+            botocore's default retries. ResilientLLM uses 1, as it retries itself.
+
+    Returns:
+        A boto3 "bedrock-runtime" client.
+    """
+    global _session
+    key = (region_name, max_pool_connections, tcp_keepalive, connect_timeout, read_timeout, max_attempts)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            if _session is None:
+                _session = boto3.session.Session()
+            client = _session.client(
+                "bedrock-runtime",
+                region_name=region_name,
+                config=Config(
+                    max_pool_connections=max_pool_connections,
+                    tcp_keepalive=tcp_keepalive,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                    retries=client_retries(max_attempts),
+                ),
+            )
+            _clients[key] = client
+    return client
+
+
+def clear_clients():
+    """Drop every shared client, for example after credentials have changed."""
+    global _session
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _session = None
@@ -0,0 +1,243 @@
+import asyncio
+import copy
+import threading
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+from .cache import request_key
+from .stream_control import StreamCancelled, StreamControl, current_stream_control
+
+
+class _Flight:
+    """A shared upstream call and the chunks it has produced so far."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.result: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        # Closes the upstream stream from a subscriber's thread.
+        self.control = StreamControl()
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class CoalescingLLM(BaseModel):
+    """
+    Wraps an LLM so that identical requests in flight at the same time share
+    a single upstream call ("single flight").
+
+    Requests are identical when model id, system prompt, sampling parameters
+    and messages match (see cache.request_key). For the streaming methods the
+    upstream stream is read by a background worker into a shared buffer; every
+    subscriber receives the same chunk sequence, and late joiners replay the
+    buffered chunks first. The upstream stream is closed if every subscriber
+    goes away. Once a call completes, the next identical request goes upstream
+    again; combine with CachedLLM to also reuse completed responses.
+
+    Attributes:
+        llm: The wrapped ClaudeLLM or MistralLLM.
+        upstream_calls (int): Calls made to the wrapped LLM.
+        coalesced_calls (int): Requests served by joining a call in flight.
+    """
+    llm: Any
+    upstream_calls: int = 0
+    coalesced_calls: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self._acalls: Dict[str, asyncio.Task] = {}
+        self._astreams: Dict[str, _AsyncFlight] = {}
+
+    @property
+    def modelId(self):
+        return self.llm.modelId
+
+    @property
+    def max_tokens(self):
+        return self.llm.max_tokens
+
+    def _join(self, flights: Dict, key: str, factory):
+        """Return (flight, leader) for key, creating the flight if needed. Call with the lock held."""
+        flight = flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = flights[key] = factory()
+            self.upstream_calls += 1
+        else:
+            self.coalesced_calls += 1
+        return flight, leader
+
+    def generate(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        with self._lock:
+            flight, leader = self._join(self._calls, key, _Flight)
+
+        if not leader:
+            with flight.condition:
+                flight.condition.wait_for(lambda: flight.done)
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = self.llm.generate(prompt, system_prompt=system_prompt)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def _pump(self, key: str, flight: _Flight, prompt: Dict, system_prompt: Optional[str]):
+        stream = flight.control.iterate(self.llm.generate_stream_deltas(prompt, system_prompt=system_prompt))
+        try:
+            for chunk in stream:
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            stream.close()
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def generate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        with self._lock:
+            flight, leader = self._join(self._streams, key, _Flight)
+            flight.subscribers += 1
+        if leader:
+            threading.Thread(
+                target=self._pump, args=(key, flight, prompt, system_prompt), daemon=True
+            ).start()
+        # The caller's control cannot reach the pump thread; its cancel wakes
+        # this subscriber, and the last subscriber to leave closes upstream.
+        outer = current_stream_control()
+        if outer is not None:
+            outer.attach(flight.wake)
+
+        index = 0
+        try:
+            while True:
+                with flight.condition:
+                    flight.condition.wait_for(
+                        lambda: index < len(flight.chunks) or flight.done or (outer is not None and outer.cancelled)
+                    )
+                    pending = flight.chunks[index:]
+                    done = flight.done
+                if outer is not None and outer.cancelled:
+                    raise StreamCancelled(outer.stop_reason)
+                for chunk in pending:
+                    index += 1
+                    yield chunk
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.done
+                if abandoned and self._streams.get(key) is flight:
+                    # Everyone left. Stop taking new subscribers and close upstream.
+                    del self._streams[key]
+            if abandoned:
+                flight.control.cancel("abandoned")
+
+    def generate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        for chunk in self.generate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+
+    async def agenerate(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        task, leader = self._join(
+            self._acalls, key,
+            lambda: asyncio.ensure_future(self.llm.agenerate(prompt, system_prompt=system_prompt)),
+        )
+        if leader:
+            task.add_done_callback(lambda _: self._acalls.pop(key, None))
+        # Shield the shared call so one caller being cancelled does not cancel it for the others.
+        result = await asyncio.shield(task)
+        return result if leader else copy.deepcopy(result)
+
+    async def _apump(self, key: str, flight: _AsyncFlight, prompt: Dict, system_prompt: Optional[str]):
+        try:
+            async for chunk in self.llm.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+                flight.chunks.append(chunk)
+                flight.notify()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            if self._astreams.get(key) is flight:
+                del self._astreams[key]
+            flight.done = True
+            flight.notify()
+
+    async def agenerate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        key = request_key(self.llm, prompt, system_prompt)
+        flight, leader = self._join(self._astreams, key, _AsyncFlight)
+        flight.subscribers += 1
+        if leader:
+            flight.task = asyncio.ensure_future(self._apump(key, flight, prompt, system_prompt))
+
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    index += 1
+                    yield flight.chunks[index - 1]
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Everyone left. Stop taking new subscribers and close upstream.
+                if self._astreams.get(key) is flight:
+                    del self._astreams[key]
+                flight.task.cancel()
+
+    async def agenerate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        async for chunk in self.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
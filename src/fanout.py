@@ -0,0 +1,204 @@
+import asyncio
+import queue
+import threading
+import time
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+
+from .chat import Chat
+from .messages import Messages
+from .stream_control import StreamControl
+
+_DONE = object()
+
+
+class FanOutTiming(BaseModel):
+    """
+    How one backend served the last fan-out turn. Times are measured from the
+    start of the turn.
+
+    Attributes:
+        backend (str): Name of the backend.
+        model_id (Optional[str]): The backend LLM's model id.
+        ttfc_seconds (Optional[float]): Time to the first text chunk.
+        total_seconds (Optional[float]): Time to the end of the response.
+        chunks (int): Text chunks received.
+        stop_reason (Optional[str]): Why the stream ended, see StreamControl.
+        error (Optional[str]): The error that ended the backend's turn, if any.
+    """
+    backend: str
+    model_id: Optional[str] = None
+    ttfc_seconds: Optional[float] = None
+    total_seconds: Optional[float] = None
+    chunks: int = 0
+    stop_reason: Optional[str] = None
+    error: Optional[str] = None
+
+    class Config:
+        protected_namespaces = ()
+
+
+class FanOutChat(BaseModel):
+    """
+    Sends each prompt to several LLMs at once, for comparing models on the
+    same conversation, for example Claude 3 Sonnet, Claude 3 Haiku and
+    Mistral Large side by side.
+
+    Every backend has its own Chat, so its history holds its own responses.
+    The streams run concurrently and their chunks are yielded in arrival
+    order, tagged with the backend's name, so a turn takes as long as the
+    slowest model. A backend that fails is recorded in `timings` and does not
+    stop the others. Create one with Chat.fan_out or from_llms.
+
+    Attributes:
+        chats (Dict[str, Chat]): The Chat of each backend, by name.
+        timings (Dict[str, FanOutTiming]): Per-backend timings of the last turn.
+        close_timeout (float): Seconds closing a stream early waits for the
+            cancelled backends to finish their turn.
+    """
+    chats: Dict[str, Chat]
+    timings: Dict[str, FanOutTiming] = {}
+    close_timeout: float = 5.0
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._controls: Dict[str, StreamControl] = {}
+
+    @classmethod
+    def from_llms(cls, llms: Dict[str, Any], system_prompt: Optional[str] = None, messages: Optional[Messages] = None, **chat_fields) -> "FanOutChat":
+        """
+        Parameters:
+            llms (Dict[str, Any]): The LLM of each backend, by name.
+            system_prompt (Optional[str]): System prompt of every backend.
+            messages (Optional[Messages]): History each backend starts from.
+                Each gets its own copy.
+            **chat_fields: Other Chat settings, such as context_budget.
+        """
+        chats = {
+            name: Chat(
+                llm=llm,
+                system_prompt=system_prompt,
+                messages=Messages(messages=list(messages.messages) if messages is not None else []),
+                **chat_fields,
+            )
+            for name, llm in llms.items()
+        }
+        return cls(chats=chats)
+
+    def cancel(self, backend: Optional[str] = None):
+        """Stop the turn in progress for one backend, or for all of them. Safe to call from any thread."""
+        for name, control in list(self._controls.items()):
+            if backend is None or name == backend:
+                control.cancel()
+
+    def _start_turn(self) -> float:
+        self._controls = {name: StreamControl() for name in self.chats}
+        self.timings = {
+            name: FanOutTiming(backend=name, model_id=getattr(chat.llm, "modelId", None))
+            for name, chat in self.chats.items()
+        }
+        return time.perf_counter()
+
+    def _chunk(self, name: str, chunk: str, start: float):
+        timing = self.timings[name]
+        if timing.ttfc_seconds is None and chunk:
+            timing.ttfc_seconds = time.perf_counter() - start
+        timing.chunks += 1
+
+    def _finish(self, name: str, start: float, error: Optional[Exception] = None):
+        timing = self.timings[name]
+        timing.total_seconds = time.perf_counter() - start
+        timing.stop_reason = self._controls[name].stop_reason
+        if error is not None:
+            print(f"Backend {name} failed: {error}")
+            timing.error = str(error)
+
+    def generate_stream(self, prompt):
+        """
+        Stream the responses of every backend to a prompt.
+
+        Each backend streams in its own thread. Closing the generator early
+        cancels the backends still streaming, which closes their response
+        streams, and waits up to `close_timeout` for their threads. A backend
+        that has not even received its response by then, for example one
+        stuck connecting, finishes its turn in the background.
+
+        Parameters:
+            prompt: The user message.
+
+        Yields:
+            Tuple[str, str]: The backend's name and a text delta, in arrival order.
+        """
+        start = self._start_turn()
+        events = queue.Queue()
+
+        def run(name: str, chat: Chat):
+            error = None
+            try:
+                for chunk in chat.generate_stream(prompt, control=self._controls[name]):
+                    self._chunk(name, chunk, start)
+                    events.put((name, chunk))
+            except Exception as e:
+                error = e
+            finally:
+                self._finish(name, start, error)
+                events.put((name, _DONE))
+
+        threads = [threading.Thread(target=run, args=item, daemon=True) for item in self.chats.items()]
+        for thread in threads:
+            thread.start()
+        remaining = len(threads)
+        try:
+            while remaining:
+                name, chunk = events.get()
+                if chunk is _DONE:
+                    remaining -= 1
+                    continue
+                yield name, chunk
+        finally:
+            if remaining:
+                for control in self._controls.values():
+                    control.cancel("abandoned")
+            deadline = time.monotonic() + self.close_timeout
+            for thread in threads:
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+    async def agenerate_stream(self, prompt):
+        """
+        Stream the responses of every backend on the running event loop. See
+        generate_stream; backends that have not finished `close_timeout`
+        seconds after an early close are cancelled.
+        """
+        start = self._start_turn()
+        events = asyncio.Queue()
+
+        async def run(name: str, chat: Chat):
+            error = None
+            try:
+                async for chunk in chat.agenerate_stream(prompt, control=self._controls[name]):
+                    self._chunk(name, chunk, start)
+                    events.put_nowait((name, chunk))
+            except Exception as e:
+                error = e
+            finally:
+                self._finish(name, start, error)
+                events.put_nowait((name, _DONE))
+
+        tasks = [asyncio.create_task(run(name, chat)) for name, chat in self.chats.items()]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                name, chunk = await events.get()
+                if chunk is _DONE:
+                    remaining -= 1
+                    continue
+                yield name, chunk
+        finally:
+            if remaining:
+                for control in self._controls.values():
+                    control.cancel("abandoned")
+            if tasks:
+                _, late = await asyncio.wait(tasks, timeout=self.close_timeout)
+                for task in late:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
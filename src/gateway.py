@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from pydantic import BaseModel
+from typing import Any, Callable, Dict, Optional
+from pydantic import ValidationError
+from urllib.parse import unquote
+
+from .messages import Message
+from .stream_control import StreamControl
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class _Scheduler:
+    """
+    At most `limit` generations at a time; the others wait in arrival order.
+    A released slot is handed straight to the longest waiting request, so a
+    new request cannot overtake it. With one request per session at a time,
+    sessions are served round robin.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = deque()
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait was cancelled.
+                self.release()
+            elif future in self.waiting:
+                self.waiting.remove(future)
+            raise
+
+    def release(self):
+        while self.waiting:
+            future = self.waiting.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class _Session:
+    def __init__(self, chat):
+        self.chat = chat
+        self.control: Optional[StreamControl] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.control is not None
+
+
+class ChatGateway(BaseModel):
+    """
+    Serves Chat sessions over HTTP from one asyncio process, streaming
+    responses as server-sent events. Needs no web framework.
+
+    Endpoints, with the session id in the path:
+
+        POST   /sessions/{id}/messages  {"prompt": "..."} or {"message": {...}};
+                                        streams "chunk" events of {"text": ...},
+                                        then "done" with the stop reason, or "error"
+        POST   /sessions/{id}/cancel    stop the generation in progress
+        GET    /sessions/{id}           the history, as {"messages": [...]}
+        DELETE /sessions/{id}           clear the history
+        GET    /stats                   counters, and the process CPU time
+
+    A session has at most one generation in progress; another prompt gets a
+    409. At most `max_concurrent` generations stream at a time and the others
+    wait in arrival order, up to `max_queued` before new ones get a 503.
+
+    Chunks are written as they arrive and the next one is only read from the
+    model once the client has taken the previous ones, so a slow client is
+    never buffered for beyond the socket's write buffer. A client that stops
+    reading for `write_timeout` seconds, or disconnects, has its generation
+    cancelled and its slot released, keeping the text streamed so far. A
+    client that disconnects while queued is dropped from the queue.
+
+    Sessions are created by `chat_factory`, given the session id; open the
+    history from a SessionStore there to persist them. The least recently
+    used idle sessions beyond `max_sessions` are dropped.
+
+    Attributes:
+        chat_factory (Callable[[str], Chat]): Creates the Chat of a new session.
+        max_concurrent (int): Generations streaming at once.
+        max_queued (int): Generations waiting for a slot before new ones are refused.
+        max_sessions (int): Sessions kept in memory.
+        write_timeout (float): Seconds a client may stop reading before its
+            generation is cancelled.
+        write_buffer_bytes (int): Bytes buffered per connection before writing
+            waits for the client.
+        max_body_bytes (int): Largest request body accepted.
+    """
+    chat_factory: Callable[[str], Any]
+    max_concurrent: int = 256
+    max_queued: int = 4096
+    max_sessions: int = 10000
+    write_timeout: float = 30.0
+    write_buffer_bytes: int = 64 * 1024
+    max_body_bytes: int = 16 * 1024 * 1024
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._scheduler = _Scheduler(self.max_concurrent)
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._counters = {"streams_completed": 0, "streams_cancelled": 0, "streams_failed": 0, "chunks_sent": 0, "rejected": 0}
+        self._started = time.monotonic()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """Start listening. Serve with `await server.serve_forever()`."""
+        return await asyncio.start_server(self._handle, host, port, backlog=1024)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "sessions": len(self._sessions),
+            "streaming": self._scheduler.active,
+            "queued": len(self._scheduler.waiting),
+            "uptime_seconds": time.monotonic() - self._started,
+            "cpu_seconds": time.process_time(),
+        }
+
+    def _session(self, session_id: str) -> _Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session(self.chat_factory(session_id))
+            excess = len(self._sessions) - self.max_sessions
+            if excess > 0:
+                idle = []
+                for key, other in self._sessions.items():
+                    if len(idle) == excess:
+                        break
+                    if not other.busy:
+                        idle.append(key)
+                for key in idle:
+                    del self._sessions[key]
+        else:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    # HTTP.
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_bytes)
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), self.write_timeout)
+            if request is None:
+                return
+            if isinstance(request, int):
+                await self._respond(writer, request, {"error": _REASONS[request]})
+                return
+            await self._route(reader, writer, *request)
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Gateway error: {e}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            return 400
+        if length > self.max_body_bytes:
+            return 413
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], body
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Any):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+    async def _route(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str, body: bytes):
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if parts == ["stats"] and method == "GET":
+            return await self._respond(writer, 200, self.stats())
+        if len(parts) not in (2, 3) or parts[0] != "sessions" or not parts[1]:
+            return await self._respond(writer, 404, {"error": "Not found"})
+        session_id, action = parts[1], parts[2] if len(parts) == 3 else None
+
+        if action is None and method == "GET":
+            session = self._session(session_id)
+            return await self._respond(writer, 200, {"messages": [m.to_dict() for m in session.chat.messages.messages]})
+        if action is None and method == "DELETE":
+            session = self._session(session_id)
+            if session.busy:
+                return await self._respond(writer, 409, {"error": "A generation is in progress"})
+            session.chat.reset()
+            return await self._respond(writer, 200, {"messages": []})
+        if action == "cancel" and method == "POST":
+            session = self._sessions.get(session_id)
+            cancelled = session is not None and session.busy
+            if cancelled:
+                session.control.cancel()
+            return await self._respond(writer, 200, {"cancelled": cancelled})
+        if action == "messages" and method == "POST":
+            return await self._generate(reader, writer, session_id, body)
+        return await self._respond(writer, 405 if action in (None, "cancel", "messages") else 404, {"error": "Not allowed"})
+
+    # Generation.
+
+    async def _generate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, session_id: str, body: bytes):
+        try:
+            request = json.loads(body or b"{}")
+            prompt = request.get("message") or request["prompt"]
+        except (ValueError, KeyError, AttributeError):
+            return await self._respond(writer, 400, {"error": 'Expected {"prompt": "..."} or {"message": {...}}'})
+        if not isinstance(prompt, (str, dict)):
+            return await self._respond(writer, 400, {"error": "The prompt must be a string or a message"})
+        if isinstance(prompt, dict):
+            try:
+                message = Message(**prompt)
+            except ValidationError as e:
+                return await self._respond(writer, 400, {"error": f"Invalid message: {e}"})
+            if message.role != "user":
+                return await self._respond(writer, 400, {"error": 'The message role must be "user"'})
+
+        session = self._session(session_id)
+        if session.busy:
+            self._counters["rejected"] += 1
+            return await self._respond(writer, 409, {"error": "A generation is in progress"})
+        if len(self._scheduler.waiting) >= self.max_queued:
+            self._counters["rejected"] += 1
+            return await self._respond(writer, 503, {"error": "Too many requests, please try again later"})
+
+        control = session.control = StreamControl()
+        disconnected = asyncio.ensure_future(self._disconnected(reader))
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+            if not await self._acquire(disconnected):
+                self._counters["streams_cancelled"] += 1
+                return
+            try:
+                disconnected.add_done_callback(lambda task: task.cancelled() or control.cancel("abandoned"))
+                await self._stream(writer, session, control, prompt, disconnected)
+            finally:
+                self._scheduler.release()
+        finally:
+            disconnected.cancel()
+            session.control = None
+
+    async def _disconnected(self, reader: asyncio.StreamReader):
+        """Returns once the client has closed the connection."""
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+
+    async def _acquire(self, disconnected: asyncio.Future) -> bool:
+        """Wait for a slot, unless the client disconnects first. Returns True once the slot is held."""
+        acquired = asyncio.ensure_future(self._scheduler.acquire())
+        held = False
+        try:
+            await asyncio.wait((acquired, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            held = acquired.done() and not disconnected.done()
+            return held
+        finally:
+            if not acquired.done():
+                # The scheduler gives the slot back if it is handed over meanwhile.
+                acquired.cancel()
+            elif not held and not acquired.cancelled():
+                self._scheduler.release()
+
+    async def _stream(self, writer: asyncio.StreamWriter, session: _Session, control: StreamControl, prompt, disconnected: asyncio.Future):
+        stream = session.chat.agenerate_stream(prompt, control=control)
+        event, payload = "done", None
+        try:
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                writer.write(b"event: chunk\ndata: " + json.dumps({"text": chunk}).encode() + b"\n\n")
+                self._counters["chunks_sent"] += 1
+                # Waits only while the socket's write buffer is full.
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            control.cancel("abandoned")
+            event = None
+        except Exception as e:
+            print(f"Generation failed: {e}")
+            event, payload = "error", {"error": str(e)}
+        finally:
+            await stream.aclose()
+
+        if event is None or control.interrupted:
+            self._counters["streams_cancelled"] += 1
+        elif event == "error":
+            self._counters["streams_failed"] += 1
+        else:
+            self._counters["streams_completed"] += 1
+        if event is not None and not disconnected.done():
+            writer.write(f"event: {event}\ndata: {json.dumps(payload or {'stop_reason': control.stop_reason})}\n\n".encode())
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Chat sessions over HTTP with server-sent events.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", choices=["claude", "mistral"], default="claude")
+    parser.add_argument("--system-prompt", default="Talk like a pirate.")
+    parser.add_argument("--max-concurrent", type=int, default=256)
+    parser.add_argument("--stub", action="store_true", help="Serve from StubBedrockRuntime, for load testing without AWS.")
+    parser.add_argument("--stub-first-chunk-latency", type=float, default=0.3)
+    parser.add_argument("--stub-chunk-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    from .chat import Chat
+    if args.model == "claude":
+        from .llm_bedrock_claude import ClaudeLLM
+        llm = ClaudeLLM()
+    else:
+        from .llm_bedrock_mistral import MistralLLM
+        llm = MistralLLM()
+    if args.stub:
+        from .stub_runtime import StubBedrockRuntime
+        runtime = StubBedrockRuntime(
+            text="Arr, matey! Here be the treasure ye seek, buried under the old oak tree. " * 3,
+            chunk_size=4,
+            first_chunk_latency=args.stub_first_chunk_latency,
+            chunk_latency=args.stub_chunk_latency,
+        )
+        llm.bedrock_runtime = runtime
+        llm.async_transport = runtime.as_async_transport()
+
+    gateway = ChatGateway(
+        chat_factory=lambda session_id: Chat(llm=llm, system_prompt=args.system_prompt),
+        max_concurrent=args.max_concurrent,
+    )
+
+    async def serve():
+        server = await gateway.start(args.host, args.port)
+        print(f"Serving on http://{args.host}:{args.port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
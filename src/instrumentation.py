@@ -0,0 +1,127 @@
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+# Metrics emitted by the LLM classes and Chat. Values are in seconds, bytes
+# or tokens as the name says; every metric carries a "model_id" attribute.
+#
+#   request_build_seconds     building the request, prompt rendering included
+#   prompt_render_seconds     rendering the Mistral prompt template
+#   request_body_bytes        size of the request body
+#   upstream_ttfb_seconds     sending the request until the response starts
+#   ttfc_seconds              sending the request until the first text chunk
+#   inter_chunk_gap_seconds   time between consecutive text chunks
+#   response_seconds          sending the request until the response is complete
+#   input_tokens              input tokens reported by the model, those read
+#                             from or written to the prompt cache excluded
+#   cache_read_input_tokens   input tokens read from the prompt cache (Claude)
+#   cache_creation_input_tokens  input tokens written to the prompt cache (Claude)
+#   output_tokens             output tokens reported by the model
+#   post_process_seconds      writing the response to the history (Chat)
+
+
+class Instrumentation:
+    """
+    Receives the metrics emitted while serving requests. The LLM classes and
+    Chat hold None by default and skip all timing in that case, so the
+    default costs nothing; assign an instance to `llm.instrumentation` or
+    `chat.instrumentation` to collect metrics.
+
+    Subclasses implement `emit`. This base class discards everything.
+    """
+
+    def emit(self, name: str, value: float, **attributes):
+        pass
+
+
+class HistogramInstrumentation(Instrumentation):
+    """
+    Keeps an in-process distribution of each metric, split by model id.
+
+    Attributes:
+        max_samples (int): Most recent samples kept per metric for percentiles.
+    """
+
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max_samples
+        self._series: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, name: str, value: float, **attributes):
+        key = (name, attributes.get("model_id"))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"count": 0, "sum": 0.0, "samples": deque(maxlen=self.max_samples)}
+            series["count"] += 1
+            series["sum"] += value
+            series["samples"].append(value)
+
+    def percentile(self, name: str, q: float, model_id: Optional[str] = None) -> Optional[float]:
+        """The q-th percentile (0-100) of a metric's recent samples, or None without samples."""
+        with self._lock:
+            samples = sorted(
+                value
+                for (metric, model), series in self._series.items()
+                if metric == name and (model_id is None or model == model_id)
+                for value in series["samples"]
+            )
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(q / 100 * len(samples)) - 1))]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean, p50, p95, p99 and max of every metric, keyed by "name[model_id]"."""
+        with self._lock:
+            series = {key: (s["count"], s["sum"], sorted(s["samples"])) for key, s in self._series.items()}
+
+        def pick(samples, q):
+            return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+        return {
+            f"{name}[{model_id}]": {
+                "count": count,
+                "mean": total / count,
+                "p50": pick(samples, 0.50),
+                "p95": pick(samples, 0.95),
+                "p99": pick(samples, 0.99),
+                "max": samples[-1],
+            }
+            for (name, model_id), (count, total, samples) in sorted(series.items(), key=str)
+        }
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Records every metric on an OpenTelemetry histogram of the same name,
+    prefixed with `prefix`. Needs the opentelemetry-api package; exporting is
+    configured through the usual OpenTelemetry SDK setup.
+
+    Attributes:
+        meter: The OpenTelemetry meter to use. Defaults to the global meter
+            provider's meter for this package.
+        prefix (str): Prefix added to every instrument name.
+    """
+
+    def __init__(self, meter=None, prefix: str = "bedrock_chat."):
+        if meter is None:
+            from opentelemetry import metrics
+            meter = metrics.get_meter("amazon-bedrock-chat")
+        self.meter = meter
+        self.prefix = prefix
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def emit(self, name: str, value: float, **attributes):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = self.meter.create_histogram(self.prefix + name)
+        histogram.record(value, attributes=attributes)
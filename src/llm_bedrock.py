@@ -0,0 +1,405 @@
+import json
+import time
+from botocore.exceptions import ClientError
+from pydantic import BaseModel
+from typing import ClassVar, Dict, Optional
+
+from .clients import get_bedrock_runtime
+from .instrumentation import Instrumentation
+from .stream_control import StreamCancelled, current_stream_control
+from .stream_decoder import DeltaFrame, StreamDecoder, default_stream_decoder
+from .transport import AsyncTransport, default_transport
+
+
+class _RequestTimer:
+    """Times the stages of one request and emits them to an Instrumentation."""
+
+    def __init__(self, instrumentation: Instrumentation, model_id: str):
+        self.instrumentation = instrumentation
+        self.attributes = {"model_id": model_id}
+        self.start = time.perf_counter()
+        self.sent = self.start
+        self.last_chunk = None
+
+    def emit(self, name: str, value: float):
+        self.instrumentation.emit(name, value, **self.attributes)
+
+    def request_built(self, kwargs: Dict):
+        self.sent = time.perf_counter()
+        self.emit("request_build_seconds", self.sent - self.start)
+        self.emit("request_body_bytes", len(kwargs["body"]))
+
+    def first_byte(self):
+        self.emit("upstream_ttfb_seconds", time.perf_counter() - self.sent)
+
+    def chunk(self):
+        now = time.perf_counter()
+        if self.last_chunk is None:
+            self.emit("ttfc_seconds", now - self.sent)
+        else:
+            self.emit("inter_chunk_gap_seconds", now - self.last_chunk)
+        self.last_chunk = now
+
+    def usage(self, usage: Dict[str, int]):
+        for name, value in usage.items():
+            self.emit(name, value)
+
+    def done(self):
+        self.emit("response_seconds", time.perf_counter() - self.sent)
+
+class BedrockLLM(BaseModel):
+    """
+    Base class for the Bedrock hosted LLMs. Holds the Bedrock Runtime client
+    and the request/response loop shared by every model family. Subclasses
+    describe how to build a request body and how to read the model's responses.
+
+    Attributes:
+        region_name (str): AWS region where the Bedrock Runtime is available.
+        content_type (str): Content type for the request, typically "application/json".
+        accept_type (str): Expected content type of the response, typically "application/json".
+        max_tokens (int): Maximum number of tokens to generate in the response.
+        max_pool_connections (int): Connection pool size of the shared Bedrock Runtime client.
+        tcp_keepalive (bool): Keep idle pooled connections alive between requests.
+        client_max_attempts (Optional[int]): Attempts the client makes per
+            request, retries included. None keeps botocore's default retries.
+            ResilientLLM sets 1, as it retries itself.
+
+    Methods:
+        generate(prompt, system_prompt=None): Generate response synchronously.
+        generate_stream(prompt, system_prompt=None): Stream response, yielding chunks and the cumulative message.
+        generate_stream_deltas(prompt, system_prompt=None): Stream response, yielding text chunks only.
+        agenerate, agenerate_stream, agenerate_stream_deltas: asyncio counterparts of the above.
+
+    Assign an Instrumentation to `instrumentation` to receive request timings
+    and token usage, see src/instrumentation.py. Stream events are decoded
+    by `stream_decoder`, see src/stream_decoder.py.
+    """
+    region_name: str = "us-west-2"
+    content_type: str = "application/json"
+    accept_type: str = "application/json"
+    max_tokens: int = 1000
+    max_pool_connections: int = 50
+    tcp_keepalive: bool = True
+    client_max_attempts: Optional[int] = None
+
+    # Bytes around the text of a plain text delta event, for the stream
+    # decoder's fast path. None decodes every event in full.
+    _delta_frame: ClassVar[Optional[DeltaFrame]] = None
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._bedrock_runtime = None
+        self._async_transport = None
+        self._instrumentation = None
+        self._stream_decoder = None
+
+    @property
+    def bedrock_runtime(self):
+        """
+        Provides access to the Bedrock Runtime client. The client is shared
+        process-wide with every other LLM using the same region and connection
+        settings, so creating an LLM instance is cheap.
+        """
+        if self._bedrock_runtime is None:
+            self._bedrock_runtime = get_bedrock_runtime(
+                self.region_name,
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=self.tcp_keepalive,
+                max_attempts=self.client_max_attempts,
+            )
+        return self._bedrock_runtime
+
+    @bedrock_runtime.setter
+    def bedrock_runtime(self, client):
+        self._bedrock_runtime = client
+
+    @property
+    def async_transport(self) -> AsyncTransport:
+        """The transport used by the async methods. Assign to plug in another transport or a stub."""
+        if self._async_transport is None:
+            self._async_transport = default_transport(
+                self.region_name,
+                self.bedrock_runtime,
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=self.tcp_keepalive,
+                max_attempts=self.client_max_attempts,
+            )
+        return self._async_transport
+
+    @async_transport.setter
+    def async_transport(self, transport: AsyncTransport):
+        self._async_transport = transport
+
+    @property
+    def instrumentation(self) -> Optional[Instrumentation]:
+        """Receives request metrics. None, the default, skips all timing."""
+        return self._instrumentation
+
+    @instrumentation.setter
+    def instrumentation(self, instrumentation: Optional[Instrumentation]):
+        self._instrumentation = instrumentation
+
+    @property
+    def stream_decoder(self) -> StreamDecoder:
+        """Decodes the response stream events. Defaults to a shared FastStreamDecoder."""
+        if self._stream_decoder is None:
+            self._stream_decoder = default_stream_decoder()
+        return self._stream_decoder
+
+    @stream_decoder.setter
+    def stream_decoder(self, decoder: StreamDecoder):
+        self._stream_decoder = decoder
+
+    def _timer(self) -> Optional[_RequestTimer]:
+        if self._instrumentation is None:
+            return None
+        return _RequestTimer(self._instrumentation, self.modelId)
+
+    def _prepare_request(self, prompt: Dict, system_prompt: Optional[str] = None) -> Dict:
+        """
+        Build the keyword arguments for invoke_model from a prompt.
+
+        Parameters:
+            prompt (Dict): The input prompt for the model.
+            system_prompt (Optional[str]): An optional system-level prompt to prepend.
+
+        Returns:
+            Dict: A dictionary of keyword arguments ready for the API call.
+        """
+        raise NotImplementedError
+
+    def _parse_response(self, body: Dict) -> Dict:
+        """
+        Convert a decoded invoke_model response body into a message.
+
+        Returns:
+            Dict: A dictionary with the 'role' and 'content' of the generated response.
+        """
+        raise NotImplementedError
+
+    def _parse_stream_event(self, event_data: Dict) -> Optional[str]:
+        """
+        Extract the text from a decoded stream event.
+
+        Returns:
+            Optional[str]: The text chunk, or None for events that carry no text.
+        """
+        raise NotImplementedError
+
+    def _parse_usage(self, data: Dict) -> Optional[Dict[str, int]]:
+        """
+        Extract token usage from a decoded response body or stream event.
+        Bedrock appends invocation metrics to the last event of a stream.
+
+        Returns:
+            Optional[Dict[str, int]]: "input_tokens" and/or "output_tokens", or None.
+        """
+        metrics = data.get("amazon-bedrock-invocationMetrics")
+        if metrics is None:
+            return None
+        return {"input_tokens": metrics.get("inputTokenCount", 0), "output_tokens": metrics.get("outputTokenCount", 0)}
+
+    def _handle_event(self, event: Dict, timer: Optional[_RequestTimer], decoder: StreamDecoder) -> Optional[str]:
+        payload = event["chunk"]["bytes"]
+        chunk = decoder.delta_text(payload, self._delta_frame)
+        if chunk is not None:
+            if timer is not None and chunk:
+                timer.chunk()
+            return chunk
+        event_data = decoder.loads(payload)
+        chunk = self._parse_stream_event(event_data)
+        if timer is not None:
+            if chunk:
+                timer.chunk()
+            usage = self._parse_usage(event_data)
+            if usage:
+                timer.usage(usage)
+        return chunk
+
+    def generate(self, prompt: Dict, system_prompt: str = None):
+        """
+        Generate a response synchronously based on the given prompt.
+
+        Parameters:
+            prompt (Dict): The input prompt for the model.
+            system_prompt (str, optional): An optional system-level prompt to prepend.
+
+        Returns:
+            Dict: A dictionary with the 'role' and 'content' of the generated response.
+        """
+        timer = self._timer()
+        kwargs = self._prepare_request(prompt, system_prompt)
+        if timer is not None:
+            timer.request_built(kwargs)
+        response = self.bedrock_runtime.invoke_model(**kwargs)
+        body = json.loads(response.get("body").read())
+        if timer is not None:
+            timer.done()
+            timer.usage(self._parse_usage(body) or {})
+        return self._parse_response(body)
+
+    def stream_response_deltas(self, response, timer: Optional[_RequestTimer] = None):
+        """
+        Stream the text deltas from the response body.
+
+        Parameters:
+            response: The response object from an asynchronous invocation.
+
+        Yields:
+            str: Each text chunk as it arrives.
+
+        Raises:
+            StreamCancelled: The StreamControl of the stream closed the body.
+        """
+        body = response.get("body")
+        decoder = self.stream_decoder
+        control = current_stream_control()
+        try:
+            for event in body:
+                chunk = self._handle_event(event, timer, decoder)
+                if chunk is not None:
+                    yield chunk
+        except json.JSONDecodeError as e:
+            print("\nError decoding JSON from response chunk:", e)
+            raise
+        except Exception as e:
+            # Reading a body closed under us may fail rather than just end.
+            if control is not None and control.cancelled:
+                raise StreamCancelled(control.stop_reason) from e
+            raise
+        finally:
+            # Close the connection if the stream is abandoned, so the model
+            # stops generating rather than running to completion unread.
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+        if control is not None and control.cancelled:
+            raise StreamCancelled(control.stop_reason)
+        if timer is not None:
+            timer.done()
+
+    def stream_response_chunks(self, response, timer: Optional[_RequestTimer] = None):
+        """
+        Stream chunks from the response body and process each chunk.
+
+        Parameters:
+            response: The response object from an asynchronous invocation.
+
+        Yields:
+            Tuple[str, Dict]: Each yield provides a chunk of text and the cumulative message content.
+        """
+        chunks = []
+        for chunk in self.stream_response_deltas(response, timer):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+
+    def _invoke_stream(self, prompt: Dict, system_prompt: Optional[str], timer: Optional[_RequestTimer]):
+        kwargs = self._prepare_request(prompt, system_prompt)
+        if timer is not None:
+            timer.request_built(kwargs)
+        response = self.bedrock_runtime.invoke_model_with_response_stream(**kwargs)
+        if timer is not None:
+            timer.first_byte()
+        control = current_stream_control()
+        if control is not None:
+            control.attach(getattr(response.get("body"), "close", None))
+        return response
+
+    def generate_stream(self, prompt: Dict, system_prompt: str = None):
+        """
+        Invoke the model with the given prompt and stream the response asynchronously.
+
+        Parameters:
+            prompt (Dict): The input prompt for the model.
+            system_prompt (str, optional): An optional system-level prompt to prepend.
+
+        Yields:
+            The streaming response, chunk by chunk.
+        """
+        try:
+            timer = self._timer()
+            response = self._invoke_stream(prompt, system_prompt, timer)
+            yield from self.stream_response_chunks(response, timer)
+        except ClientError as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    def generate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        """
+        Invoke the model with the given prompt and stream only the text deltas.
+
+        Unlike generate_stream, no cumulative message is built per chunk, so the
+        cost of each chunk does not grow with the length of the response.
+
+        Parameters:
+            prompt (Dict): The input prompt for the model.
+            system_prompt (str, optional): An optional system-level prompt to prepend.
+
+        Yields:
+            str: The streaming response, chunk by chunk.
+        """
+        try:
+            timer = self._timer()
+            response = self._invoke_stream(prompt, system_prompt, timer)
+            yield from self.stream_response_deltas(response, timer)
+        except ClientError as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    async def agenerate(self, prompt: Dict, system_prompt: str = None):
+        """
+        Generate a response on the running event loop. See generate.
+        """
+        timer = self._timer()
+        kwargs = self._prepare_request(prompt, system_prompt)
+        if timer is not None:
+            timer.request_built(kwargs)
+        body = json.loads(await self.async_transport.invoke_model(**kwargs))
+        if timer is not None:
+            timer.done()
+            timer.usage(self._parse_usage(body) or {})
+        return self._parse_response(body)
+
+    async def agenerate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        """
+        Stream the text deltas on the running event loop. See generate_stream_deltas.
+        """
+        try:
+            timer = self._timer()
+            kwargs = self._prepare_request(prompt, system_prompt)
+            if timer is not None:
+                timer.request_built(kwargs)
+            first = True
+            decoder = self.stream_decoder
+            control = current_stream_control()
+            events = self.async_transport.invoke_model_with_response_stream(**kwargs)
+            try:
+                async for event in events:
+                    if first and timer is not None:
+                        timer.first_byte()
+                    first = False
+                    chunk = self._handle_event(event, timer, decoder)
+                    if chunk is not None:
+                        yield chunk
+            finally:
+                # Close the upstream stream now rather than when it is garbage collected.
+                await events.aclose()
+            if control is not None and control.cancelled:
+                raise StreamCancelled(control.stop_reason)
+            if timer is not None:
+                timer.done()
+        except json.JSONDecodeError as e:
+            print("\nError decoding JSON from response chunk:", e)
+            raise
+        except ClientError as e:
+            print(f"An error occurred: {e}")
+            raise
+
+    async def agenerate_stream(self, prompt: Dict, system_prompt: str = None):
+        """
+        Stream the response on the running event loop. See generate_stream.
+        """
+        chunks = []
+        async for chunk in self.agenerate_stream_deltas(prompt, system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
@@ -1,26 +1,55 @@
-import boto3
 import json
-from botocore.exceptions import ClientError
-from pydantic import BaseModel
-from typing import Literal, Dict, Optional
+from pydantic import validator
+from typing import Literal, Dict, List, Optional
 
-class ClaudeLLM(BaseModel):
+from .llm_bedrock import BedrockLLM
+
+# Models that accept cache_control breakpoints on Bedrock. The others reject
+# a request that has them.
+PROMPT_CACHING_MODELS = frozenset((
+    "anthropic.claude-3-5-haiku-20241022-v1:0",
+    "us.anthropic.claude-3-5-haiku-20241022-v1:0",
+    "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
+))
+
+CACHE_CONTROL = {"type": "ephemeral"}
+# Largest number of cache_control breakpoints Bedrock accepts in one request.
+MAX_CACHE_BREAKPOINTS = 4
+_CACHE_CONTROL_JSON = ", \"cache_control\": " + json.dumps(CACHE_CONTROL)
+
+class ClaudeLLM(BedrockLLM):
     """
     A class representing Claude Language Models, facilitating synchronous and
     asynchronous interactions with various versions of the Claude LLM via the 
     AWS Bedrock Runtime.
 
     Attributes:
-        modelId (Literal): Identifier for the specific Claude model version.
+        modelId (Literal): Identifier for the specific Claude model version,
+            or the cross-region inference profile of models that are only
+            invoked through one, such as Claude 3.7 Sonnet.
         region_name (str): AWS region where the Bedrock Runtime is available.
         content_type (str): Content type for the request, typically "application/json".
         accept_type (str): Expected content type of the response, typically "application/json".
         anthropic_version (str): Version of the Anthropic API being used.
         max_tokens (int): Maximum number of tokens to generate in the response.
+        prompt_caching (Literal): Mark cacheable prefixes of the request with
+            cache_control breakpoints. Only for the models that support prompt
+            caching, see PROMPT_CACHING_MODELS; other models raise a
+            ValidationError unless it is "off".
+            "system" caches the system prompt. "auto" also caches the history:
+            a breakpoint after the last message before each of the newest
+            `cache_history_breakpoints` user turns, so every request writes
+            its history to the cache and reads what the previous turn wrote.
+            "off", the default, sends the request unchanged.
+        cache_history_breakpoints (int): History breakpoints used by "auto".
+            Bedrock allows four per request, including the system prompt's,
+            so at most four are used, or three with a system prompt.
 
     Methods:
         generate(prompt, system_prompt=None): Generate response synchronously.
         generate_stream(prompt, system_prompt=None): Stream response asynchronously, yielding chunks.
+        generate_stream_deltas(prompt, system_prompt=None): Stream response, yielding text chunks only.
+        agenerate, agenerate_stream, agenerate_stream_deltas: asyncio counterparts of the above.
     """
     modelId: Literal[
         "anthropic.claude-instant-v1",
@@ -28,22 +57,40 @@ class ClaudeLLM(BaseModel):
         "anthropic.claude-v2",
         "anthropic.claude-3-sonnet-20240229-v1:0",
         "anthropic.claude-3-haiku-20240307-v1:0",
+        "anthropic.claude-3-5-haiku-20241022-v1:0",
+        "us.anthropic.claude-3-5-haiku-20241022-v1:0",
+        "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
     ] = "anthropic.claude-3-sonnet-20240229-v1:0"
-    region_name: str = "us-west-2"
-    content_type: str = "application/json"
-    accept_type: str = "application/json"
     anthropic_version: str = "bedrock-2023-05-31"
-    max_tokens: int = 1000
-
-    def __init__(self, **data):
-        super().__init__(**data)
-        # Initialize the AWS Bedrock Runtime client with the specified AWS region.
-        self._bedrock_runtime = boto3.client("bedrock-runtime", region_name=self.region_name)
-
-    @property
-    def bedrock_runtime(self):
-        """Provides access to the Bedrock Runtime client."""
-        return self._bedrock_runtime
+    prompt_caching: Literal["off", "system", "auto"] = "off"
+    cache_history_breakpoints: int = 2
+
+    @validator("prompt_caching")
+    def check_prompt_caching(cls, value, values):
+        model_id = values.get("modelId")
+        if value != "off" and model_id not in PROMPT_CACHING_MODELS:
+            raise ValueError(
+                f"{model_id} does not support prompt caching; use one of {sorted(PROMPT_CACHING_MODELS)} or prompt_caching='off'"
+            )
+        return value
+
+    _delta_frame = (b'{"type":"content_block_delta","index":0,"delta":{"type":"text_delta","text":"', b'"}}')
+
+    def _cache_breakpoints(self, messages: List[Dict], system_prompt: Optional[str] = None) -> List[int]:
+        """Indexes of the messages whose last content block gets a breakpoint."""
+        if self.prompt_caching != "auto":
+            return []
+        limit = min(self.cache_history_breakpoints, MAX_CACHE_BREAKPOINTS - (1 if system_prompt else 0))
+        # The history before a user turn does not change in later requests,
+        # so it is the prefix worth caching.
+        points = []
+        for index in range(len(messages) - 1, 0, -1):
+            if len(points) >= limit:
+                break
+            content = messages[index - 1].get("content")
+            if messages[index]["role"] == "user" and isinstance(content, list) and content:
+                points.append(index - 1)
+        return points
 
     def _prepare_kwargs(self, prompt: Dict, system_prompt: Optional[str] = None) -> Dict:
         """
@@ -56,80 +103,81 @@ class ClaudeLLM(BaseModel):
         Returns:
             Dict: A dictionary of keyword arguments ready for the API call.
         """
+        body = {
+            "anthropic_version": self.anthropic_version,
+            "max_tokens": self.max_tokens,
+            **prompt
+        }
         if system_prompt:
-            prompt['system'] = system_prompt
+            if self.prompt_caching == "off":
+                body["system"] = system_prompt
+            else:
+                body["system"] = [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+        points = self._cache_breakpoints(prompt.get("messages", []), system_prompt)
+
+        # Splice in the pre-encoded messages of a Prompt rather than encoding
+        # the whole history again, copying the large fragments only once. A
+        # literal '"messages": null' can only be the top-level key, as quotes
+        # inside strings are escaped.
+        fragments = getattr(prompt, "message_fragments", None)
+        if fragments is not None:
+            if points:
+                fragments = list(fragments)
+                for index in points:
+                    # An encoded message ends with its last content block's
+                    # closing brace, then "]}".
+                    fragments[index] = fragments[index][:-3] + _CACHE_CONTROL_JSON + "}]}"
+            body["messages"] = None
+            head, tail = json.dumps(body).split('"messages": null', 1)
+            parts = [head, '"messages": [']
+            for index, fragment in enumerate(fragments):
+                if index:
+                    parts.append(", ")
+                parts.append(fragment)
+            parts += ["]", tail]
+            body = "".join(parts)
+        else:
+            if points:
+                messages = body["messages"] = list(body["messages"])
+                for index in points:
+                    content = messages[index]["content"]
+                    messages[index] = {
+                        **messages[index],
+                        "content": content[:-1] + [{**content[-1], "cache_control": CACHE_CONTROL}],
+                    }
+            body = json.dumps(body)
 
         return {
             "modelId": self.modelId,
             "contentType": self.content_type,
             "accept": self.accept_type,
-            "body": json.dumps({
-                "anthropic_version": self.anthropic_version,
-                "max_tokens": self.max_tokens,
-                **prompt
-            })
+            "body": body
         }
 
-    def generate(self, prompt: Dict, system_prompt: str = None):
-        """
-        Generate a response synchronously based on the given prompt.
-
-        Parameters:
-            prompt (Dict): The input prompt for the model.
-            system_prompt (str, optional): An optional system-level prompt to prepend.
+    def _prepare_request(self, prompt: Dict, system_prompt: Optional[str] = None) -> Dict:
+        return self._prepare_kwargs(prompt, system_prompt)
 
-        Returns:
-            Dict: A dictionary with the 'role' and 'content' of the generated response.
-        """
-        kwargs = self._prepare_kwargs(prompt, system_prompt)
-        response = self.bedrock_runtime.invoke_model(**kwargs)
-        body = json.loads(response.get("body").read())
+    def _parse_response(self, body: Dict) -> Dict:
         return {"role": body['role'], "content": body['content']}
 
-    def stream_response_chunks(self, response):
-        """
-        Stream chunks from the response body and process each chunk.
-
-        Parameters:
-            response: The response object from an asynchronous invocation.
-
-        Yields:
-            Tuple[str, Dict]: Each yield provides a chunk of text and the cumulative message content.
-        """
-        message = {}
-        message_text = ""
-        message_start_info = {}
-        chunk = ""
-        try:
-            for event in response.get("body"):
-                event_data = json.loads(event["chunk"]["bytes"])
-                event_type = event_data.get("type")
-                if event_type == "message_start":
-                    message_start_info = event_data.get("message")
-                elif event_type in ["content_block_delta", "content_block_start"]:
-                    chunk = event_data.get("delta", {}).get("text", "")
-                    message_text += chunk
-                    message = {"role": message_start_info.get("role", ""), "content": [{"type": "text", "text": message_text}]}
-                    yield chunk, message
-        except json.JSONDecodeError as e:
-            print("\nError decoding JSON from response chunk:", e)
-            raise
-
-    def generate_stream(self, prompt: Dict, system_prompt: str = None):
-        """
-        Invoke the model with the given prompt and stream the response asynchronously.
-
-        Parameters:
-            prompt (Dict): The input prompt for the model.
-            system_prompt (str, optional): An optional system-level prompt to prepend.
-
-        Yields:
-            The streaming response, chunk by chunk.
-        """
-        try:
-            kwargs = self._prepare_kwargs(prompt, system_prompt)
-            response = self.bedrock_runtime.invoke_model_with_response_stream(**kwargs)
-            yield from self.stream_response_chunks(response)
-        except ClientError as e:
-            print(f"An error occurred: {e}")
-            raise
+    def _parse_stream_event(self, event_data: Dict) -> Optional[str]:
+        if event_data.get("type") in ["content_block_delta", "content_block_start"]:
+            return event_data.get("delta", {}).get("text", "")
+        return None
+
+    def _parse_usage(self, data: Dict) -> Optional[Dict[str, int]]:
+        # Input tokens, including those read from or written to the prompt
+        # cache, arrive with message_start, output tokens with message_delta,
+        # and all of them in a non-streamed response body.
+        if data.get("type") == "message_start":
+            usage = data.get("message", {}).get("usage", {})
+            return {name: usage[name] for name in _INPUT_USAGE if usage.get(name) is not None} or None
+        if data.get("type") == "message_delta" or "content" in data:
+            usage = data.get("usage", {})
+            return {name: usage[name] for name in _USAGE if usage.get(name) is not None} or None
+        return None
+
+
+_INPUT_USAGE = ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+_USAGE = _INPUT_USAGE + ("output_tokens",)
@@ -1,41 +1,122 @@
-import boto3
 import json
-from botocore.exceptions import ClientError
-from pydantic import BaseModel
-from typing import Literal, Dict, Optional
-
-from jinja2 import Template
-
-class MistralLLM(BaseModel):
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Literal, Dict, List, Optional, Tuple
+
+from .llm_bedrock import BedrockLLM
+
+if TYPE_CHECKING:
+    from jinja2 import Template
+
+DEFAULT_PROMPT_TEMPLATE = "{{ bos_token }}{% set first_user_message_handled = false %}{% for message in messages %}{% if (message['role'] == 'user') != (loop.index0 % 2 == 0) %}{{ raise_exception('Conversation roles must alternate user/assistant/user/assistant/...') }}{% endif %}{% if message['role'] == 'user' %}{% if not first_user_message_handled %}{{ '[INST] ' + system_prompt + ' ' + message['content'][0]['text'] + ' [/INST]' }}{% set first_user_message_handled = true %}{% else %}{{ '[INST] ' + message['content'][0]['text'] + ' [/INST]' }}{% endif %}{% elif message['role'] == 'assistant' %}{{ message['content'][0]['text'] + eos_token}}{% else %}{{ raise_exception('Only user and assistant roles are supported!') }}{% endif %}{% endfor %}"
+
+
+@lru_cache(maxsize=32)
+def compile_template(source: str) -> "Template":
+    """Compile a prompt template once per distinct template string. jinja2 is imported on first use."""
+    from jinja2 import Template
+    return Template(source)
+
+
+class IncrementalPromptRenderer:
+    """
+    Renders DEFAULT_PROMPT_TEMPLATE by appending the segments of new turns to
+    the cached rendering of earlier turns of the same conversation.
+
+    Conversations are recognised by their system prompt, special tokens and
+    first message, and the most recently used `maxsize` are kept. Any input the
+    fast path does not handle exactly like the template (roles that do not
+    alternate, non-text first content, a missing system prompt) returns None so
+    the caller can fall back to the Jinja template, errors included.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple, Tuple[List, List[str], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, messages: List[Dict], system_prompt, bos_token: str, eos_token: str) -> Optional[str]:
+        if not isinstance(system_prompt, str) or not messages:
+            return None
+
+        turns = []
+        for index, message in enumerate(messages):
+            role = message.get('role')
+            if role not in ('user', 'assistant') or (role == 'user') != (index % 2 == 0):
+                return None
+            try:
+                text = message['content'][0]['text']
+            except (KeyError, IndexError, TypeError):
+                return None
+            if not isinstance(text, str):
+                return None
+            turns.append((role, text))
+
+        key = (system_prompt, bos_token, eos_token, turns[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        cached_turns, cached_segments, cached_rendered = entry if entry else ([], [], bos_token)
+        reused = 0
+        for cached, turn in zip(cached_turns, turns):
+            if cached != turn:
+                break
+            reused += 1
+
+        if reused == len(cached_turns):
+            prefix = cached_rendered
+        else:
+            prefix = bos_token + "".join(cached_segments[:reused])
+
+        segments = cached_segments[:reused]
+        for role, text in turns[reused:]:
+            if role == 'user':
+                # The template's first_user_message_handled flag is scoped to a
+                # single loop iteration, so every user turn gets the system prompt.
+                segments.append('[INST] ' + system_prompt + ' ' + text + ' [/INST]')
+            else:
+                segments.append(text + eos_token)
+
+        rendered = prefix + "".join(segments[reused:])
+
+        with self._lock:
+            self._entries[key] = (turns, segments, rendered)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return rendered
+
+
+class MistralLLM(BedrockLLM):
 
     modelId: Literal[
         "mistral.mistral-7b-instruct-v0:2",
         "mistral.mixtral-8x7b-instruct-v0:1",
         "mistral.mistral-large-2402-v1:0"
     ] = "mistral.mistral-large-2402-v1:0"
-    region_name: str = "us-west-2"
-
-    content_type: str = "application/json"
-    accept_type: str = "application/json"
 
-    max_tokens: int = 1000
     temperature: float = 0.5
     top_p: float = 0.9
     top_k: int = 50
     bos_token: str = "<s>"
     eos_token: str = "</s>"
 
-    prompt_template: str = "{{ bos_token }}{% set first_user_message_handled = false %}{% for message in messages %}{% if (message['role'] == 'user') != (loop.index0 % 2 == 0) %}{{ raise_exception('Conversation roles must alternate user/assistant/user/assistant/...') }}{% endif %}{% if message['role'] == 'user' %}{% if not first_user_message_handled %}{{ '[INST] ' + system_prompt + ' ' + message['content'][0]['text'] + ' [/INST]' }}{% set first_user_message_handled = true %}{% else %}{{ '[INST] ' + message['content'][0]['text'] + ' [/INST]' }}{% endif %}{% elif message['role'] == 'assistant' %}{{ message['content'][0]['text'] + eos_token}}{% else %}{{ raise_exception('Only user and assistant roles are supported!') }}{% endif %}{% endfor %}"
+    prompt_template: str = DEFAULT_PROMPT_TEMPLATE
+
+    # Reuse the rendered prompt of earlier turns when the default template is in
+    # use. The output is the same as rendering the template from scratch.
+    incremental_prompt: bool = True
+
+    _delta_frame = (b'{"outputs":[{"text":"', b'","stop_reason":null}]}')
 
     def __init__(self, **data):
         super().__init__(**data)
-        # Initialize the AWS Bedrock Runtime client with the specified AWS region.
-        self._bedrock_runtime = boto3.client("bedrock-runtime", region_name=self.region_name)
-
-    @property
-    def bedrock_runtime(self):
-        """Provides access to the Bedrock Runtime client."""
-        return self._bedrock_runtime
+        self._renderer = IncrementalPromptRenderer()
 
     def _prepare_kwargs(self, prompt: str, system_prompt: Optional[str] = None) -> Dict:
         """
@@ -72,8 +153,15 @@ class MistralLLM(BaseModel):
         Returns:
             str: The formatted prompt as a string.
         """
-        # Load the template string into a Jinja object. 
-        template = Template(self.prompt_template)
+        if self.incremental_prompt and self.prompt_template == DEFAULT_PROMPT_TEMPLATE:
+            rendered_template = self._renderer.render(
+                prompt['messages'], system_prompt, self.bos_token, self.eos_token
+            )
+            if rendered_template is not None:
+                return rendered_template
+
+        # Load the template string into a (cached) Jinja object.
+        template = compile_template(self.prompt_template)
 
         data = {
             "bos_token": self.bos_token,
@@ -87,73 +175,19 @@ class MistralLLM(BaseModel):
 
         # Take a look at what we got!
         return rendered_template
-    
-
-    def generate(self, prompt: Dict, system_prompt: str = None):
-        """
-        Generate a response synchronously based on the given prompt.
-
-        Parameters:
-            prompt (Dict): The input prompt for the model.
-            system_prompt (str, optional): An optional system-level prompt to prepend.
-
-        Returns:
-            Dict: A dictionary with the 'role' and 'content' of the generated response.
-        """
-        prompt_string = self._format_prompt_as_string(prompt, system_prompt)
-        kwargs = self._prepare_kwargs(prompt_string)
-        response = self.bedrock_runtime.invoke_model(**kwargs)
-        body = json.loads(response.get("body").read())
-
-        return {"role": "assistant", "content": [{"type": "text", "text": body['outputs'][0]['text']}]}
 
-    def stream_response_chunks(self, response):
-        """
-        Stream chunks from the response body and process each chunk.
-
-        Parameters:
-            response: The response object from an asynchronous invocation.
-
-        Yields:
-            Tuple[str, Dict]: Each yield provides a chunk of text and the cumulative message content.
-        """
-        message = {}
-        message_text = ""
-        chunk = ""
-        try:
-            for event in response.get("body"):
-                event_data = json.loads(event["chunk"]["bytes"])
-
-                outputs = event_data.get("outputs", {})
-                chunk = outputs[0].get("text", "")
-
-                message_text += chunk
-                message = {"role": "assistant", "content": [{"type": "text", "text": message_text}]}
-                yield chunk, message
-
-        except json.JSONDecodeError as e:
-            print("\nError decoding JSON from response chunk:", e)
-            raise
-
-    def generate_stream(self, prompt: Dict, system_prompt: str = None):
-        """
-        Invoke the model with the given prompt and stream the response asynchronously.
-
-        Parameters:
-            prompt (Dict): The input prompt for the model.
-            system_prompt (str, optional): An optional system-level prompt to prepend.
-
-        Yields:
-            The streaming response, chunk by chunk.
-        """
-        try:
+    def _prepare_request(self, prompt: Dict, system_prompt: Optional[str] = None) -> Dict:
+        if self.instrumentation is None:
             prompt_string = self._format_prompt_as_string(prompt, system_prompt)
-            kwargs = self._prepare_kwargs(prompt_string)
+        else:
+            start = time.perf_counter()
+            prompt_string = self._format_prompt_as_string(prompt, system_prompt)
+            self.instrumentation.emit("prompt_render_seconds", time.perf_counter() - start, model_id=self.modelId)
+        return self._prepare_kwargs(prompt_string)
 
-            # print(json.dumps(kwargs, indent=2))
+    def _parse_response(self, body: Dict) -> Dict:
+        return {"role": "assistant", "content": [{"type": "text", "text": body['outputs'][0]['text']}]}
 
-            response = self.bedrock_runtime.invoke_model_with_response_stream(**kwargs)
-            yield from self.stream_response_chunks(response)
-        except ClientError as e:
-            print(f"An error occurred: {e}")
-            raise
\ No newline at end of file
+    def _parse_stream_event(self, event_data: Dict) -> Optional[str]:
+        outputs = event_data.get("outputs", {})
+        return outputs[0].get("text", "")
@@ -0,0 +1,456 @@
+import asyncio
+import math
+import queue
+import threading
+import time
+from collections import deque
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+from .stream_control import StreamCancelled, StreamControl, current_stream_control
+
+_DONE = object()
+
+
+class BackendStats:
+    """
+    Rolling time-to-first-chunk samples and health of one backend.
+
+    Attributes:
+        window (int): Number of recent samples kept.
+        failure_threshold (int): Consecutive failures that mark it unhealthy.
+        cooldown (float): Seconds an unhealthy backend is skipped.
+    """
+
+    def __init__(self, window: int = 100, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.samples = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            self.failures = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.unhealthy_until = time.monotonic() + self.cooldown
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(q / 100 * len(samples)) - 1))]
+
+
+class RoutingLLM(BaseModel):
+    """
+    Routes each request to the fastest healthy of several LLM backends, for
+    example the same model in two regions, or Claude and Mistral side by side.
+    Implements the same generate methods as ClaudeLLM and MistralLLM.
+
+    Backends are ranked by a rolling percentile of their time to first chunk
+    (time to response for generate). Backends without samples yet are tried
+    first so every backend gets measured. A backend is skipped for a while
+    after consecutive failures, or while its circuit breaker is open when it
+    is a ResilientLLM. A request that fails before its first chunk fails over
+    to the next backend.
+
+    With `hedge` on, a second request goes to the next backend when the first
+    has not produced a chunk after its `hedge_percentile` time to first
+    chunk. The first to produce text wins and the other stream is closed at
+    once: the async methods cancel its task, the synchronous methods close
+    its response body through a StreamControl, which ends a blocking read.
+
+    Attributes:
+        backends (List[Any]): The LLMs to route between.
+        route_by (float): Percentile of time to first chunk used for ranking.
+        hedge (bool): Send hedge requests.
+        hedge_percentile (float): Percentile of the primary's time to first
+            chunk to wait before hedging.
+        hedge_delay (float): Seconds to wait before hedging while the primary
+            has no samples.
+        window (int): Samples kept per backend.
+        failure_threshold (int): Consecutive failures before a backend is skipped.
+        cooldown (float): Seconds a failing backend is skipped.
+    """
+    backends: List[Any]
+    route_by: float = 50
+    hedge: bool = False
+    hedge_percentile: float = 95
+    hedge_delay: float = 1.0
+    window: int = 100
+    failure_threshold: int = 3
+    cooldown: float = 30.0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._stats = [BackendStats(self.window, self.failure_threshold, self.cooldown) for _ in self.backends]
+
+    @property
+    def modelId(self):
+        return self.backends[0].modelId
+
+    @property
+    def max_tokens(self):
+        return self.backends[0].max_tokens
+
+    def backend_name(self, index: int) -> str:
+        backend = self.backends[index]
+        return f"{getattr(backend, 'modelId', type(backend).__name__)}@{getattr(backend, 'region_name', '')}"
+
+    def stats(self) -> List[Dict]:
+        """Per backend name, request count, wins, health and p50/p95 time to first chunk, in backend order."""
+        return [
+            {
+                "backend": self.backend_name(i),
+                "requests": s.requests,
+                "wins": s.wins,
+                "healthy": self._healthy(i),
+                "p50": s.percentile(50),
+                "p95": s.percentile(95),
+            }
+            for i, s in enumerate(self._stats)
+        ]
+
+    def _settle(self, winner: int, started: Dict[int, float], failed=()):
+        """
+        Record the winner's latency. Losers that started before the winner are
+        recorded with the time they had taken so far, a lower bound on their
+        latency, so a backend that keeps losing hedges drops in the ranking.
+        A loser started after the winner, such as a late hedge, has no useful
+        bound and is not recorded.
+        """
+        now = time.perf_counter()
+        self._stats[winner].record_win()
+        for index, start in started.items():
+            if index not in failed and start <= started[winner]:
+                self._stats[index].record(now - start)
+
+    def _healthy(self, index: int) -> bool:
+        breaker = getattr(self.backends[index], "breaker", None)
+        return self._stats[index].healthy and not (breaker is not None and breaker.is_open)
+
+    def _ranked(self) -> List[int]:
+        """Backend indexes, best first. Unhealthy backends go last rather than being dropped."""
+        def key(index):
+            latency = self._stats[index].percentile(self.route_by)
+            return (not self._healthy(index), -1 if latency is None else latency)
+        return sorted(range(len(self.backends)), key=key)
+
+    def _hedge_after(self, index: int) -> Optional[float]:
+        if not self.hedge or len(self.backends) < 2:
+            return None
+        delay = self._stats[index].percentile(self.hedge_percentile)
+        return self.hedge_delay if delay is None else delay
+
+    # Synchronous methods. Each attempt runs in a worker thread that reports to
+    # a queue, so a hedge can be started while the primary is still waiting.
+
+    def _stream_worker(self, index, prompt, system_prompt, out: queue.Queue, control: StreamControl):
+        # The control lets the router close the backend's response body from
+        # its own thread; a cancelled stream simply ends.
+        stream = control.iterate(self.backends[index].generate_stream_deltas(prompt, system_prompt=system_prompt))
+        try:
+            for chunk in stream:
+                out.put((index, chunk, None))
+            out.put((index, _DONE, None))
+        except Exception as e:
+            out.put((index, None, e))
+        finally:
+            stream.close()
+
+    def generate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        ranked = self._ranked()
+        out = queue.Queue()
+        started: Dict[int, float] = {}
+        controls: Dict[int, StreamControl] = {}
+        buffers: Dict[int, List[str]] = {}
+        # The caller's control cannot reach the worker threads, so its cancel
+        # wakes this generator and cancels every backend's stream.
+        outer = current_stream_control()
+
+        def cancel():
+            out.put((None, None, StreamCancelled(outer.stop_reason)))
+            for control in list(controls.values()):
+                control.cancel(outer.stop_reason)
+
+        def launch():
+            index = ranked[len(started)]
+            started[index] = time.perf_counter()
+            controls[index] = StreamControl()
+            if outer is not None and outer.cancelled:
+                controls[index].cancel(outer.stop_reason)
+            buffers[index] = []
+            self._stats[index].record_request()
+            threading.Thread(
+                target=self._stream_worker,
+                args=(index, prompt, system_prompt, out, controls[index]),
+                daemon=True,
+            ).start()
+            return index
+
+        if outer is not None:
+            outer.attach(cancel)
+        launch()
+        hedge_at = self._hedge_after(ranked[0])
+        hedge_at = None if hedge_at is None else time.perf_counter() + hedge_at
+        running = set(started)
+        failed = set()
+        winner = None
+        finished = False
+
+        try:
+            # Wait for the first backend to produce text.
+            while winner is None:
+                timeout = None
+                if hedge_at is not None and len(started) == 1:
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                try:
+                    index, chunk, error = out.get(timeout=timeout)
+                except queue.Empty:
+                    running.add(launch())
+                    continue
+
+                if index is None:
+                    raise error
+                if error is not None:
+                    self._stats[index].record_failure()
+                    running.discard(index)
+                    failed.add(index)
+                    if not running:
+                        if len(started) == len(ranked):
+                            raise error
+                        running.add(launch())
+                    continue
+
+                if chunk is _DONE:
+                    winner, finished = index, True
+                else:
+                    buffers[index].append(chunk)
+                    if chunk:
+                        winner = index
+
+            for index, control in controls.items():
+                if index != winner:
+                    control.cancel("abandoned")
+            self._settle(winner, started, failed)
+
+            yield from buffers[winner]
+            while not finished:
+                index, chunk, error = out.get()
+                if index is None:
+                    raise error
+                if index != winner:
+                    continue
+                if error is not None:
+                    self._stats[winner].record_failure()
+                    raise error
+                if chunk is _DONE:
+                    break
+                yield chunk
+        finally:
+            for control in controls.values():
+                control.cancel("abandoned")
+
+    def generate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        for chunk in self.generate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+
+    def generate(self, prompt: Dict, system_prompt: str = None):
+        ranked = self._ranked()
+        out = queue.Queue()
+        started: Dict[int, float] = {}
+
+        def call(index):
+            try:
+                out.put((index, self.backends[index].generate(prompt, system_prompt=system_prompt), None))
+            except Exception as e:
+                out.put((index, None, e))
+
+        def launch():
+            index = ranked[len(started)]
+            started[index] = time.perf_counter()
+            self._stats[index].record_request()
+            threading.Thread(target=call, args=(index,), daemon=True).start()
+
+        launch()
+        hedge_at = self._hedge_after(ranked[0])
+        hedge_at = None if hedge_at is None else time.perf_counter() + hedge_at
+        pending = 1
+        failed = set()
+        while True:
+            timeout = None
+            if hedge_at is not None and len(started) == 1:
+                timeout = max(0.0, hedge_at - time.perf_counter())
+            try:
+                index, response, error = out.get(timeout=timeout)
+            except queue.Empty:
+                launch()
+                pending += 1
+                continue
+            pending -= 1
+            if error is None:
+                # A late loser's response is simply discarded.
+                self._settle(index, started, failed)
+                return response
+            self._stats[index].record_failure()
+            failed.add(index)
+            if pending == 0:
+                if len(started) == len(ranked):
+                    raise error
+                launch()
+                pending += 1
+
+    # Asynchronous methods. Attempts are tasks; the loser's task is cancelled,
+    # which closes its upstream stream.
+
+    async def _astream_worker(self, index, prompt, system_prompt, out: asyncio.Queue):
+        try:
+            async for chunk in self.backends[index].agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+                await out.put((index, chunk, None))
+            await out.put((index, _DONE, None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await out.put((index, None, e))
+
+    async def agenerate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        ranked = self._ranked()
+        out = asyncio.Queue()
+        started: Dict[int, float] = {}
+        tasks: Dict[int, asyncio.Task] = {}
+        buffers: Dict[int, List[str]] = {}
+
+        def launch():
+            index = ranked[len(started)]
+            started[index] = time.perf_counter()
+            buffers[index] = []
+            self._stats[index].record_request()
+            tasks[index] = asyncio.ensure_future(self._astream_worker(index, prompt, system_prompt, out))
+
+        launch()
+        hedge_at = self._hedge_after(ranked[0])
+        hedge_at = None if hedge_at is None else time.perf_counter() + hedge_at
+        failed = set()
+        winner = None
+        finished = False
+
+        try:
+            while winner is None:
+                timeout = None
+                if hedge_at is not None and len(started) == 1:
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                try:
+                    index, chunk, error = await asyncio.wait_for(out.get(), timeout)
+                except asyncio.TimeoutError:
+                    launch()
+                    continue
+
+                if error is not None:
+                    self._stats[index].record_failure()
+                    failed.add(index)
+                    if failed == set(started):
+                        if len(started) == len(ranked):
+                            raise error
+                        launch()
+                    continue
+
+                if chunk is _DONE:
+                    winner, finished = index, True
+                else:
+                    buffers[index].append(chunk)
+                    if chunk:
+                        winner = index
+
+            for index, task in tasks.items():
+                if index != winner:
+                    task.cancel()
+            self._settle(winner, started, failed)
+
+            for chunk in buffers[winner]:
+                yield chunk
+            while not finished:
+                index, chunk, error = await out.get()
+                if index != winner:
+                    continue
+                if error is not None:
+                    self._stats[winner].record_failure()
+                    raise error
+                if chunk is _DONE:
+                    break
+                yield chunk
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def agenerate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        async for chunk in self.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+
+    async def agenerate(self, prompt: Dict, system_prompt: str = None):
+        ranked = self._ranked()
+        started: Dict[int, float] = {}
+        tasks: Dict[asyncio.Task, int] = {}
+
+        def launch():
+            index = ranked[len(started)]
+            started[index] = time.perf_counter()
+            self._stats[index].record_request()
+            tasks[asyncio.ensure_future(self.backends[index].agenerate(prompt, system_prompt=system_prompt))] = index
+
+        launch()
+        hedge_after = self._hedge_after(ranked[0])
+        pending = set(tasks)
+        failed = set()
+        try:
+            while True:
+                timeout = hedge_after if len(started) == 1 else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    pending = set(t for t in tasks if not t.done())
+                    continue
+                for task in done:
+                    index = tasks[task]
+                    if task.exception() is None:
+                        self._settle(index, started, failed)
+                        return task.result()
+                    self._stats[index].record_failure()
+                    failed.add(index)
+                    error = task.exception()
+                if not pending:
+                    if len(started) == len(ranked):
+                        raise error
+                    launch()
+                    pending = set(t for t in tasks if not t.done())
+        finally:
+            for task in tasks:
+                task.cancel()
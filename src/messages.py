@@ -1,11 +1,53 @@
+import base64
+import hashlib
+import io
 import json
-from pydantic import BaseModel, ValidationError, validator
-from typing import Optional, List, Union, Literal
+import threading
+from collections import OrderedDict
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError, model_serializer, validator
+from typing import Callable, Optional, List, Union, Literal, BinaryIO
 
 class MessageContentSource(BaseModel):
     type: Literal["base64"] = "base64"
     media_type: Literal["image/jpeg", "image/png"] = "image/png"
     data: str
+    # Size in bytes of the image before ingestion. Not sent to the model.
+    original_size: Optional[int] = Field(default=None, exclude=True)
+
+    # Reads `data` on every use, for sources created with `deferred`.
+    _load: Optional[Callable[[], str]] = PrivateAttr(default=None)
+
+    @classmethod
+    def deferred(cls, media_type: str, load: Callable[[], str], type: str = "base64") -> "MessageContentSource":
+        """
+        A source whose data is read by calling `load` each time it is used, for
+        example from a SessionStore's cache. Neither the source nor its message
+        keeps the data.
+        """
+        return _construct(cls, {"type": type, "media_type": media_type, "original_size": None}, private={"_load": load})
+
+    @property
+    def is_deferred(self) -> bool:
+        return "data" not in self.__dict__
+
+    def __getattr__(self, name):
+        if name == "data":
+            private = self.__pydantic_private__
+            load = private.get("_load") if private else None
+            if load is not None:
+                return load()
+        return super().__getattr__(name)
+
+    def __eq__(self, other):
+        if not isinstance(other, MessageContentSource):
+            return NotImplemented
+        return self.type == other.type and self.media_type == other.media_type and self.data == other.data
+
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler):
+        if self.is_deferred:
+            return {"type": self.type, "media_type": self.media_type, "data": self.data}
+        return handler(self)
 
 class ImageContent(BaseModel):
     type: Literal["image"] = "image"
@@ -17,10 +59,216 @@ class TextContent(BaseModel):
 
 Content = Union[ImageContent, TextContent]
 
+class ImageIngestor(BaseModel):
+    """
+    Prepares uploaded images for the model: downscales them to `max_edge`,
+    re-encodes them as JPEG or PNG, and stores each distinct image once.
+
+    Images are identified by the SHA-256 of their uploaded bytes, so the same
+    upload, for example a file re-sent on a Streamlit rerun, reuses the already
+    encoded string instead of being processed and held in memory again. Only
+    the encoded result is kept; the uploaded bytes are dropped after ingestion.
+
+    Resizing and re-encoding need Pillow. Without it images are stored as
+    uploaded, and are still deduplicated.
+
+    Attributes:
+        max_edge (int): Longest edge in pixels after downscaling.
+        quality (int): JPEG quality used when re-encoding.
+        output_format (Literal): "auto" keeps PNG for images with transparency
+            and uses JPEG otherwise.
+        max_images (int): Number of distinct images kept for deduplication.
+    """
+    max_edge: int = 1568
+    quality: int = 85
+    output_format: Literal["auto", "jpeg", "png"] = "auto"
+    max_images: int = 256
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._images: "OrderedDict[str, MessageContentSource]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ingest(self, image: Union[bytes, str, BinaryIO], media_type: Optional[str] = None) -> ImageContent:
+        """
+        Ingest an image from bytes, a file path or a binary file object.
+
+        Parameters:
+            image: The image to ingest.
+            media_type (Optional[str]): MIME type of the upload, used when
+                Pillow is not available to re-encode the image.
+
+        Returns:
+            ImageContent: Content block ready to add to a message.
+        """
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                raw = f.read()
+        elif isinstance(image, (bytes, bytearray)):
+            raw = bytes(image)
+        else:
+            raw = image.read()
+
+        key = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            source = self._images.get(key)
+            if source is not None:
+                self._images.move_to_end(key)
+                return ImageContent(source=source)
+
+        data, media_type = self._encode(raw, media_type)
+        source = MessageContentSource(
+            media_type=media_type,
+            data=base64.b64encode(data).decode(),
+            original_size=len(raw),
+        )
+
+        with self._lock:
+            source = self._images.setdefault(key, source)
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+        return ImageContent(source=source)
+
+    def _encode(self, raw: bytes, media_type: Optional[str]):
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            print("Pillow is not installed, images are sent as uploaded.")
+            return raw, media_type or "image/png"
+
+        image = Image.open(io.BytesIO(raw))
+        source_format = image.format
+        # Re-encoding drops EXIF, so apply its orientation to the pixels first.
+        rotated = image.getexif().get(0x0112, 1) != 1
+        if rotated:
+            image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > self.max_edge
+        if resized:
+            image.thumbnail((self.max_edge, self.max_edge))
+
+        output_format = self.output_format
+        if output_format == "auto":
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            output_format = "png" if has_alpha else "jpeg"
+
+        out = io.BytesIO()
+        if output_format == "png":
+            image.save(out, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(out, format="JPEG", quality=self.quality, optimize=True)
+        data = out.getvalue()
+
+        # Keep a small upload as it is if re-encoding would not make it smaller.
+        if not resized and not rotated and len(data) >= len(raw) and source_format in ("JPEG", "PNG"):
+            return raw, "image/" + source_format.lower()
+        return data, "image/" + output_format
+
+def _construct(cls, values: dict, private: Optional[dict] = None):
+    """
+    Create a model instance from already valid field values. Like
+    model_construct, without its per-field default handling, which costs
+    more than validating a small message.
+    """
+    instance = cls.__new__(cls)
+    object.__setattr__(instance, "__dict__", values)
+    object.__setattr__(instance, "__pydantic_fields_set__", set(values))
+    object.__setattr__(instance, "__pydantic_extra__", None)
+    object.__setattr__(instance, "__pydantic_private__", private)
+    return instance
+
 class Message(BaseModel):
     role: Optional[Literal["user", "assistant"]] = "user"
     content: List[Content]
 
+    # Dict and JSON encodings of the message, kept until a field is
+    # reassigned. Content blocks should be replaced rather than edited in place.
+    # Not kept for a message with deferred images, whose data stays out of it.
+    _dict: Optional[dict] = PrivateAttr(default=None)
+    _json: Optional[str] = PrivateAttr(default=None)
+
+    def __eq__(self, other):
+        # Compares the fields only: the cached encodings are not part of the message.
+        if not isinstance(other, Message):
+            return NotImplemented
+        return type(self) is type(other) and self.role == other.role and self.content == other.content
+
+    def __setattr__(self, name, value):
+        if name in self.model_fields:
+            self._dict = None
+            self._json = None
+        super().__setattr__(name, value)
+
+    @classmethod
+    def trusted(cls, payload: dict) -> "Message":
+        """
+        Build a message from a well-formed dict produced by this package, such
+        as a model response or a streamed message, without validating it.
+        Content other than text and images is validated as usual. Use
+        `Message(**payload)` for anything that comes from a user.
+        """
+        content, encoded = [], []
+        deferred = False
+        for block in payload["content"]:
+            kind = block.get("type")
+            if kind == "text":
+                content.append(_construct(TextContent, {"type": "text", "text": block["text"]}))
+                encoded.append({"type": "text", "text": block["text"]})
+            elif kind == "image" and isinstance(block["source"], MessageContentSource):
+                # A deferred source is encoded when the message is first serialised.
+                content.append(_construct(ImageContent, {"type": "image", "source": block["source"]}))
+                deferred = True
+            elif kind == "image":
+                source = block["source"]
+                fields = {"type": source.get("type", "base64"), "media_type": source["media_type"], "data": source["data"]}
+                content.append(_construct(ImageContent, {
+                    "type": "image",
+                    "source": _construct(MessageContentSource, {**fields, "original_size": None}),
+                }))
+                encoded.append({"type": "image", "source": fields})
+            else:
+                return cls(**payload)
+        role = payload.get("role", "assistant")
+        return _construct(
+            cls, {"role": role, "content": content},
+            private={"_dict": None if deferred else {"role": role, "content": encoded}, "_json": None},
+        )
+
+    def to_dict(self) -> dict:
+        """The message as a dict, as model_dump() would return it. Treat it as read-only."""
+        # Private attributes are read directly, as pydantic's attribute lookup
+        # for them costs more than the rest of this method.
+        private = self.__pydantic_private__
+        encoded = private["_dict"]
+        if encoded is None:
+            content = []
+            deferred = False
+            for block in self.content:
+                if isinstance(block, TextContent):
+                    content.append({"type": block.type, "text": block.text})
+                elif isinstance(block, ImageContent):
+                    source = block.source
+                    deferred = deferred or source.is_deferred
+                    content.append({
+                        "type": block.type,
+                        "source": {"type": source.type, "media_type": source.media_type, "data": source.data},
+                    })
+                else:
+                    content.append(block.model_dump())
+            encoded = {"role": self.role, "content": content}
+            if not deferred:
+                private["_dict"] = encoded
+        return encoded
+
+    def to_json(self) -> str:
+        """The message encoded as it appears in a request body."""
+        private = self.__pydantic_private__
+        encoded = private["_json"]
+        if encoded is None:
+            encoded = json.dumps(self.to_dict())
+            if private["_dict"] is not None:
+                private["_json"] = encoded
+        return encoded
+
     @validator('content', pre=True, each_item=True)
     def default_to_textcontent(cls, v):
         if isinstance(v, str):
@@ -28,26 +276,153 @@ class Message(BaseModel):
             return TextContent(type='text', text=v)
         return v
 
+class Prompt(dict):
+    """
+    The {"messages": [...]} prompt passed to the LLM classes. Alongside the
+    message dicts it carries `message_fragments`, each message's cached JSON
+    encoding, so request bodies do not have to re-encode the whole history on
+    every turn. The message dicts are cached by each Message and must not be
+    modified.
+    """
+
+    def __init__(self, messages: List[Message]):
+        super().__init__(messages=[message.to_dict() for message in messages])
+        self.message_fragments = [message.to_json() for message in messages]
+
+    @property
+    def messages_json(self) -> str:
+        """The messages as a JSON array."""
+        return "[" + ", ".join(self.message_fragments) + "]"
+
+class StreamBuffer:
+    """
+    Collects the text deltas of a streamed assistant turn and commits them to a
+    Messages instance as a single validated Message.
+
+    Appending a chunk is constant time. The full text is only joined and
+    validated when the buffer is committed, or every `checkpoint_interval`
+    chunks if one is set.
+
+    Attributes:
+        role (str): Role of the message being streamed, usually "assistant".
+        checkpoint_interval (Optional[int]): Number of chunks between interim
+            commits to the history. None commits only at the end of the stream.
+    """
+
+    def __init__(self, messages, role: str = "assistant", checkpoint_interval: Optional[int] = None):
+        self._messages = messages
+        self.role = role
+        self.checkpoint_interval = checkpoint_interval
+        self._chunks: List[str] = []
+        self._pending = 0
+        self._written = False
+
+    @property
+    def written(self) -> bool:
+        """True once a checkpoint has written the message to the history."""
+        return self._written
+
+    @property
+    def text(self) -> str:
+        """The text received so far."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def append(self, chunk: str):
+        self._chunks.append(chunk)
+        self._pending += 1
+        if self.checkpoint_interval and self._pending >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def message(self) -> dict:
+        return {"role": self.role, "content": [{"type": "text", "text": self.text}]}
+
+    def checkpoint(self):
+        """Write the text received so far to the history."""
+        self._pending = 0
+        self._messages.update_stream(self.message(), trusted=True)
+        self._written = True
+
+    def commit(self):
+        """Write the final message to the history, if anything was received."""
+        if self._pending:
+            self.checkpoint()
+
 class Messages(BaseModel):
     messages: List[Message] = []
 
-    def add(self, payload):
+    # Called with ("add" | "replace" | "pop" | "clear", message) after every change
+    # made through these methods, to persist the history. See src/sessions.py.
+    _journal: Optional[Callable] = PrivateAttr(default=None)
+
+    def _record(self, op: str, message: Optional[Message] = None):
+        if self._journal is not None:
+            self._journal(op, message)
+
+    def add(self, payload, trusted: bool = False):
+        """
+        Add a message. `trusted` skips validation for well-formed messages
+        produced by this package, such as model responses; see Message.trusted.
+        """
 
         if isinstance(payload, str):
             # Directly handle string content by wrapping it into the expected structure
             payload = {"role" : "user", "content" :[{"type": "text", "text": payload}]}
         try:
-            new_message = Message(**payload)
+            new_message = Message.trusted(payload) if trusted else Message(**payload)
             self.messages.append(new_message)
+            self._record("add", new_message)
         except ValidationError as e:
             print("Validation error:", e)
 
-    def update_stream(self, streaming_message):
+    def clear(self):
+        """Remove every message from the history."""
+        self.messages = []
+        self._record("clear")
+
+    def pop(self) -> Message:
+        """Remove and return the last message."""
+        message = self.messages.pop()
+        self._record("pop")
+        return message
+
+    def image_bytes_saved(self, messages: Optional[List[Message]] = None) -> int:
+        """
+        Bytes of base64 request payload saved by image ingestion for the images
+        in the history (or in `messages`), compared with sending each upload as
+        it was. For a full-history request this is the saving per request.
+        """
+        saved = 0
+        for message in self.messages if messages is None else messages:
+            for content in message.content:
+                if content.type == "image" and content.source.original_size is not None:
+                    saved += 4 * ((content.source.original_size + 2) // 3) - len(content.source.data)
+        return saved
+
+    def to_prompt(self, messages: Optional[List[Message]] = None) -> Prompt:
+        """
+        Build the prompt for the LLM classes.
+
+        Parameters:
+            messages (Optional[List[Message]]): Messages to send instead of the
+                whole history, for example a history trimmed to a budget.
+        """
+        return Prompt(self.messages if messages is None else messages)
+
+    def stream_buffer(self, role: str = "assistant", checkpoint_interval: Optional[int] = None) -> StreamBuffer:
+        """Start buffering a streamed message that will be committed to this history."""
+        return StreamBuffer(self, role=role, checkpoint_interval=checkpoint_interval)
+
+    def update_stream(self, streaming_message, trusted: bool = False):
         try:
             streaming_message_role = streaming_message.get("role", "assistant")
+            message = Message.trusted(streaming_message) if trusted else Message(**streaming_message)
             if streaming_message_role == self.messages[-1].role:
-                self.messages[-1] = Message(**streaming_message)
+                self.messages[-1] = message
+                self._record("replace", message)
             else:
-                self.messages.append(Message(**streaming_message))
+                self.messages.append(message)
+                self._record("add", message)
         except ValidationError as e:
             print("Validation error:", e)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import base64
+import threading
+import weakref
+from collections import OrderedDict
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Tuple
+
+from .messages import Message, Messages
+
+# A piece of a rendered message: ("markdown", text) or ("image", source). An
+# image is decoded through the image cache when it is drawn.
+Part = Tuple[str, Any]
+
+
+class HistoryRenderer(BaseModel):
+    """
+    Draws a Chat history in a Streamlit app on every rerun, without copying
+    the history or decoding its images again.
+
+    Messages are read in place rather than through model_dump(). The parts of
+    the `max_messages` most recently drawn messages are kept until the message
+    changes, so a rerun only prepares the messages added since the last one.
+    Parts refer to their message weakly and hold image sources rather than
+    image data, so a history that is dropped is freed with its parts.
+    Decoded images are kept in a cache bounded by `max_image_bytes` and keyed
+    by their base64 string, whose hash Python computes once per string, so the
+    images of old turns are looked up rather than hashed or decoded.
+
+    One renderer can serve every session of the app, for example through
+    st.cache_resource; both caches are shared and thread safe. Streamlit is
+    imported when `render` is first called.
+
+    Attributes:
+        avatars (Dict[str, Optional[str]]): Avatar of each role, for example
+            {"assistant": "./img/claude.png"}.
+        max_image_bytes (int): Decoded image bytes kept in the cache.
+        max_messages (int): Messages whose parts are kept, over all sessions.
+    """
+    avatars: Dict[str, Optional[str]] = {}
+    max_image_bytes: int = 128 * 1024 * 1024
+    max_messages: int = 4096
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._lock = threading.Lock()
+        self._images: "OrderedDict[str, bytes]" = OrderedDict()
+        self._image_bytes = 0
+        # id(message) -> (weak reference to the message, its role, its content
+        # list, parts). Assigning the role or content invalidates the parts.
+        self._parts: "OrderedDict[int, Tuple[weakref.ref, str, list, List[Part]]]" = OrderedDict()
+        # Ids of collected messages, removed from _parts on the next call; the
+        # weakref callback may run at any point, even with the lock held.
+        self._dead: List[int] = []
+
+    def image(self, data: str) -> bytes:
+        """The decoded bytes of a base64 image, from the cache when possible."""
+        with self._lock:
+            decoded = self._images.get(data)
+            if decoded is not None:
+                self._images.move_to_end(data)
+                return decoded
+        decoded = base64.b64decode(data)
+        with self._lock:
+            if data not in self._images:
+                self._images[data] = decoded
+                self._image_bytes += len(decoded)
+                while self._image_bytes > self.max_image_bytes and len(self._images) > 1:
+                    _, evicted = self._images.popitem(last=False)
+                    self._image_bytes -= len(evicted)
+        return decoded
+
+    def _forget(self, key: int):
+        self._dead.append(key)
+
+    def _prune(self):
+        # Call with the lock held.
+        while self._dead:
+            key = self._dead.pop()
+            cached = self._parts.get(key)
+            if cached is not None and cached[0]() is None:
+                del self._parts[key]
+
+    def parts(self, message: Message) -> List[Part]:
+        """The parts to draw for a message, prepared once per version of the message."""
+        key = id(message)
+        with self._lock:
+            self._prune()
+            cached = self._parts.get(key)
+            if cached is not None and cached[0]() is message and cached[1] == message.role and cached[2] is message.content:
+                self._parts.move_to_end(key)
+                return cached[3]
+        parts = []
+        for content in message.content:
+            if content.type == "text":
+                parts.append(("markdown", content.text))
+            elif content.type == "image":
+                parts.append(("image", content.source))
+        reference = weakref.ref(message, lambda _, key=key: self._forget(key))
+        with self._lock:
+            self._parts[key] = (reference, message.role, message.content, parts)
+            self._parts.move_to_end(key)
+            while len(self._parts) > self.max_messages:
+                self._parts.popitem(last=False)
+        return parts
+
+    def render_message(self, message: Message):
+        """Draw one message in a chat message container."""
+        import streamlit as st
+
+        with st.chat_message(message.role, avatar=self.avatars.get(message.role)):
+            for kind, value in self.parts(message):
+                if kind == "markdown":
+                    st.markdown(value)
+                else:
+                    st.image(self.image(value.data))
+
+    def render(self, messages: Messages):
+        """
+        Draw every message of a history, typically at the top of the script
+        before the new turn is handled.
+
+        Parameters:
+            messages (Messages): The history, usually st.session_state.chat.messages.
+        """
+        for message in messages.messages:
+            self.render_message(message)
@@ -0,0 +1,364 @@
+import asyncio
+import random
+import threading
+import time
+from botocore.exceptions import BotoCoreError, ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional, Tuple
+
+from .budget import ContextBudget
+
+# Error codes worth retrying: throttling and transient service side failures.
+RETRYABLE_ERRORS = (
+    "ThrottlingException",
+    "ModelStreamErrorException",
+    "ModelTimeoutException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+)
+
+
+# Failures of the connection rather than of the request: refused or dropped
+# connections and read timeouts, from botocore or the async transport.
+CONNECTION_ERRORS = (BotoConnectionError, HTTPClientError, ConnectionError, TimeoutError)
+
+# Everything a call to the model can fail with, as far as the breaker is concerned.
+CALL_ERRORS = (ClientError, BotoCoreError, ConnectionError, TimeoutError)
+
+
+def error_code(error: ClientError) -> str:
+    return error.response.get("Error", {}).get("Code", "")
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        return error_code(error) in RETRYABLE_ERRORS
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+def is_model_failure(error: Exception) -> bool:
+    """Whether an error counts against the model, rather than the request."""
+    return is_retryable(error) or isinstance(error, BotoCoreError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+
+class RetryPolicy(BaseModel):
+    """
+    Exponential backoff with full jitter.
+
+    Attributes:
+        max_attempts (int): Attempts per request, including the first.
+        base_delay (float): Backoff ceiling in seconds after the first failure.
+        max_delay (float): Largest backoff ceiling in seconds.
+    """
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after failed attempt number `attempt` (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. `reserve` always succeeds and returns how long
+    the caller must wait before using what it reserved, so waiting callers are
+    served in order and never spin.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Largest burst.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Client side limit on requests per minute and estimated tokens per minute
+    for one model id. The request rate adapts: each throttle from the service
+    cuts it by `backoff_factor`, and each success recovers a little of it, up
+    to the configured rate.
+
+    Attributes:
+        requests_per_minute (Optional[float]): None for no request limit.
+        tokens_per_minute (Optional[float]): None for no token limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        backoff_factor: float = 0.7,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.backoff_factor = backoff_factor
+        self._requests = TokenBucket(requests_per_minute / 60, requests_per_minute / 60 * 5) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserve one request and `tokens` tokens, returning the seconds to wait."""
+        wait = 0.0
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.reserve(tokens))
+        return wait
+
+    def on_throttle(self):
+        if self._requests is not None:
+            floor = self.requests_per_minute / 60 * 0.1
+            self._requests.rate = max(floor, self._requests.rate * self.backoff_factor)
+
+    def on_success(self):
+        if self._requests is not None:
+            full = self.requests_per_minute / 60
+            self._requests.rate = min(full, self._requests.rate + full * 0.05)
+
+
+_limiters: Dict[Tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(model_id: str, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None) -> RateLimiter:
+    """The process-wide rate limiter for a model id and quota."""
+    key = (model_id, requests_per_minute, tokens_per_minute)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return limiter
+
+
+class CircuitBreaker:
+    """
+    Stops calling a model after `failure_threshold` consecutive failures.
+    After `reset_timeout` seconds one trial request is let through; its
+    success closes the circuit again. A trial that ends any other way, such as
+    a rejected request or a stream closed early, must be ended with
+    `end_trial` so that the next call can be the trial.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError if the call must not be made. Returns True for the trial call."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+                raise CircuitOpenError("Circuit open: too many recent failures from the model.")
+            self._trial = True
+            return True
+
+    def end_trial(self):
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class ResilientLLM(BaseModel):
+    """
+    Wraps an LLM with retries, client side rate limiting and a circuit breaker.
+
+    Throttling, transient and connection errors are retried with jittered
+    exponential backoff. A stream is only retried if it failed before yielding any chunk;
+    after that the error is raised to the caller, as a retry would repeat text
+    the caller has already received. Unless `client_max_attempts` of the
+    wrapped LLM is set, its client makes a single attempt per request, so
+    botocore does not retry on top of these retries.
+
+    Attributes:
+        llm: The wrapped ClaudeLLM or MistralLLM.
+        retry (RetryPolicy): Backoff settings.
+        requests_per_minute (Optional[float]): Request quota shared by every
+            ResilientLLM for the same model id. None for no limit.
+        tokens_per_minute (Optional[float]): Token quota, estimated from the
+            prompt plus max_tokens. None for no limit.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout (float): Seconds the circuit stays open.
+    """
+    llm: Any
+    retry: RetryPolicy = Field(default_factory=RetryPolicy)
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        # Retries are made here; botocore retrying each attempt as well
+        # would multiply them and hide throttling from the rate limiter.
+        if getattr(self.llm, "client_max_attempts", 1) is None:
+            self.llm.client_max_attempts = 1
+        self._limiter = rate_limiter(self.llm.modelId, self.requests_per_minute, self.tokens_per_minute)
+        self._breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        self._estimator = ContextBudget()
+
+    @property
+    def modelId(self):
+        return self.llm.modelId
+
+    @property
+    def max_tokens(self):
+        return self.llm.max_tokens
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    def _admit(self, prompt: Dict, system_prompt: Optional[str]) -> Tuple[bool, float]:
+        """Check the breaker and reserve quota. Returns whether this is the breaker's trial call, and the seconds to wait."""
+        trial = self._breaker.before_call()
+        tokens = 0
+        if self.tokens_per_minute:
+            tokens = self._estimator.estimate_prompt_tokens(prompt, system_prompt) + self.llm.max_tokens
+        return trial, self._limiter.reserve(tokens)
+
+    def _failed(self, error: Exception):
+        if is_model_failure(error):
+            self._breaker.record_failure()
+        if isinstance(error, ClientError) and error_code(error) == "ThrottlingException":
+            self._limiter.on_throttle()
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        self._failed(error)
+        return is_retryable(error) and attempt + 1 < self.retry.max_attempts and not self._breaker.is_open
+
+    def _succeeded(self):
+        self._breaker.record_success()
+        self._limiter.on_success()
+
+    def generate(self, prompt: Dict, system_prompt: str = None):
+        for attempt in range(self.retry.max_attempts):
+            trial, wait = self._admit(prompt, system_prompt)
+            try:
+                time.sleep(wait)
+                response = self.llm.generate(prompt, system_prompt=system_prompt)
+            except CALL_ERRORS as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(self.retry.delay(attempt))
+                continue
+            finally:
+                if trial:
+                    self._breaker.end_trial()
+            self._succeeded()
+            return response
+
+    def generate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        for attempt in range(self.retry.max_attempts):
+            trial, wait = self._admit(prompt, system_prompt)
+            started = False
+            try:
+                time.sleep(wait)
+                for chunk in self.llm.generate_stream_deltas(prompt, system_prompt=system_prompt):
+                    started = True
+                    yield chunk
+                self._succeeded()
+                return
+            except CALL_ERRORS as e:
+                if started:
+                    self._failed(e)
+                    raise
+                if not self._should_retry(e, attempt):
+                    raise
+            finally:
+                # Also reached when the caller closes the stream early.
+                if trial:
+                    self._breaker.end_trial()
+            time.sleep(self.retry.delay(attempt))
+
+    def generate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        for chunk in self.generate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
+
+    async def agenerate(self, prompt: Dict, system_prompt: str = None):
+        for attempt in range(self.retry.max_attempts):
+            trial, wait = self._admit(prompt, system_prompt)
+            try:
+                await asyncio.sleep(wait)
+                response = await self.llm.agenerate(prompt, system_prompt=system_prompt)
+            except CALL_ERRORS as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt))
+                continue
+            finally:
+                if trial:
+                    self._breaker.end_trial()
+            self._succeeded()
+            return response
+
+    async def agenerate_stream_deltas(self, prompt: Dict, system_prompt: str = None):
+        for attempt in range(self.retry.max_attempts):
+            trial, wait = self._admit(prompt, system_prompt)
+            started = False
+            try:
+                await asyncio.sleep(wait)
+                async for chunk in self.llm.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+                    started = True
+                    yield chunk
+                self._succeeded()
+                return
+            except CALL_ERRORS as e:
+                if started:
+                    self._failed(e)
+                    raise
+                if not self._should_retry(e, attempt):
+                    raise
+            finally:
+                if trial:
+                    self._breaker.end_trial()
+            await asyncio.sleep(self.retry.delay(attempt))
+
+    async def agenerate_stream(self, prompt: Dict, system_prompt: str = None):
+        chunks = []
+        async for chunk in self.agenerate_stream_deltas(prompt, system_prompt=system_prompt):
+            chunks.append(chunk)
+            yield chunk, {"role": "assistant", "content": [{"type": "text", "text": "".join(chunks)}]}
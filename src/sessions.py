@@ -0,0 +1,333 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from .messages import Message, MessageContentSource, Messages
+
+
+class SessionStore:
+    """
+    Persists Chat histories by session id, so a conversation survives restarts
+    and can be resumed on any replica that shares the storage.
+
+    Each session is an append-only log of changes ("add", "replace", "pop"
+    and "clear" records) written as the history changes. Image data is stored out
+    of line, once per distinct image, and log records refer to it by hash, so
+    streaming checkpoints and new turns never rewrite earlier images.
+
+    Recently used sessions are kept in memory, up to `max_sessions`; older
+    ones are evicted and cost nothing until they are opened again, when their
+    log is replayed. Images are read back whenever a message is serialised or
+    drawn, through a cache of `max_blob_bytes` shared by all sessions. The
+    messages do not keep them, so outside of a request being built, the image
+    data of stored sessions held in memory is bounded by `max_blob_bytes`. Opening a session that is still in memory only replays what
+    other replicas have appended since.
+
+    Usage: keep only the session id in per-user state and open the history
+    on each request.
+
+        chat = Chat(llm=ClaudeLLM(), messages=store.open(session_id))
+
+    Subclasses implement `_append`, `_read`, `_put_blob`, `_get_blob`,
+    `_rewrite` and `delete`.
+
+    Attributes:
+        max_sessions (int): Sessions kept in memory.
+        max_blob_bytes (int): Size of the in-memory cache of image data,
+            shared by all sessions.
+    """
+
+    def __init__(self, max_sessions: int = 128, max_blob_bytes: int = 64 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.max_blob_bytes = max_blob_bytes
+        # session id -> (messages, writer token, read offset)
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._blobs: "OrderedDict[str, str]" = OrderedDict()
+        self._blob_bytes = 0
+        self._stored = set()
+        self._lock = threading.Lock()
+
+    # Storage, implemented by subclasses.
+
+    def _append(self, session_id: str, record: Dict):
+        raise NotImplementedError
+
+    def _read(self, session_id: str, offset) -> Tuple[List[Dict], object, bool]:
+        """Records after `offset` (None for all), the new offset, and whether the log was replaced."""
+        raise NotImplementedError
+
+    def _put_blob(self, key: str, data: str):
+        raise NotImplementedError
+
+    def _get_blob(self, key: str) -> str:
+        raise NotImplementedError
+
+    def _rewrite(self, session_id: str, records: List[Dict]):
+        """Atomically replace a session's log."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        """Delete a session's history. Images stay, as other sessions may use them."""
+        raise NotImplementedError
+
+    # Encoding of messages with out-of-line images.
+
+    def _blob(self, key: str) -> str:
+        with self._lock:
+            data = self._blobs.get(key)
+            if data is not None:
+                self._blobs.move_to_end(key)
+                return data
+        data = self._get_blob(key)
+        with self._lock:
+            cached = self._blobs.get(key)
+            if cached is not None:
+                # Read by another thread meanwhile.
+                return cached
+            self._blobs[key] = data
+            self._blob_bytes += len(data)
+            while self._blob_bytes > self.max_blob_bytes and len(self._blobs) > 1:
+                self._blob_bytes -= len(self._blobs.popitem(last=False)[1])
+        return data
+
+    def _encode(self, message: Message) -> Dict:
+        encoded = message.to_dict()
+        content = []
+        for block in encoded["content"]:
+            if block["type"] == "image":
+                source = block["source"]
+                key = hashlib.sha256(source["data"].encode()).hexdigest()
+                if key not in self._stored:
+                    self._put_blob(key, source["data"])
+                    self._stored.add(key)
+                block = {"type": "image", "source": {"type": source["type"], "media_type": source["media_type"], "blob": key}}
+            content.append(block)
+        return {"role": encoded["role"], "content": content}
+
+    def _decode(self, encoded: Dict) -> Message:
+        for content in encoded["content"]:
+            if content["type"] == "image" and "blob" in content["source"]:
+                source = content["source"]
+                content["source"] = MessageContentSource.deferred(
+                    source["media_type"], functools.partial(self._blob, source["blob"]), source.get("type", "base64"),
+                )
+        return Message.trusted(encoded)
+
+    def _apply(self, messages: Messages, records: List[Dict], skip_writer: Optional[str] = None):
+        # Applied to the list directly, so replaying does not write the log again.
+        for record in records:
+            if record.get("writer") == skip_writer:
+                continue
+            op = record["op"]
+            if op == "clear":
+                messages.messages = []
+            elif op == "pop":
+                if messages.messages:
+                    messages.messages.pop()
+            elif op == "replace" and messages.messages:
+                messages.messages[-1] = self._decode(record["message"])
+            else:
+                messages.messages.append(self._decode(record["message"]))
+
+    # Public API.
+
+    def open(self, session_id: str) -> Messages:
+        """
+        The history of a session, empty for a new one. Changes made to it
+        through Messages or Chat are written to the store.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+
+        if entry is None:
+            messages = Messages()
+            writer = uuid.uuid4().hex
+            records, offset, _ = self._read(session_id, None)
+            self._apply(messages, records)
+            messages._journal = self._journal(session_id, writer)
+            entry = [messages, writer, offset]
+        else:
+            messages, writer, offset = entry
+            records, entry[2], replaced = self._read(session_id, offset)
+            if replaced:
+                messages.messages = []
+            self._apply(messages, records, skip_writer=None if replaced else writer)
+
+        with self._lock:
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return messages
+
+    def _journal(self, session_id: str, writer: str):
+        def journal(op: str, message: Optional[Message] = None):
+            record = {"op": op, "writer": writer}
+            if message is not None:
+                record["message"] = self._encode(message)
+            self._append(session_id, record)
+        return journal
+
+    def evict(self, session_id: Optional[str] = None):
+        """Drop one session, or every session, from memory. Nothing is lost."""
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+    def compact(self, session_id: str):
+        """
+        Rewrite a session's log as its current messages, dropping replaced
+        streaming checkpoints and cleared turns.
+        """
+        messages = Messages()
+        records, _, _ = self._read(session_id, None)
+        self._apply(messages, records)
+        writer = uuid.uuid4().hex
+        self._rewrite(
+            session_id,
+            [{"op": "clear", "writer": writer}]
+            + [{"op": "add", "writer": writer, "message": self._encode(m)} for m in messages.messages],
+        )
+        self.evict(session_id)
+
+
+class FileSessionStore(SessionStore):
+    """
+    Stores each session as a JSON lines file, and each image as a file named
+    by its hash, under `directory`. The directory can be on storage shared by
+    several replicas.
+
+    Attributes:
+        directory (str): Root directory of the store.
+    """
+
+    def __init__(self, directory: str = "sessions", **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "logs"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, "logs", quote(session_id, safe="") + ".jsonl")
+
+    def _append(self, session_id: str, record: Dict):
+        # One write per record on a file opened for appending, so records
+        # from several writers do not interleave.
+        with open(self._path(session_id), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _read(self, session_id: str, offset):
+        try:
+            f = open(self._path(session_id), "rb")
+        except FileNotFoundError:
+            return [], None, offset is not None
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            replaced = offset is not None and offset[0] != inode
+            position = 0 if offset is None or replaced else offset[1]
+            f.seek(position)
+            data = f.read()
+        # A record still being written has no newline yet; read it next time.
+        end = data.rfind(b"\n") + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return records, (inode, position + end), replaced
+
+    def _put_blob(self, key: str, data: str):
+        path = os.path.join(self.directory, "blobs", key)
+        if not os.path.exists(path):
+            temp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp, "w") as f:
+                f.write(data)
+            os.replace(temp, path)
+
+    def _get_blob(self, key: str) -> str:
+        with open(os.path.join(self.directory, "blobs", key)) as f:
+            return f.read()
+
+    def _rewrite(self, session_id: str, records: List[Dict]):
+        path = self._path(session_id)
+        temp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        os.replace(temp, path)
+
+    def delete(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+        self.evict(session_id)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Stores sessions and images in a sqlite database, shareable between
+    processes on one host.
+
+    Attributes:
+        path (str): Path of the database file.
+    """
+
+    def __init__(self, path: str = "sessions.sqlite", **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS records "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, record TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS records_session ON records (session_id, id)")
+            db.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, data TEXT)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def _append(self, session_id: str, record: Dict):
+        with self._connection() as db:
+            db.execute("INSERT INTO records (session_id, record) VALUES (?, ?)", (session_id, json.dumps(record)))
+
+    def _read(self, session_id: str, offset):
+        rows = self._connection().execute(
+            "SELECT id, record FROM records WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, offset or 0),
+        ).fetchall()
+        if not rows:
+            return [], offset, False
+        # Rewritten logs start with a "clear" record, so replaying them
+        # after older records is still correct.
+        return [json.loads(record) for _, record in rows], rows[-1][0], False
+
+    def _put_blob(self, key: str, data: str):
+        with self._connection() as db:
+            db.execute("INSERT OR IGNORE INTO blobs (key, data) VALUES (?, ?)", (key, data))
+
+    def _get_blob(self, key: str) -> str:
+        return self._connection().execute("SELECT data FROM blobs WHERE key = ?", (key,)).fetchone()[0]
+
+    def _rewrite(self, session_id: str, records: List[Dict]):
+        with self._connection() as db:
+            db.execute("DELETE FROM records WHERE session_id = ?", (session_id,))
+            db.executemany(
+                "INSERT INTO records (session_id, record) VALUES (?, ?)",
+                [(session_id, json.dumps(record)) for record in records],
+            )
+
+    def delete(self, session_id: str):
+        self._rewrite(session_id, [{"op": "clear"}])
+        self.evict(session_id)
@@ -0,0 +1,332 @@
+import asyncio
+import contextvars
+import threading
+import time
+from pydantic import BaseModel, PrivateAttr
+from typing import Any, Callable, List, Literal, Optional
+
+# The StreamControl of the stream being read in this context. The LLM classes
+# register their response body with it, so cancel() can close the connection
+# even while another thread is blocked reading from it.
+_current = contextvars.ContextVar("stream_control", default=None)
+
+# Stop reasons that end a stream before the model finished it.
+INTERRUPTED = ("cancelled", "timeout", "abandoned")
+
+
+def current_stream_control() -> Optional["StreamControl"]:
+    return _current.get()
+
+
+class StreamCancelled(Exception):
+    """
+    Raised by a stream whose StreamControl cancelled it, so that wrappers such
+    as CachedLLM and ResilientLLM do not take the truncated response for a
+    complete one. StreamControl.iterate ends the stream quietly on it.
+    """
+
+    def __init__(self, reason: Optional[str] = None):
+        super().__init__(f"stream {reason or 'cancelled'}")
+        self.reason = reason
+
+
+class StreamControl(BaseModel):
+    """
+    Stop conditions and a cancel handle for one streamed Chat turn.
+
+    Pass one to Chat.generate_stream or Chat.agenerate_stream. `cancel()` can
+    be called from any thread, for example by a stop button, and closes the
+    upstream response stream at once, so the model stops generating and the
+    connection is released. A stream whose consumer stops reading is closed
+    the same way.
+
+    Stop sequences are matched on the text as it streams, across chunk
+    boundaries; text that could be the start of a stop sequence is held back
+    until it is known not to be. Time limits cancel the stream when they
+    expire, even while it is waiting for the model.
+
+    After the stream ends, `stop_reason` tells why: "end_turn" when the model
+    finished, "stop_sequence", "cancelled", "timeout", or "abandoned" when
+    the consumer stopped reading.
+
+    Attributes:
+        stop_sequences (List[str]): End the response before any of these.
+        max_seconds (Optional[float]): Cancel the stream this long after it
+            started.
+        first_chunk_timeout (Optional[float]): Cancel the stream if no text
+            arrived this long after it started.
+        max_chunk_gap (Optional[float]): Cancel the stream if no text arrived
+            this long after the previous text.
+        partial (Literal): What Chat keeps of an interrupted turn. "keep"
+            commits the text received so far, and drops the user turn if
+            nothing was received, so the history still alternates. "discard"
+            drops both the partial response and the user turn.
+        stop_reason (Optional[str]): Why the stream ended, once it has.
+    """
+    stop_sequences: List[str] = []
+    max_seconds: Optional[float] = None
+    first_chunk_timeout: Optional[float] = None
+    max_chunk_gap: Optional[float] = None
+    partial: Literal["keep", "discard"] = "keep"
+    stop_reason: Optional[str] = None
+
+    _cancelled: bool = PrivateAttr(default=False)
+    _closers: List[Callable] = PrivateAttr(default_factory=list)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _timers: List = PrivateAttr(default_factory=list)
+    _schedule: Optional[Callable] = PrivateAttr(default=None)
+    _gap_timer: Optional[Any] = PrivateAttr(default=None)
+    _task: Optional[asyncio.Task] = PrivateAttr(default=None)
+    _loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
+    _awaiting: bool = PrivateAttr(default=False)
+    _first_chunk_at: Optional[float] = PrivateAttr(default=None)
+    _last_chunk_at: Optional[float] = PrivateAttr(default=None)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def interrupted(self) -> bool:
+        """True if the stream ended before the model finished it."""
+        return self.stop_reason in INTERRUPTED
+
+    def cancel(self, reason: str = "cancelled"):
+        """Stop the stream and close its upstream connection. Safe to call from any thread, and more than once."""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            if self.stop_reason is None:
+                self.stop_reason = reason
+            closers, self._closers = self._closers, []
+        for close in closers:
+            try:
+                close()
+            except Exception:
+                pass
+        if self._loop is not None:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self._loop:
+                self._interrupt_task()
+            elif not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._interrupt_task)
+
+    def attach(self, close: Optional[Callable]):
+        """Register a function that closes the upstream stream. Called by the LLM classes."""
+        if close is None:
+            return
+        with self._lock:
+            if not self._cancelled:
+                self._closers.append(close)
+                return
+        close()
+
+    # Stop sequences.
+
+    def _holdback(self, text: str) -> int:
+        """Length of the longest end of `text` that starts a stop sequence."""
+        longest = 0
+        for sequence in self.stop_sequences:
+            for length in range(min(len(sequence) - 1, len(text)), longest, -1):
+                if text.endswith(sequence[:length]):
+                    longest = length
+                    break
+        return longest
+
+    def _scan(self, pending: str):
+        """Split pending text into (text to emit, text to hold back, stopped)."""
+        stop = -1
+        for sequence in self.stop_sequences:
+            index = pending.find(sequence)
+            if index != -1 and (stop == -1 or index < stop):
+                stop = index
+        if stop != -1:
+            return pending[:stop], "", True
+        held = self._holdback(pending)
+        return pending[:len(pending) - held], pending[len(pending) - held:], False
+
+    # Deadlines.
+
+    def _deadlines(self, schedule):
+        self._schedule = schedule
+        if self.max_seconds is not None:
+            self._arm(self.max_seconds, self._expire, False)
+        if self.first_chunk_timeout is not None:
+            self._arm(self.first_chunk_timeout, self._expire, True)
+
+    def _arm(self, delay: float, fn, arg):
+        with self._lock:
+            if self._schedule is not None:
+                self._timers.append(self._schedule(delay, fn, arg))
+
+    def _arm_gap(self, delay: float):
+        with self._lock:
+            if self._schedule is not None:
+                self._gap_timer = self._schedule(delay, self._check_gap, self.max_chunk_gap)
+
+    def _disarm(self):
+        with self._lock:
+            timers, self._timers, self._schedule = self._timers, [], None
+            if self._gap_timer is not None:
+                timers.append(self._gap_timer)
+                self._gap_timer = None
+        for timer in timers:
+            timer.cancel()
+
+    def _expire(self, only_before_first_chunk: bool):
+        if only_before_first_chunk and self._first_chunk_at is not None:
+            return
+        self.cancel("timeout")
+
+    def _check_gap(self, gap: float):
+        # Armed at the first chunk, then re-armed for the rest of the gap
+        # allowed since the latest one, rather than once per chunk.
+        remaining = gap - (time.monotonic() - self._last_chunk_at)
+        if remaining <= 0:
+            self.cancel("timeout")
+        else:
+            self._arm_gap(remaining)
+
+    def _start(self):
+        # A control serves one stream; a cancel() before it started still applies.
+        self._first_chunk_at = None
+        self._last_chunk_at = None
+
+    def _chunk(self, chunk: str):
+        if chunk:
+            now = time.monotonic()
+            self._last_chunk_at = now
+            if self._first_chunk_at is None:
+                self._first_chunk_at = now
+                if self.max_chunk_gap is not None:
+                    self._arm_gap(self.max_chunk_gap)
+
+    # Iteration.
+
+    def iterate(self, stream):
+        """
+        Apply the stop conditions to a stream of text deltas.
+
+        Parameters:
+            stream: A generate_stream_deltas generator.
+
+        Yields:
+            str: The deltas, cut at the first stop sequence.
+        """
+        self._start()
+        self._deadlines(_start_timer)
+        pending = ""
+        try:
+            while not self._cancelled:
+                token = _current.set(self)
+                try:
+                    chunk = next(stream)
+                except StopIteration:
+                    break
+                except Exception:
+                    if self._cancelled:
+                        break
+                    raise
+                finally:
+                    _current.reset(token)
+                self._chunk(chunk)
+                if self._cancelled:
+                    break
+                if not self.stop_sequences:
+                    yield chunk
+                    continue
+                text, pending, stopped = self._scan(pending + chunk)
+                if text:
+                    yield text
+                if stopped:
+                    self.stop_reason = "stop_sequence"
+                    return
+            if pending and not self._cancelled:
+                yield pending
+            if self.stop_reason is None:
+                self.stop_reason = "end_turn"
+        except GeneratorExit:
+            if self.stop_reason is None:
+                self.stop_reason = "abandoned"
+            raise
+        finally:
+            self._disarm()
+            self._closers = []
+            stream.close()
+
+    async def aiterate(self, stream):
+        """
+        Async version of iterate, for agenerate_stream_deltas generators.
+        cancel() interrupts a pending read at once by cancelling the reading
+        task, and only while it is waiting on the stream.
+        """
+        self._start()
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._deadlines(lambda delay, fn, arg: self._loop.call_later(delay, fn, arg))
+        pending = ""
+        try:
+            while not self._cancelled:
+                self._awaiting = True
+                token = _current.set(self)
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                except asyncio.CancelledError:
+                    if not self._cancelled:
+                        raise
+                    # Our own interruption: absorb it and end the stream.
+                    uncancel = getattr(self._task, "uncancel", None)
+                    if uncancel is not None:
+                        uncancel()
+                    break
+                except Exception:
+                    if self._cancelled:
+                        break
+                    raise
+                finally:
+                    _current.reset(token)
+                    self._awaiting = False
+                self._chunk(chunk)
+                if self._cancelled:
+                    break
+                if not self.stop_sequences:
+                    yield chunk
+                    continue
+                text, pending, stopped = self._scan(pending + chunk)
+                if text:
+                    yield text
+                if stopped:
+                    self.stop_reason = "stop_sequence"
+                    return
+            if pending and not self._cancelled:
+                yield pending
+            if self.stop_reason is None:
+                self.stop_reason = "end_turn"
+        except GeneratorExit:
+            if self.stop_reason is None:
+                self.stop_reason = "abandoned"
+            raise
+        finally:
+            self._disarm()
+            self._task = None
+            self._loop = None
+            await stream.aclose()
+
+    def _interrupt_task(self):
+        # Runs on the event loop. Only a task suspended on the upstream read
+        # is cancelled; otherwise the flag ends the stream at its next chunk.
+        if self._awaiting and self._task is not None:
+            self._task.cancel()
+
+
+def _start_timer(delay: float, fn, arg) -> threading.Timer:
+    timer = threading.Timer(delay, fn, (arg,))
+    timer.daemon = True
+    timer.start()
+    return timer
@@ -0,0 +1,77 @@
+import json
+from typing import Any, Callable, Optional, Tuple
+
+# The bytes around the text of a plain text delta event, as Bedrock sends it,
+# for example b'{"outputs":[{"text":"' and b'","stop_reason":null}]}'.
+DeltaFrame = Tuple[bytes, bytes]
+
+
+class StreamDecoder:
+    """
+    Decodes the payloads of Bedrock response stream events with the standard
+    library json module. Subclass it to plug another decoder into the LLM
+    classes through `llm.stream_decoder`.
+
+    Methods:
+        loads(payload): Decode a whole event payload.
+        delta_text(payload, frame): The text of a plain text delta event, or
+            None to have the event decoded in full.
+    """
+
+    def loads(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+    def delta_text(self, payload: bytes, frame: Optional[DeltaFrame]) -> Optional[str]:
+        return None
+
+
+class FastStreamDecoder(StreamDecoder):
+    """
+    Reads the text of delta events, most of a stream, straight from the
+    payload bytes, without decoding the rest of the event. Any event that is
+    not exactly a text delta in the model's frame, such as message_start,
+    message_delta, an error or a delta with unexpected keys, is decoded in
+    full, with orjson when it is installed.
+
+    Attributes:
+        loads: The function decoding whole payloads.
+    """
+
+    def __init__(self, loads: Optional[Callable[[bytes], Any]] = None):
+        if loads is None:
+            try:
+                import orjson
+                loads = orjson.loads
+            except ImportError:
+                loads = json.loads
+        self.loads = loads
+
+    def delta_text(self, payload: bytes, frame: Optional[DeltaFrame]) -> Optional[str]:
+        if frame is None:
+            return None
+        prefix, suffix = frame
+        if not (payload.startswith(prefix) and payload.endswith(suffix)):
+            return None
+        text = payload[len(prefix):len(payload) - len(suffix)]
+        if b"\\" in text:
+            # Escapes need a JSON decode, which also rejects an unescaped quote
+            # that would mean the text ended before the suffix.
+            try:
+                text = json.loads(b'"' + text + b'"')
+            except ValueError:
+                return None
+            return text if isinstance(text, str) else None
+        if b'"' in text:
+            return None
+        return text.decode()
+
+
+_default = None
+
+
+def default_stream_decoder() -> StreamDecoder:
+    """The FastStreamDecoder shared by LLMs that were not given another decoder."""
+    global _default
+    if _default is None:
+        _default = FastStreamDecoder()
+    return _default
@@ -0,0 +1,345 @@
+import asyncio
+import hashlib
+import io
+import json
+import threading
+import time
+from botocore.exceptions import ClientError, EventStreamError
+from typing import Dict, List, Optional
+
+from .transport import AsyncTransport
+
+
+class StubBedrockRuntime:
+    """
+    Local stand-in for the boto3 "bedrock-runtime" client, for running the LLM
+    classes without AWS access. Assign it to `llm.bedrock_runtime`.
+
+    Responses are synthesised in the format of the requested model family
+    (Claude messages events or Mistral outputs) from `text`, split into
+    `chunk_size` character chunks, or replayed from `recordings` made with
+    RecordingBedrockRuntime. Latency and failures can be injected to exercise
+    streaming, retry and throttling behaviour. `as_async_transport()` serves
+    the same responses to the async methods without worker threads.
+
+    With `prompt_cache` set, synthesised Claude responses report the usage
+    Bedrock would for the request's cache_control breakpoints: the prefix up
+    to each breakpoint is remembered, a later request with the same prefix
+    reads it, and the rest up to the last breakpoint is written. Tokens are
+    estimated at four characters each.
+
+    Attributes:
+        text (str): Text of every synthesised response.
+        chunk_size (int): Characters per streamed chunk.
+        recordings (Optional[List[Dict]]): Recorded exchanges to replay in
+            turn, see load_recordings. Replaces the synthesised responses.
+        first_chunk_latency (float): Seconds before the first event of a
+            stream, and before an invoke_model response.
+        chunk_latency (float): Seconds between stream events.
+        throttle_first (int): Number of initial requests rejected with a
+            ThrottlingException.
+        throttle_every (int): Additionally reject every n-th request. 0 disables.
+        fail_stream_after (Optional[int]): Raise a ModelStreamErrorException
+            after this many chunks of each stream.
+        prompt_cache (bool): Simulate Claude prompt caching.
+        input_token_latency (float): Additional seconds before the first event
+            for each input token not read from the simulated prompt cache.
+        requests (List[Dict]): Every request received, in order.
+        chunks_sent (int): Text chunks delivered over all streams.
+        streams_closed_early (int): Streams closed by the client before
+            their last event.
+    """
+
+    def __init__(
+        self,
+        text: str = "Hello! How can I help you today?",
+        chunk_size: int = 4,
+        recordings: Optional[List[Dict]] = None,
+        first_chunk_latency: float = 0.0,
+        chunk_latency: float = 0.0,
+        throttle_first: int = 0,
+        throttle_every: int = 0,
+        fail_stream_after: Optional[int] = None,
+        prompt_cache: bool = False,
+        input_token_latency: float = 0.0,
+    ):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.recordings = recordings
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_latency = chunk_latency
+        self.throttle_first = throttle_first
+        self.throttle_every = throttle_every
+        self.fail_stream_after = fail_stream_after
+        self.prompt_cache = prompt_cache
+        self.input_token_latency = input_token_latency
+        self.requests: List[Dict] = []
+        self.chunks_sent = 0
+        self.streams_closed_early = 0
+        self._lock = threading.Lock()
+        self._cached_prefixes = set()
+
+    def _admit(self, operation: str, kwargs: Dict) -> int:
+        with self._lock:
+            self.requests.append(kwargs)
+            count = len(self.requests)
+        self._check_throttle(operation, count)
+        return count
+
+    def _check_throttle(self, operation: str, count: int):
+        if count <= self.throttle_first or (self.throttle_every and count % self.throttle_every == 0):
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."}},
+                operation,
+            )
+
+    def _chunks(self) -> List[str]:
+        return [self.text[i:i + self.chunk_size] for i in range(0, len(self.text), self.chunk_size)]
+
+    def _recording(self, count: int) -> Optional[Dict]:
+        if not self.recordings:
+            return None
+        return self.recordings[(count - 1) % len(self.recordings)]
+
+    def _usage(self, kwargs: Dict) -> Optional[Dict[str, int]]:
+        """Input usage of a Claude request under the simulated prompt cache, or None."""
+        if not self.prompt_cache or kwargs["modelId"].startswith("mistral."):
+            return None
+        body = json.loads(kwargs["body"])
+        system = body.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        blocks = list(system) + [
+            {"role": message["role"], **block}
+            for message in body.get("messages", [])
+            for block in (message["content"] if isinstance(message["content"], list) else [{"type": "text", "text": message["content"]}])
+        ]
+
+        prefix = hashlib.sha256()
+        tokens = 0
+        breakpoints = []
+        for block in blocks:
+            marked = block.pop("cache_control", None) is not None
+            encoded = json.dumps(block)
+            prefix.update(encoded.encode())
+            tokens += len(encoded) // 4
+            if marked:
+                breakpoints.append((prefix.hexdigest(), tokens))
+
+        read = written = 0
+        with self._lock:
+            for key, position in breakpoints:
+                if key in self._cached_prefixes:
+                    read = position
+                self._cached_prefixes.add(key)
+        if breakpoints:
+            written = breakpoints[-1][1] - read
+        return {"input_tokens": tokens - read - written, "cache_read_input_tokens": read, "cache_creation_input_tokens": written}
+
+    def _latency(self, usage: Optional[Dict[str, int]]) -> float:
+        if usage is None:
+            return self.first_chunk_latency
+        return self.first_chunk_latency + self.input_token_latency * (usage["input_tokens"] + usage["cache_creation_input_tokens"])
+
+    def _events(self, model_id: str, count: int = 1, usage: Optional[Dict[str, int]] = None) -> List[Dict]:
+        recording = self._recording(count)
+        if recording is not None:
+            return recording["events"]
+        chunks = self._chunks()
+        if model_id.startswith("mistral."):
+            return [{"outputs": [{"text": chunk, "stop_reason": None}]} for chunk in chunks]
+        return (
+            [
+                {"type": "message_start", "message": {"role": "assistant", "content": [], "usage": {"input_tokens": 0, "output_tokens": 1, **(usage or {})}}},
+                {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+            ]
+            + [{"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}} for chunk in chunks]
+            + [
+                {"type": "content_block_stop", "index": 0},
+                {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(chunks)}},
+                {"type": "message_stop"},
+            ]
+        )
+
+    def _body(self, model_id: str, count: int, usage: Optional[Dict[str, int]] = None) -> Dict:
+        recording = self._recording(count)
+        if recording is not None and "body" in recording:
+            return recording["body"]
+        if model_id.startswith("mistral."):
+            return {"outputs": [{"text": self.text, "stop_reason": "stop"}]}
+        body = {"role": "assistant", "content": [{"type": "text", "text": self.text}]}
+        if usage is not None:
+            body["usage"] = {**usage, "output_tokens": len(self._chunks())}
+        return body
+
+    def _stream_events(self, kwargs: Dict, count: int):
+        """Yield (delay, event, is_chunk) for one stream, raising injected stream errors."""
+        usage = self._usage(kwargs)
+        first_chunk_latency = self._latency(usage)
+        chunks = 0
+        for index, event in enumerate(self._events(kwargs["modelId"], count, usage)):
+            is_chunk = "outputs" in event or event.get("type") == "content_block_delta"
+            if is_chunk and self.fail_stream_after is not None and chunks >= self.fail_stream_after:
+                raise EventStreamError(
+                    {"Error": {"Code": "ModelStreamErrorException", "Message": "The model stream failed."}},
+                    "InvokeModelWithResponseStream",
+                )
+            chunks += is_chunk
+            # Encoded without whitespace, as Bedrock sends events.
+            yield (first_chunk_latency if index == 0 else self.chunk_latency), {"chunk": {"bytes": json.dumps(event, separators=(",", ":")).encode()}}, is_chunk
+
+    def _sent(self, is_chunk: bool):
+        if is_chunk:
+            with self._lock:
+                self.chunks_sent += 1
+
+    def _closed_early(self):
+        with self._lock:
+            self.streams_closed_early += 1
+
+    def invoke_model(self, **kwargs):
+        count = self._admit("InvokeModel", kwargs)
+        usage = self._usage(kwargs)
+        time.sleep(self._latency(usage))
+        return {"body": io.BytesIO(json.dumps(self._body(kwargs["modelId"], count, usage)).encode())}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        count = self._admit("InvokeModelWithResponseStream", kwargs)
+        return {"body": _StubEventStream(self, self._stream_events(kwargs, count))}
+
+    def as_async_transport(self) -> "StubAsyncTransport":
+        """An AsyncTransport serving the same responses, waiting with asyncio.sleep."""
+        return StubAsyncTransport(self)
+
+
+class StubAsyncTransport(AsyncTransport):
+    """Async view of a StubBedrockRuntime, for the LLM classes' async methods."""
+
+    def __init__(self, runtime: StubBedrockRuntime):
+        self.runtime = runtime
+
+    async def invoke_model(self, **kwargs) -> bytes:
+        count = self.runtime._admit("InvokeModel", kwargs)
+        usage = self.runtime._usage(kwargs)
+        await asyncio.sleep(self.runtime._latency(usage))
+        return json.dumps(self.runtime._body(kwargs["modelId"], count, usage)).encode()
+
+    async def invoke_model_with_response_stream(self, **kwargs):
+        count = self.runtime._admit("InvokeModelWithResponseStream", kwargs)
+        finished = False
+        try:
+            for delay, event, is_chunk in self.runtime._stream_events(kwargs, count):
+                if delay:
+                    await asyncio.sleep(delay)
+                self.runtime._sent(is_chunk)
+                yield event
+            finished = True
+        finally:
+            if not finished:
+                self.runtime._closed_early()
+
+
+class _StubEventStream:
+    """
+    Stream body of StubBedrockRuntime. Like the botocore EventStream it can be
+    closed from another thread, which ends a pending wait at once.
+    """
+
+    def __init__(self, runtime: StubBedrockRuntime, events):
+        self._runtime = runtime
+        self._events = events
+        self._closed = threading.Event()
+        self._finished = False
+
+    def __iter__(self):
+        try:
+            for delay, event, is_chunk in self._events:
+                if (delay and self._closed.wait(delay)) or self._closed.is_set():
+                    return
+                self._runtime._sent(is_chunk)
+                yield event
+        except Exception:
+            self._finished = True
+            raise
+        self._finished = True
+
+    def close(self):
+        if not self._finished and not self._closed.is_set():
+            self._closed.set()
+            self._runtime._closed_early()
+
+
+class RecordingBedrockRuntime:
+    """
+    Wraps a real Bedrock Runtime client and appends every exchange to a JSON
+    lines file, for replay by StubBedrockRuntime without AWS access.
+
+    Each line holds the request's modelId and either the decoded response
+    body or the decoded stream events.
+
+    Attributes:
+        client: The boto3 "bedrock-runtime" client to record.
+        path (str): File the recordings are appended to.
+    """
+
+    def __init__(self, client, path: str):
+        self.client = client
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _save(self, recording: Dict):
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(recording) + "\n")
+
+    def invoke_model(self, **kwargs):
+        response = self.client.invoke_model(**kwargs)
+        body = json.loads(response["body"].read())
+        self._save({"modelId": kwargs["modelId"], "body": body})
+        return {**response, "body": io.BytesIO(json.dumps(body).encode())}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        response = self.client.invoke_model_with_response_stream(**kwargs)
+        return {**response, "body": _RecordedEventStream(self, kwargs["modelId"], response["body"])}
+
+
+class _RecordedEventStream:
+    """
+    Stream body of RecordingBedrockRuntime. The events are saved once the
+    stream has been read to the end; a stream closed before that, for example
+    by a StreamControl, is not recorded.
+    """
+
+    def __init__(self, runtime: RecordingBedrockRuntime, model_id: str, events):
+        self._runtime = runtime
+        self._model_id = model_id
+        self._events = events
+        self._closed = False
+
+    def __iter__(self):
+        recorded = []
+        for event in self._events:
+            recorded.append(json.loads(event["chunk"]["bytes"]))
+            yield event
+        if not self._closed:
+            self._runtime._save({"modelId": self._model_id, "events": recorded})
+
+    def close(self):
+        self._closed = True
+        close = getattr(self._events, "close", None)
+        if close is not None:
+            close()
+
+
+def load_recordings(path: str, model_id: Optional[str] = None) -> List[Dict]:
+    """
+    Load recordings written by RecordingBedrockRuntime.
+
+    Parameters:
+        path (str): The JSON lines file.
+        model_id (Optional[str]): Only keep recordings of this model.
+    """
+    with open(path) as f:
+        recordings = [json.loads(line) for line in f if line.strip()]
+    if model_id is not None:
+        recordings = [r for r in recordings if r["modelId"] == model_id]
+    return recordings
@@ -0,0 +1,154 @@
+import threading
+from pydantic import BaseModel, Field
+from typing import Any, List, Literal, Optional
+
+from .budget import IMAGE_PLACEHOLDER, ContextBudget
+from .messages import Message, Prompt
+
+DEFAULT_INSTRUCTIONS = (
+    "You summarise conversations between a user and an AI assistant. Write a "
+    "concise summary of the conversation below that keeps every fact, "
+    "decision, open question and user preference the assistant will need to "
+    "continue it. If a previous summary is given, merge it into the new one. "
+    "Reply with the summary only."
+)
+
+
+class HistorySummarizer(BaseModel):
+    """
+    Rolling summarisation of long Chat histories, so requests stop growing
+    with the length of the conversation.
+
+    Once the history sent to the model is estimated above `max_tokens`, the
+    turns before the last `keep_last_turns` are summarised by `llm`, usually
+    a cheaper model such as Claude 3 Haiku, together with the previous
+    summary. Later requests send the summary in place of those turns, as a
+    synthetic first turn or appended to the system prompt, followed by the
+    remaining turns verbatim. The stored history is not changed.
+
+    Summaries are written in a background thread started after a turn
+    completes, so no request waits for one. Until a summary is ready the
+    previous one, or the full history, is sent.
+
+    Attributes:
+        llm: The LLM that writes the summaries.
+        max_tokens (int): Estimated size of the history, summary included,
+            above which older turns are summarised.
+        keep_last_turns (int): User/assistant turns always sent verbatim.
+        target (Literal): "turn" sends the summary as a user turn and a short
+            assistant acknowledgement; "system" appends it to the system prompt.
+        instructions (str): System prompt for the summarising model.
+        estimator (ContextBudget): Token estimator for the threshold.
+    """
+    llm: Any
+    max_tokens: int = 8000
+    keep_last_turns: int = 4
+    target: Literal["turn", "system"] = "turn"
+    instructions: str = DEFAULT_INSTRUCTIONS
+    estimator: ContextBudget = Field(default_factory=ContextBudget)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # The summary covers the history up to and including this message.
+        self._summary: Optional[str] = None
+        self._anchor: Optional[Message] = None
+        self._covered = 0
+        self._turn: List[Message] = []
+
+    @property
+    def summary(self) -> Optional[str]:
+        return self._summary
+
+    def _current(self, messages: List[Message]):
+        """The summary and the number of messages it covers, if it applies to this history."""
+        with self._lock:
+            summary, anchor, covered, turn = self._summary, self._anchor, self._covered, self._turn
+        # A history that was reset or edited no longer starts with what was summarised.
+        if summary is None or len(messages) <= covered or messages[covered - 1] is not anchor:
+            return None, 0, []
+        return summary, covered, turn
+
+    def compact(self, messages: List[Message]) -> List[Message]:
+        """The messages to send: the summary in place of the turns it covers, then the rest."""
+        summary, covered, turn = self._current(messages)
+        if summary is None:
+            return messages
+        if self.target == "system":
+            return messages[covered:]
+        return turn + messages[covered:]
+
+    def system_prompt(self, system_prompt: Optional[str], messages: List[Message]) -> Optional[str]:
+        """The system prompt to send, with the summary appended when `target` is "system"."""
+        if self.target != "system":
+            return system_prompt
+        summary, _, _ = self._current(messages)
+        if summary is None:
+            return system_prompt
+        section = f"Summary of the conversation so far:\n{summary}"
+        return f"{system_prompt}\n\n{section}" if system_prompt else section
+
+    def schedule(self, messages: List[Message]):
+        """
+        Start summarising in the background if the history has grown past
+        the threshold. Called by Chat after each turn.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        summary, covered, turn = self._current(messages)
+        sent = turn + messages[covered:] if summary is not None else messages
+        if sum(self.estimator.estimate_message_tokens(m) for m in sent) <= self.max_tokens:
+            return
+
+        # Summarise up to the start of the last kept turns, which begin with a user message.
+        cut = len(messages) - 2 * self.keep_last_turns
+        while cut > covered and messages[cut].role != "user":
+            cut -= 1
+        if cut <= covered:
+            return
+
+        older = list(messages[covered:cut])
+        self._thread = threading.Thread(
+            target=self._summarize, args=(summary, older, messages[cut - 1], cut), daemon=True
+        )
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None):
+        """Wait for a background summary to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _transcript(self, summary: Optional[str], messages: List[Message]) -> str:
+        lines = []
+        if summary:
+            lines += ["Previous summary:", summary, ""]
+        lines.append("Conversation:")
+        for message in messages:
+            text = " ".join(
+                content.text if content.type == "text" else IMAGE_PLACEHOLDER
+                for content in message.content
+            )
+            lines.append(f"{message.role.capitalize()}: {text}")
+        return "\n".join(lines)
+
+    def _summarize(self, summary: Optional[str], messages: List[Message], anchor: Message, covered: int):
+        request = Message.trusted({"role": "user", "content": [{"type": "text", "text": self._transcript(summary, messages)}]})
+        try:
+            response = self.llm.generate(Prompt([request]), system_prompt=self.instructions)
+        except Exception as e:
+            print(f"Summarization failed: {e}")
+            return
+        text = "".join(content.get("text", "") for content in response.get("content", [])).strip()
+        if not text:
+            return
+
+        turn = [
+            Message.trusted({"role": "user", "content": [{"type": "text", "text": f"Summary of our conversation so far:\n{text}"}]}),
+            Message.trusted({"role": "assistant", "content": [{"type": "text", "text": "Understood, I will continue from there."}]}),
+        ]
+        with self._lock:
+            self._summary, self._anchor, self._covered, self._turn = text, anchor, covered, turn
@@ -0,0 +1,284 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .clients import client_retries
+
+# Transports are shared like the clients of src/clients.py, so every LLM with
+# the same settings uses one connection pool.
+_transports: Dict[Tuple, "AsyncTransport"] = {}
+_transports_lock = threading.Lock()
+
+
+class AsyncTransport:
+    """
+    Base class for the asynchronous transports used by the LLM classes.
+
+    A transport sends an already prepared Bedrock request (the keyword arguments
+    built by `_prepare_kwargs`) and returns the raw response. Implement both
+    methods to plug in a different client or a stub.
+
+    Methods:
+        invoke_model(**kwargs): Return the response body as bytes.
+        invoke_model_with_response_stream(**kwargs): Yield the stream events,
+            each in the boto3 shape {"chunk": {"bytes": b"..."}}.
+    """
+
+    async def invoke_model(self, **kwargs) -> bytes:
+        raise NotImplementedError
+
+    async def invoke_model_with_response_stream(self, **kwargs) -> AsyncIterator[Dict]:
+        raise NotImplementedError
+        yield
+
+    async def aclose(self):
+        pass
+
+
+_DONE = object()
+
+
+class _StreamReader(threading.Thread):
+    """
+    Reads one response stream in a thread of its own and hands each event,
+    then _DONE or the error that ended the stream, to a queue on the event loop.
+    """
+
+    def __init__(self, client, kwargs: Dict, loop: asyncio.AbstractEventLoop, events: asyncio.Queue):
+        super().__init__(daemon=True)
+        self.client = client
+        self.kwargs = kwargs
+        self.loop = loop
+        self.events = events
+        self._body = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.events.put_nowait, item)
+        except RuntimeError:
+            # The event loop has closed; nobody is reading any more.
+            pass
+
+    def run(self):
+        try:
+            response = self.client.invoke_model_with_response_stream(**self.kwargs)
+            body = response.get("body")
+            with self._lock:
+                self._body = body
+                closed = self._closed
+            if closed:
+                self._close_body(body)
+                return
+            for event in body:
+                self._put((event, None))
+            self._put((_DONE, None))
+        except BaseException as e:
+            self._put((None, e))
+
+    def close(self):
+        """Close the connection, which also ends a read blocked in the thread."""
+        with self._lock:
+            self._closed = True
+            body = self._body
+        if body is not None:
+            self._close_body(body)
+
+    @staticmethod
+    def _close_body(body):
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+
+class ThreadedTransport(AsyncTransport):
+    """
+    Runs a synchronous boto3 client in threads.
+
+    Each stream is read by a thread of its own, which is blocked for as long
+    as the model takes and hands the events to the event loop as they arrive.
+    Concurrent streams therefore do not queue for the few workers of the
+    default executor. invoke_model calls run in an executor of their own,
+    sized like the client's connection pool.
+
+    Attributes:
+        client: A boto3 "bedrock-runtime" client.
+        max_workers (int): Threads for concurrent invoke_model calls.
+    """
+
+    def __init__(self, client, max_workers: int = 50):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bedrock-invoke")
+
+    def _invoke_model(self, kwargs: Dict) -> bytes:
+        return self.client.invoke_model(**kwargs).get("body").read()
+
+    async def invoke_model(self, **kwargs) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._invoke_model, kwargs)
+
+    async def invoke_model_with_response_stream(self, **kwargs) -> AsyncIterator[Dict]:
+        events = asyncio.Queue()
+        reader = _StreamReader(self.client, kwargs, asyncio.get_running_loop(), events)
+        reader.start()
+        try:
+            while True:
+                event, error = await events.get()
+                if error is not None:
+                    raise error
+                if event is _DONE:
+                    break
+                yield event
+        finally:
+            reader.close()
+
+
+class AioBotocoreTransport(AsyncTransport):
+    """
+    Native asyncio transport backed by aiobotocore.
+
+    The client is created on first use inside the running event loop, with
+    the same connection pool settings as the boto3 clients of src/clients.py,
+    and kept open until `aclose` is awaited. Requests that arrive while it is
+    being created wait for the same client.
+
+    Attributes:
+        region_name (str): AWS region where the Bedrock Runtime is available.
+        max_pool_connections (int): Size of the client's HTTP connection pool.
+        tcp_keepalive (bool): Keep idle pooled connections alive.
+        connect_timeout (float): Seconds to wait when opening a connection.
+        read_timeout (float): Seconds to wait for data on an open connection.
+        max_attempts (Optional[int]): Attempts per request, retries included.
+            None keeps botocore's default retries.
+    """
+
+    def __init__(
+        self,
+        region_name: str,
+        max_pool_connections: int = 50,
+        tcp_keepalive: bool = True,
+        connect_timeout: float = 5,
+        read_timeout: float = 120,
+        max_attempts: Optional[int] = None,
+    ):
+        self.region_name = region_name
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self._client_context = None
+        self._client_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _create_client(self):
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+
+        context = get_session().create_client(
+            "bedrock-runtime",
+            region_name=self.region_name,
+            config=AioConfig(
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=self.tcp_keepalive,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                retries=client_retries(self.max_attempts),
+            ),
+        )
+        client = await context.__aenter__()
+        self._client_context = context
+        return client
+
+    async def _get_client(self):
+        # No await between the check and the assignment, so concurrent first
+        # calls share one creation. A client is bound to its event loop.
+        loop = asyncio.get_running_loop()
+        if self._client_task is None or self._loop is not loop:
+            self._loop = loop
+            self._client_context = None
+            self._client_task = loop.create_task(self._create_client())
+        return await asyncio.shield(self._client_task)
+
+    async def invoke_model(self, **kwargs) -> bytes:
+        client = await self._get_client()
+        response = await client.invoke_model(**kwargs)
+        return await response["body"].read()
+
+    async def invoke_model_with_response_stream(self, **kwargs) -> AsyncIterator[Dict]:
+        client = await self._get_client()
+        response = await client.invoke_model_with_response_stream(**kwargs)
+        body = response["body"]
+        try:
+            async for event in body:
+                yield event
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                result = close()
+                if asyncio.iscoroutine(result):
+                    await result
+
+    async def aclose(self):
+        context = self._client_context
+        self._client_context = None
+        self._client_task = None
+        self._loop = None
+        if context is not None:
+            await context.__aexit__(None, None, None)
+
+
+class StubTransport(AsyncTransport):
+    """
+    Transport that returns canned responses, for running without AWS access.
+
+    Attributes:
+        body (bytes): Body returned by invoke_model.
+        events (List[bytes]): Raw event payloads yielded by the stream.
+        latency (float): Seconds to wait before each response and each event.
+        requests (List[Dict]): Every request received, in order.
+    """
+
+    def __init__(self, body: bytes = b"{}", events: Optional[List[bytes]] = None, latency: float = 0.0):
+        self.body = body
+        self.events = events or []
+        self.latency = latency
+        self.requests: List[Dict[str, Any]] = []
+
+    async def invoke_model(self, **kwargs) -> bytes:
+        self.requests.append(kwargs)
+        await asyncio.sleep(self.latency)
+        return self.body
+
+    async def invoke_model_with_response_stream(self, **kwargs) -> AsyncIterator[Dict]:
+        self.requests.append(kwargs)
+        for event in self.events:
+            await asyncio.sleep(self.latency)
+            yield {"chunk": {"bytes": event}}
+
+
+def default_transport(
+    region_name: str,
+    client,
+    max_pool_connections: int = 50,
+    tcp_keepalive: bool = True,
+    max_attempts: Optional[int] = None,
+) -> AsyncTransport:
+    """
+    Return the shared transport for the given settings. Uses aiobotocore when
+    it is installed, otherwise runs the boto3 client in threads.
+    """
+    try:
+        import aiobotocore  # noqa: F401
+    except ImportError:
+        key = ("threaded", client, max_pool_connections)
+        factory = lambda: ThreadedTransport(client, max_workers=max_pool_connections)
+    else:
+        key = ("aiobotocore", region_name, max_pool_connections, tcp_keepalive, max_attempts)
+        factory = lambda: AioBotocoreTransport(region_name, max_pool_connections, tcp_keepalive, max_attempts=max_attempts)
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = _transports[key] = factory()
+    return transport
@@ -0,0 +1,33 @@
+from src.cache import CachedLLM, request_key
+from src.llm_bedrock_claude import ClaudeLLM
+from src.llm_bedrock_mistral import MistralLLM
+from src.resilience import ResilientLLM
+from tests.test_fanout import stub_llm
+
+PROMPT = {"messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}
+
+
+def key(llm):
+    return request_key(llm, PROMPT, "sys")
+
+
+def test_key_covers_every_request_setting():
+    assert key(MistralLLM()) != key(MistralLLM(prompt_template="{{ messages }}"))
+    assert key(MistralLLM()) != key(MistralLLM(bos_token="<bos>"))
+    assert key(MistralLLM()) != key(MistralLLM(temperature=0.1))
+    assert key(ClaudeLLM()) != key(ClaudeLLM(anthropic_version="bedrock-2099-01-01"))
+    assert key(ClaudeLLM()) != key(ClaudeLLM(max_tokens=10))
+
+
+def test_key_ignores_connection_settings_and_wrappers():
+    assert key(ClaudeLLM()) == key(ClaudeLLM(region_name="eu-west-1", max_pool_connections=5))
+    assert key(MistralLLM()) == key(MistralLLM(incremental_prompt=False))
+    assert key(ClaudeLLM()) == key(ResilientLLM(llm=ClaudeLLM()))
+
+
+def test_templates_do_not_share_entries():
+    plain, runtime = stub_llm(MistralLLM, text="plain")
+    templated, _ = stub_llm(MistralLLM, text="templated", prompt_template="{{ messages[0]['content'][0]['text'] }}")
+    cache = CachedLLM(llm=plain).cache
+    assert CachedLLM(llm=plain, cache=cache).generate(PROMPT, "sys")["content"][0]["text"] == "plain"
+    assert CachedLLM(llm=templated, cache=cache).generate(PROMPT, "sys")["content"][0]["text"] == "templated"
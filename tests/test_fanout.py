@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+
+from src.chat import Chat
+from src.fanout import FanOutChat
+from src.llm_bedrock_claude import ClaudeLLM
+from src.llm_bedrock_mistral import MistralLLM
+from src.stub_runtime import StubBedrockRuntime
+
+HAIKU = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+def stub_llm(cls=ClaudeLLM, text="Hello there", first_chunk_latency=0.0, chunk_latency=0.0, **fields):
+    llm = cls(**fields)
+    runtime = StubBedrockRuntime(text=text, chunk_size=4, first_chunk_latency=first_chunk_latency, chunk_latency=chunk_latency)
+    llm.bedrock_runtime = runtime
+    llm.async_transport = runtime.as_async_transport()
+    return llm, runtime
+
+
+class StalledLLM:
+    """Blocks before any response exists, like a request stuck connecting."""
+
+    modelId = "stalled"
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def generate_stream_deltas(self, prompt, system_prompt=None):
+        time.sleep(self.seconds)
+        yield "late"
+
+    async def agenerate_stream_deltas(self, prompt, system_prompt=None):
+        await asyncio.sleep(self.seconds)
+        yield "late"
+
+
+def texts(chat):
+    return [(message.role, message.content[0].text) for message in chat.messages.messages]
+
+
+def test_streams_are_multiplexed_in_arrival_order():
+    slow, _ = stub_llm(text="slow answer", first_chunk_latency=0.3)
+    fast, _ = stub_llm(text="fast answer", first_chunk_latency=0.01, modelId=HAIKU)
+    fan = FanOutChat.from_llms({"slow": slow, "fast": fast}, system_prompt="Be brief.")
+
+    start = time.perf_counter()
+    events = list(fan.generate_stream("hi"))
+    wall = time.perf_counter() - start
+
+    names = [name for name, chunk in events if chunk]
+    assert names[:3] == ["fast"] * 3
+    assert names[-1] == "slow"
+    assert "".join(chunk for name, chunk in events if name == "fast") == "fast answer"
+    assert "".join(chunk for name, chunk in events if name == "slow") == "slow answer"
+    # Concurrent, so the turn takes as long as the slowest backend only.
+    assert wall < 0.6
+
+
+def test_timings_per_backend():
+    claude, _ = stub_llm(text="claude says hi", first_chunk_latency=0.2)
+    mistral, _ = stub_llm(MistralLLM, text="mistral", first_chunk_latency=0.02)
+    fan = FanOutChat.from_llms({"claude": claude, "mistral": mistral}, system_prompt="Be brief.")
+    list(fan.generate_stream("hi"))
+
+    timings = fan.timings
+    assert timings["claude"].model_id == claude.modelId
+    assert timings["mistral"].model_id == mistral.modelId
+    assert timings["mistral"].ttfc_seconds < timings["claude"].ttfc_seconds
+    assert timings["claude"].ttfc_seconds >= 0.2
+    assert timings["claude"].total_seconds >= timings["claude"].ttfc_seconds
+    assert timings["mistral"].chunks == 2
+    assert all(timing.stop_reason == "end_turn" and timing.error is None for timing in timings.values())
+
+
+def test_each_backend_keeps_its_own_history():
+    first, _ = stub_llm(text="one")
+    second, _ = stub_llm(text="two", modelId=HAIKU)
+    chat = Chat(llm=first, system_prompt="Be brief.")
+    chat.messages.add("earlier")
+    chat.messages.add({"role": "assistant", "content": [{"type": "text", "text": "ok"}]})
+    fan = chat.fan_out({"first": first, "second": second})
+    list(fan.generate_stream("hi"))
+
+    assert texts(fan.chats["first"]) == [("user", "earlier"), ("assistant", "ok"), ("user", "hi"), ("assistant", "one")]
+    assert texts(fan.chats["second"])[-1] == ("assistant", "two")
+    assert len(chat.messages.messages) == 2
+
+
+def test_failing_backend_does_not_stop_the_others():
+    good, _ = stub_llm(text="fine")
+    bad, runtime = stub_llm(text="broken", modelId=HAIKU)
+    runtime.fail_stream_after = 0
+    fan = FanOutChat.from_llms({"good": good, "bad": bad}, system_prompt="Be brief.")
+    events = list(fan.generate_stream("hi"))
+
+    assert "".join(chunk for name, chunk in events if name == "good") == "fine"
+    assert fan.timings["bad"].error is not None
+    assert fan.timings["good"].error is None
+
+
+def test_cancel_one_backend():
+    quick, _ = stub_llm(text="quick")
+    endless, runtime = stub_llm(text="x" * 4000, chunk_latency=0.01, modelId=HAIKU)
+    fan = FanOutChat.from_llms({"quick": quick, "endless": endless}, system_prompt="Be brief.")
+    threading.Timer(0.1, fan.cancel, ("endless",)).start()
+
+    start = time.perf_counter()
+    list(fan.generate_stream("hi"))
+
+    assert time.perf_counter() - start < 2
+    assert fan.timings["endless"].stop_reason == "cancelled"
+    assert fan.timings["quick"].stop_reason == "end_turn"
+    assert runtime.streams_closed_early == 1
+
+
+def test_closing_early_abandons_every_backend():
+    first, first_runtime = stub_llm(text="a" * 400, chunk_latency=0.01)
+    second, second_runtime = stub_llm(text="b" * 400, first_chunk_latency=5, modelId=HAIKU)
+    fan = FanOutChat.from_llms({"first": first, "second": second}, system_prompt="Be brief.")
+
+    start = time.perf_counter()
+    stream = fan.generate_stream("hi")
+    for name, chunk in stream:
+        if chunk:
+            break
+    stream.close()
+
+    assert time.perf_counter() - start < 1
+    assert {timing.stop_reason for timing in fan.timings.values()} == {"abandoned"}
+    assert first_runtime.streams_closed_early == second_runtime.streams_closed_early == 1
+    # The partial response is kept; the backend with no text drops the user turn.
+    assert texts(fan.chats["first"])[-1][0] == "assistant"
+    assert fan.chats["second"].messages.messages == []
+
+
+def test_closing_early_does_not_wait_for_a_stalled_backend():
+    quick, _ = stub_llm(text="q" * 400, chunk_latency=0.01)
+    fan = FanOutChat.from_llms({"quick": quick, "stalled": StalledLLM(3)}, system_prompt="Be brief.")
+    fan.close_timeout = 0.2
+
+    start = time.perf_counter()
+    stream = fan.generate_stream("hi")
+    next(stream)
+    stream.close()
+
+    assert time.perf_counter() - start < 1
+
+
+def test_async_streams_timings_and_abandon():
+    async def run():
+        slow, _ = stub_llm(text="slow answer", first_chunk_latency=0.2)
+        fast, fast_runtime = stub_llm(text="f" * 400, chunk_latency=0.01, modelId=HAIKU)
+        fan = FanOutChat.from_llms({"slow": slow, "fast": fast}, system_prompt="Be brief.")
+
+        events = [event async for event in fan.agenerate_stream("hi")]
+        assert [name for name, chunk in events if chunk][0] == "fast"
+        assert fan.timings["fast"].ttfc_seconds < fan.timings["slow"].ttfc_seconds
+        assert texts(fan.chats["slow"])[-1] == ("assistant", "slow answer")
+
+        stream = fan.agenerate_stream("again")
+        await stream.__anext__()
+        await stream.aclose()
+        assert {timing.stop_reason for timing in fan.timings.values()} == {"abandoned"}
+        assert fast_runtime.streams_closed_early == 1
+
+    asyncio.run(run())
+
+
+def test_async_close_does_not_wait_for_a_stalled_backend():
+    async def run():
+        quick, _ = stub_llm(text="q" * 400, chunk_latency=0.01)
+        fan = FanOutChat.from_llms({"quick": quick, "stalled": StalledLLM(3)}, system_prompt="Be brief.")
+        fan.close_timeout = 0.2
+        start = time.perf_counter()
+        stream = fan.agenerate_stream("hi")
+        await stream.__anext__()
+        await stream.aclose()
+        assert time.perf_counter() - start < 1
+
+    asyncio.run(run())
@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+from src.chat import Chat
+from src.gateway import ChatGateway
+from tests.test_fanout import stub_llm
+
+
+async def serve(text="Hello there", first_chunk_latency=0.0, chunk_latency=0.0, **settings):
+    llm, runtime = stub_llm(text=text, first_chunk_latency=first_chunk_latency, chunk_latency=chunk_latency)
+    gateway = ChatGateway(chat_factory=lambda session_id: Chat(llm=llm, system_prompt="Be brief."), **settings)
+    server = await gateway.start("127.0.0.1", 0)
+    return gateway, server, server.sockets[0].getsockname()[1]
+
+
+async def send(port, method, path, payload=None):
+    body = b"" if payload is None else json.dumps(payload).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    return reader, writer
+
+
+async def call(port, method, path, payload=None):
+    """The status and decoded JSON body of a plain request."""
+    reader, writer = await send(port, method, path, payload)
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    return int(head.split(b" ", 2)[1]), json.loads(body)
+
+
+async def events(reader):
+    """The (event, data) pairs of a server-sent event stream, until it closes."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200")
+    result, event = [], None
+    async for line in reader:
+        line = line.strip()
+        if line.startswith(b"event: "):
+            event = line[7:].decode()
+        elif line.startswith(b"data: "):
+            result.append((event, json.loads(line[6:])))
+    return result
+
+
+def test_streams_a_turn_and_keeps_the_history():
+    async def run():
+        gateway, server, port = await serve(text="Hello there")
+        async with server:
+            reader, writer = await send(port, "POST", "/sessions/a/messages", {"prompt": "hi"})
+            received = await events(reader)
+            writer.close()
+            assert "".join(data["text"] for event, data in received if event == "chunk") == "Hello there"
+            assert received[-1] == ("done", {"stop_reason": "end_turn"})
+
+            status, body = await call(port, "GET", "/sessions/a")
+            assert status == 200
+            assert [message["role"] for message in body["messages"]] == ["user", "assistant"]
+            assert gateway.stats()["streams_completed"] == 1
+
+    asyncio.run(run())
+
+
+def test_second_prompt_to_a_busy_session_gets_409():
+    async def run():
+        gateway, server, port = await serve(first_chunk_latency=0.3)
+        async with server:
+            reader, writer = await send(port, "POST", "/sessions/a/messages", {"prompt": "hi"})
+            await asyncio.sleep(0.1)
+            status, body = await call(port, "POST", "/sessions/a/messages", {"prompt": "again"})
+            assert status == 409
+            status, _ = await call(port, "DELETE", "/sessions/a")
+            assert status == 409
+
+            assert (await events(reader))[-1][0] == "done"
+            writer.close()
+            assert gateway.stats()["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_invalid_messages_get_400():
+    async def run():
+        _, server, port = await serve()
+        async with server:
+            assert (await call(port, "POST", "/sessions/a/messages", {"nothing": 1}))[0] == 400
+            assert (await call(port, "POST", "/sessions/a/messages", {"message": {"content": "hi"}}))[0] == 400
+            message = {"role": "assistant", "content": ["hi"]}
+            assert (await call(port, "POST", "/sessions/a/messages", {"message": message}))[0] == 400
+
+    asyncio.run(run())
+
+
+def test_generations_queue_in_order_and_overflow_gets_503():
+    async def run():
+        gateway, server, port = await serve(first_chunk_latency=0.3, max_concurrent=1, max_queued=1)
+        async with server:
+            first = await send(port, "POST", "/sessions/a/messages", {"prompt": "hi"})
+            await asyncio.sleep(0.1)
+            second = await send(port, "POST", "/sessions/b/messages", {"prompt": "hi"})
+            await asyncio.sleep(0.1)
+            assert gateway.stats()["streaming"] == 1 and gateway.stats()["queued"] == 1
+
+            status, _ = await call(port, "POST", "/sessions/c/messages", {"prompt": "hi"})
+            assert status == 503
+
+            for reader, writer in (first, second):
+                assert (await events(reader))[-1] == ("done", {"stop_reason": "end_turn"})
+                writer.close()
+            stats = gateway.stats()
+            assert stats["streams_completed"] == 2 and stats["rejected"] == 1
+            assert stats["streaming"] == stats["queued"] == 0
+
+    asyncio.run(run())
+
+
+def test_disconnect_while_queued_leaves_the_queue():
+    async def run():
+        gateway, server, port = await serve(first_chunk_latency=0.3, max_concurrent=1)
+        async with server:
+            first = await send(port, "POST", "/sessions/a/messages", {"prompt": "hi"})
+            await asyncio.sleep(0.1)
+            _, writer = await send(port, "POST", "/sessions/b/messages", {"prompt": "hi"})
+            await asyncio.sleep(0.1)
+            assert gateway.stats()["queued"] == 1
+            writer.close()
+            await asyncio.sleep(0.1)
+            assert gateway.stats()["queued"] == 0
+            assert gateway.stats()["streams_cancelled"] == 1
+
+            assert (await events(first[0]))[-1][0] == "done"
+            first[1].close()
+            status, body = await call(port, "GET", "/sessions/b")
+            assert body == {"messages": []}
+
+    asyncio.run(run())
+
+
+def test_cancel_endpoint_stops_the_stream():
+    async def run():
+        gateway, server, port = await serve(text="x" * 4000, chunk_latency=0.01)
+        async with server:
+            reader, writer = await send(port, "POST", "/sessions/a/messages", {"prompt": "hi"})
+            await asyncio.sleep(0.1)
+            assert await call(port, "POST", "/sessions/a/cancel") == (200, {"cancelled": True})
+            received = await events(reader)
+            writer.close()
+            assert received[-1] == ("done", {"stop_reason": "cancelled"})
+            assert gateway.stats()["streams_cancelled"] == 1
+
+    asyncio.run(run())
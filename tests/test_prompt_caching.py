@@ -0,0 +1,38 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from src.chat import Chat
+from src.llm_bedrock_claude import ClaudeLLM
+from tests.test_fanout import stub_llm
+
+HAIKU_3_5 = "anthropic.claude-3-5-haiku-20241022-v1:0"
+
+
+def sent_body(llm, runtime):
+    chat = Chat(llm=llm, system_prompt="Be brief.")
+    for prompt in ("one", "two", "three"):
+        list(chat.generate_stream(prompt))
+    return json.loads(runtime.requests[-1]["body"])
+
+
+@pytest.mark.parametrize("model_id", ["anthropic.claude-3-sonnet-20240229-v1:0", "anthropic.claude-v2", "anthropic.claude-instant-v1"])
+def test_caching_is_rejected_on_unsupported_models(model_id):
+    with pytest.raises(ValidationError, match="does not support prompt caching"):
+        ClaudeLLM(modelId=model_id, prompt_caching="auto")
+
+
+def test_unsupported_model_sends_no_cache_control():
+    llm, runtime = stub_llm(modelId="anthropic.claude-3-sonnet-20240229-v1:0")
+    body = sent_body(llm, runtime)
+    assert body["system"] == "Be brief."
+    assert "cache_control" not in json.dumps(body)
+
+
+def test_auto_caching_marks_system_and_history():
+    llm, runtime = stub_llm(modelId=HAIKU_3_5, prompt_caching="auto")
+    body = sent_body(llm, runtime)
+    assert body["system"] == [{"type": "text", "text": "Be brief.", "cache_control": {"type": "ephemeral"}}]
+    marked = [index for index, message in enumerate(body["messages"]) if "cache_control" in message["content"][-1]]
+    assert marked == [1, 3]
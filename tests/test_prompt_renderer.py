@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+jinja2 = pytest.importorskip("jinja2")
+
+from src.llm_bedrock_mistral import DEFAULT_PROMPT_TEMPLATE, IncrementalPromptRenderer, MistralLLM
+
+TEMPLATE = jinja2.Template(DEFAULT_PROMPT_TEMPLATE)
+
+
+def text(role, value):
+    return {"role": role, "content": [{"type": "text", "text": value}]}
+
+
+def conversation(*texts):
+    return [text("user" if index % 2 == 0 else "assistant", value) for index, value in enumerate(texts)]
+
+
+def reference(messages, system_prompt, bos_token="<s>", eos_token="</s>"):
+    """The template's output, or the type of the error it raised."""
+    try:
+        return TEMPLATE.render(bos_token=bos_token, eos_token=eos_token, system_prompt=system_prompt, messages=messages)
+    except Exception as e:
+        return type(e)
+
+
+def rendered(llm, messages, system_prompt):
+    try:
+        return llm._format_prompt_as_string({"messages": messages}, system_prompt)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize("messages, system_prompt", [
+    (conversation("Hi"), "Talk like a pirate."),
+    (conversation("Hi", "Arr!", "Where is the treasure?"), "Talk like a pirate."),
+    (conversation("Hi", "Arr!", "Where?", "Under the oak.", "Thanks"), ""),
+    (conversation("", "", ""), "sys"),
+    (conversation("{{ bos_token }} {% raw %}", "</s>[INST]", 'quotes " and \\ and \n'), "{{ system_prompt }}"),
+    (conversation("héllo ✓", "日本語"), "système"),
+])
+def test_matches_template(messages, system_prompt):
+    llm = MistralLLM()
+    assert rendered(llm, messages, system_prompt) == reference(messages, system_prompt)
+
+
+def test_matches_template_with_custom_tokens():
+    llm = MistralLLM(bos_token="<bos>", eos_token="<eos>")
+    messages = conversation("Hi", "Hello", "Bye")
+    assert rendered(llm, messages, "sys") == reference(messages, "sys", "<bos>", "<eos>")
+
+
+@pytest.mark.parametrize("messages, system_prompt", [
+    ([], "sys"),
+    ([text("assistant", "Hi")], "sys"),
+    ([text("user", "Hi"), text("user", "Again")], "sys"),
+    ([text("system", "Hi")], "sys"),
+    ([{"role": "user", "content": [{"type": "image", "source": {"media_type": "image/png", "data": "QUJD"}}]}], "sys"),
+    ([{"role": "user", "content": []}], "sys"),
+    (conversation("Hi"), None),
+])
+def test_falls_back_to_template(messages, system_prompt):
+    assert IncrementalPromptRenderer().render(messages, system_prompt, "<s>", "</s>") is None
+    assert rendered(MistralLLM(), messages, system_prompt) == reference(messages, system_prompt)
+
+
+def test_custom_template_is_not_rendered_incrementally():
+    llm = MistralLLM(prompt_template="{% for message in messages %}{{ message['content'][0]['text'] }}|{% endfor %}")
+    assert rendered(llm, conversation("a", "b"), "sys") == "a|b|"
+
+
+def test_reuses_cached_turns():
+    renderer = IncrementalPromptRenderer()
+    messages = conversation("Hi", "Arr!")
+    first = renderer.render(messages, "sys", "<s>", "</s>")
+    messages = conversation("Hi", "Arr!", "Where?", "Under the oak.")
+    second = renderer.render(messages, "sys", "<s>", "</s>")
+    assert second.startswith(first)
+    assert second == reference(messages, "sys")
+
+
+def random_text(rng):
+    return "".join(rng.choice("ab {}%#\n\"'<>&[/INST]") for _ in range(rng.randint(0, 8)))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_randomized_incremental_histories(seed):
+    """
+    Grows, edits, pops and restarts several conversations in random order,
+    with a small cache so entries are also evicted, and checks every
+    rendering against the template.
+    """
+    rng = random.Random(seed)
+    llm = MistralLLM()
+    llm._renderer = IncrementalPromptRenderer(maxsize=3)
+    system_prompts = ["sys", "", "S{{ x }}", None]
+    histories = [([text("user", random_text(rng))], rng.choice(system_prompts[:3])) for _ in range(5)]
+
+    for _ in range(400):
+        index = rng.randrange(len(histories))
+        messages, system_prompt = histories[index]
+        messages = list(messages)
+        action = rng.random()
+        if action < 0.5:
+            role = "user" if len(messages) % 2 == 0 else "assistant"
+            messages.append(text(role, random_text(rng)))
+        elif action < 0.65 and len(messages) > 1:
+            messages.pop()
+        elif action < 0.8:
+            position = rng.randrange(len(messages))
+            messages[position] = text(messages[position]["role"], random_text(rng))
+        elif action < 0.85:
+            # Roles that do not alternate take the template path.
+            messages.append(text(messages[-1]["role"], random_text(rng)))
+        elif action < 0.9:
+            system_prompt = rng.choice(system_prompts)
+        else:
+            messages = [text("user", random_text(rng))]
+        histories[index] = (messages, system_prompt)
+
+        assert rendered(llm, messages, system_prompt) == reference(messages, system_prompt)
@@ -0,0 +1,45 @@
+import base64
+import gc
+
+from src.messages import Message
+from src.render import HistoryRenderer
+
+
+def image_message(size=1000, fill=b"x"):
+    data = base64.b64encode(fill * size).decode()
+    return Message(content=[
+        {"type": "text", "text": "look"},
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": data}},
+    ])
+
+
+def test_parts_are_kept_per_message_version():
+    renderer = HistoryRenderer()
+    message = image_message()
+    parts = renderer.parts(message)
+    assert parts[0] == ("markdown", "look")
+    assert renderer.image(parts[1][1].data) == b"x" * 1000
+    assert renderer.parts(message) is parts
+
+    message.content = Message(content=["changed"]).content
+    assert renderer.parts(message) == [("markdown", "changed")]
+
+
+def test_parts_do_not_keep_messages_alive():
+    renderer = HistoryRenderer()
+    for _ in range(5):
+        renderer.parts(image_message())
+    gc.collect()
+    renderer.parts(image_message())
+    assert len(renderer._parts) == 1
+
+
+def test_decoded_images_are_bounded():
+    renderer = HistoryRenderer(max_image_bytes=2500)
+    messages = [image_message(fill=bytes([index])) for index in range(5)]
+    for message in messages:
+        for kind, value in renderer.parts(message):
+            if kind == "image":
+                renderer.image(value.data)
+    assert renderer._image_bytes <= 2500
+    assert all(not isinstance(value, bytes) for parts in renderer._parts.values() for _, value in parts[3])
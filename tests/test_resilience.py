@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+from src.llm_bedrock_claude import ClaudeLLM
+from src.resilience import CircuitOpenError, ResilientLLM, RetryPolicy
+from tests.test_fanout import stub_llm
+
+PROMPT = {"messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}
+
+
+class _ThrottledBody:
+    def stream(self, **kwargs):
+        yield b'{"message": "Too many requests, please wait before trying again."}'
+
+
+def test_botocore_does_not_retry_under_resilient_llm(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    sent = []
+
+    def throttle(request, **kwargs):
+        sent.append(request.url)
+        return AWSResponse(request.url, 429, {"x-amzn-ErrorType": "ThrottlingException"}, _ThrottledBody())
+
+    llm = ResilientLLM(llm=ClaudeLLM(region_name="ap-south-2"), retry=RetryPolicy(max_attempts=3, base_delay=0.001))
+    assert llm.llm.client_max_attempts == 1
+    llm.llm.bedrock_runtime.meta.events.register("before-send.bedrock-runtime.*", throttle)
+
+    with pytest.raises(ClientError) as error:
+        llm.generate(PROMPT)
+    assert error.value.response["Error"]["Code"] == "ThrottlingException"
+    assert len(sent) == 3
+
+
+def resilient(text="Hello there", failure_threshold=5, reset_timeout=30.0, max_attempts=5, **runtime_settings):
+    llm, runtime = stub_llm(text=text)
+    for name, value in runtime_settings.items():
+        setattr(runtime, name, value)
+    return ResilientLLM(
+        llm=llm,
+        retry=RetryPolicy(max_attempts=max_attempts, base_delay=0.001),
+        failure_threshold=failure_threshold,
+        reset_timeout=reset_timeout,
+    ), runtime
+
+
+def test_throttled_requests_are_retried():
+    llm, runtime = resilient(throttle_first=2)
+    assert "".join(llm.generate_stream_deltas(PROMPT)) == "Hello there"
+    assert len(runtime.requests) == 3
+    assert llm.breaker.failures == 0
+
+
+def test_retries_stop_at_max_attempts():
+    llm, runtime = resilient(throttle_first=10, max_attempts=3)
+    with pytest.raises(ClientError):
+        llm.generate(PROMPT)
+    assert len(runtime.requests) == 3
+
+
+def test_stream_failing_after_its_first_chunk_is_not_retried():
+    llm, runtime = resilient(fail_stream_after=1)
+    received = []
+    with pytest.raises(ClientError):
+        for chunk in llm.generate_stream_deltas(PROMPT):
+            received.append(chunk)
+    assert "".join(received) and len(runtime.requests) == 1
+
+
+def test_async_throttled_requests_are_retried():
+    async def run():
+        llm, runtime = resilient(throttle_first=2)
+        chunks = [chunk async for chunk in llm.agenerate_stream_deltas(PROMPT)]
+        assert "".join(chunks) == "Hello there"
+        assert len(runtime.requests) == 3
+
+    asyncio.run(run())
+
+
+def test_breaker_opens_and_lets_one_trial_through():
+    llm, runtime = resilient(failure_threshold=2, reset_timeout=0.1, max_attempts=1, throttle_first=2)
+    for _ in range(2):
+        with pytest.raises(ClientError):
+            llm.generate(PROMPT)
+    with pytest.raises(CircuitOpenError):
+        llm.generate(PROMPT)
+    assert len(runtime.requests) == 2
+
+    time.sleep(0.15)
+    assert llm.generate(PROMPT)["content"][0]["text"] == "Hello there"
+    assert not llm.breaker.is_open and llm.breaker.failures == 0
+
+
+def test_failed_trial_reopens_the_breaker():
+    llm, runtime = resilient(failure_threshold=1, reset_timeout=0.1, max_attempts=1, throttle_first=2)
+    with pytest.raises(ClientError):
+        llm.generate(PROMPT)
+    time.sleep(0.15)
+    with pytest.raises(ClientError):
+        llm.generate(PROMPT)
+    assert llm.breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        llm.generate(PROMPT)
+
+
+def test_abandoned_trial_lets_the_next_call_be_the_trial():
+    llm, runtime = resilient(text="x" * 400, failure_threshold=1, reset_timeout=0.1, max_attempts=1, throttle_first=1)
+    with pytest.raises(ClientError):
+        llm.generate(PROMPT)
+    time.sleep(0.15)
+
+    stream = llm.generate_stream_deltas(PROMPT)
+    next(stream)
+    with pytest.raises(CircuitOpenError):
+        llm.generate(PROMPT)
+    stream.close()
+
+    assert llm.generate(PROMPT)["content"][0]["text"] == "x" * 400
+    assert not llm.breaker.is_open
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from src.llm_router import RoutingLLM
+from tests.test_fanout import HAIKU, stub_llm
+
+PROMPT = {"messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}
+
+
+def test_late_hedge_is_not_ranked_by_its_head_start():
+    primary, _ = stub_llm(text="primary", first_chunk_latency=0.3)
+    hedge, _ = stub_llm(text="hedge", first_chunk_latency=2.0, modelId=HAIKU)
+    router = RoutingLLM(backends=[primary, hedge], hedge=True, hedge_delay=0.25)
+
+    assert "".join(router.generate_stream_deltas(PROMPT)) == "primary"
+    # The hedge started 0.25 s late; the 0.05 s it had waited says nothing of its latency.
+    assert router.stats()[1]["p50"] is None
+
+    for _ in range(2):
+        assert "".join(router.generate_stream_deltas(PROMPT)) == "primary"
+    primary_stats, hedge_stats = router.stats()
+    assert primary_stats["wins"] == 3 and hedge_stats["wins"] == 0
+    assert hedge_stats["p50"] > primary_stats["p50"]
+    assert router._ranked() == [0, 1]
+
+
+def test_fails_over_before_the_first_chunk():
+    broken, broken_runtime = stub_llm(text="broken")
+    broken_runtime.throttle_first = 10
+    working, _ = stub_llm(text="working", modelId=HAIKU)
+    router = RoutingLLM(backends=[broken, working], failure_threshold=1)
+
+    assert "".join(router.generate_stream_deltas(PROMPT)) == "working"
+    assert router.stats()[0]["healthy"] is False
+    # The failing backend is now tried last.
+    assert router._ranked() == [1, 0]
+    assert "".join(router.generate_stream_deltas(PROMPT)) == "working"
+    assert len(broken_runtime.requests) == 1
+
+
+def test_hedge_wins_over_a_stalled_primary():
+    stalled, stalled_runtime = stub_llm(text="stalled", first_chunk_latency=3)
+    quick, _ = stub_llm(text="quick", modelId=HAIKU)
+    router = RoutingLLM(backends=[stalled, quick], hedge=True, hedge_delay=0.1)
+
+    start = time.perf_counter()
+    assert "".join(router.generate_stream_deltas(PROMPT)) == "quick"
+    assert time.perf_counter() - start < 1
+    assert router.stats()[1]["wins"] == 1
+    # The loser's stream is closed rather than left to run.
+    time.sleep(0.05)
+    assert stalled_runtime.streams_closed_early == 1
+
+
+def test_async_hedge_wins_over_a_stalled_primary():
+    async def run():
+        stalled, _ = stub_llm(text="stalled", first_chunk_latency=3)
+        quick, _ = stub_llm(text="quick", modelId=HAIKU)
+        router = RoutingLLM(backends=[stalled, quick], hedge=True, hedge_delay=0.1)
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in router.agenerate_stream_deltas(PROMPT)]
+        assert "".join(chunks) == "quick"
+        assert time.perf_counter() - start < 1
+
+    asyncio.run(run())
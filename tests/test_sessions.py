@@ -0,0 +1,40 @@
+import base64
+import os
+
+from src.sessions import FileSessionStore
+
+IMAGE_BYTES = 10 * 1024
+
+
+def image_turn(data):
+    return {"role": "user", "content": [
+        {"type": "text", "text": "What is this?"},
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": data}},
+    ]}
+
+
+def test_images_are_read_back_on_demand(tmp_path):
+    images = [base64.b64encode(os.urandom(IMAGE_BYTES)).decode() for _ in range(6)]
+    store = FileSessionStore(str(tmp_path))
+    messages = store.open("session")
+    for data in images:
+        messages.add(image_turn(data))
+        messages.add({"role": "assistant", "content": [{"type": "text", "text": "A picture."}]})
+
+    limit = 3 * len(images[0])
+    store = FileSessionStore(str(tmp_path), max_blob_bytes=limit)
+    reopened = store.open("session")
+    assert reopened.messages == messages.messages
+
+    for _ in range(2):
+        prompt = reopened.to_prompt()
+        sent = [message["content"][1]["source"]["data"] for message in prompt["messages"] if message["role"] == "user"]
+        assert sent == images
+        del prompt, sent
+
+    # Neither the sources nor the messages' cached encodings keep the images:
+    # only the store's cache, bounded by max_blob_bytes, does.
+    sources = [message.content[1].source for message in reopened.messages if message.role == "user"]
+    assert all(source.is_deferred for source in sources)
+    assert all(message.__pydantic_private__["_json"] is None for message in reopened.messages if message.role == "user")
+    assert store._blob_bytes <= limit
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import threading
+import time
+
+from src.cache import CachedLLM
+from src.chat import Chat
+from src.coalesce import CoalescingLLM
+from src.llm_router import RoutingLLM
+from src.resilience import ResilientLLM
+from src.stream_control import StreamControl
+from src.stub_runtime import RecordingBedrockRuntime, StubBedrockRuntime
+from tests.test_fanout import stub_llm, texts
+
+LONG = "abcdefgh" * 50
+
+
+def test_cancelled_stream_is_not_cached():
+    llm, runtime = stub_llm(text=LONG, chunk_latency=0.01)
+    chat = Chat(llm=CachedLLM(llm=llm))
+    control = StreamControl()
+    threading.Timer(0.1, control.cancel).start()
+    partial = "".join(chat.generate_stream("hi", control=control))
+
+    assert control.stop_reason == "cancelled"
+    assert 0 < len(partial) < len(LONG)
+    assert texts(chat)[-1] == ("assistant", partial)
+
+    chat = Chat(llm=chat.llm)
+    assert "".join(chat.generate_stream("hi")) == LONG
+    assert len(runtime.requests) == 2
+
+
+def test_async_cancelled_stream_is_not_cached():
+    async def run():
+        llm, runtime = stub_llm(text=LONG, chunk_latency=0.01)
+        cached = CachedLLM(llm=llm)
+        control = StreamControl(max_seconds=0.1)
+        chunks = [chunk async for chunk in Chat(llm=cached).agenerate_stream("hi", control=control)]
+        assert control.stop_reason == "timeout"
+        assert 0 < len("".join(chunks)) < len(LONG)
+
+        chunks = [chunk async for chunk in Chat(llm=cached).agenerate_stream("hi")]
+        assert "".join(chunks) == LONG
+        assert len(runtime.requests) == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_stream_does_not_close_the_breaker():
+    llm, _ = stub_llm(text=LONG, chunk_latency=0.01)
+    resilient = ResilientLLM(llm=llm)
+    resilient.breaker.record_failure()
+    control = StreamControl(max_seconds=0.1)
+    list(Chat(llm=resilient).generate_stream("hi", control=control))
+
+    assert control.stop_reason == "timeout"
+    assert resilient.breaker.failures == 1
+
+
+def test_cancelled_stream_is_not_recorded(tmp_path):
+    path = tmp_path / "recordings.jsonl"
+    llm, _ = stub_llm(text=LONG, chunk_latency=0.01)
+    llm.bedrock_runtime = RecordingBedrockRuntime(StubBedrockRuntime(text=LONG, chunk_latency=0.01), str(path))
+    list(Chat(llm=llm).generate_stream("hi", control=StreamControl(max_seconds=0.1)))
+    assert not path.exists()
+
+    llm.bedrock_runtime.client.chunk_latency = 0.0
+    list(Chat(llm=llm).generate_stream("hi"))
+    recordings = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(recordings) == 1
+
+
+def timed_out_turn(llm):
+    control = StreamControl(first_chunk_timeout=0.3)
+    start = time.perf_counter()
+    chunks = list(Chat(llm=llm).generate_stream("hi", control=control))
+    return chunks, control, time.perf_counter() - start
+
+
+def test_timeout_closes_a_routed_stream():
+    slow, runtime = stub_llm(text=LONG, first_chunk_latency=3)
+    chunks, control, wall = timed_out_turn(RoutingLLM(backends=[slow]))
+
+    assert chunks == [] and control.stop_reason == "timeout"
+    assert wall < 1
+    assert runtime.streams_closed_early == 1
+
+
+def test_timeout_closes_a_coalesced_stream():
+    slow, runtime = stub_llm(text=LONG, first_chunk_latency=3)
+    coalescing = CoalescingLLM(llm=slow)
+    chunks, control, wall = timed_out_turn(coalescing)
+
+    assert chunks == [] and control.stop_reason == "timeout"
+    assert wall < 1
+    time.sleep(0.1)
+    assert runtime.streams_closed_early == 1
+    assert coalescing._streams == {}
+
+
+def test_cancelling_one_subscriber_keeps_the_shared_stream():
+    llm, runtime = stub_llm(text=LONG, chunk_latency=0.005)
+    coalescing = CoalescingLLM(llm=llm)
+    control = StreamControl()
+    results = {}
+
+    def follow():
+        results["other"] = "".join(Chat(llm=coalescing).generate_stream("hi"))
+
+    follower = threading.Thread(target=follow)
+    threading.Timer(0.1, control.cancel).start()
+    stream = Chat(llm=coalescing).generate_stream("hi", control=control)
+    next(stream)
+    follower.start()
+    partial = "".join(stream)
+    follower.join()
+
+    assert control.stop_reason == "cancelled" and len(partial) < len(LONG)
+    assert results["other"] == LONG
+    assert coalescing.upstream_calls == 1
+    assert runtime.streams_closed_early == 0
+
+
+def test_stop_sequence_split_across_chunks():
+    llm, _ = stub_llm(text="one two STOP three")
+    control = StreamControl(stop_sequences=["STOP"])
+    chat = Chat(llm=llm)
+    assert "".join(chat.generate_stream("hi", control=control)) == "one two "
+    assert control.stop_reason == "stop_sequence"
+    assert texts(chat)[-1] == ("assistant", "one two ")
+
+
+def test_chunk_gap_times_out():
+    llm, _ = stub_llm(text=LONG, chunk_latency=0.01)
+    control = StreamControl(max_chunk_gap=0.3)
+    stream = Chat(llm=llm).generate_stream("hi", control=control)
+    while not next(stream):
+        pass
+    # No text arrives while the consumer is not reading either.
+    time.sleep(0.5)
+    list(stream)
+    assert control.stop_reason == "timeout"
+
+
+def test_discarded_partial_drops_the_turn():
+    llm, _ = stub_llm(text=LONG, chunk_latency=0.01)
+    chat = Chat(llm=llm)
+    list(chat.generate_stream("hi", control=StreamControl(max_seconds=0.1, partial="discard")))
+    assert chat.messages.messages == []
+
+
+def test_async_timeout_closes_a_routed_stream():
+    async def run():
+        slow, _ = stub_llm(text=LONG, first_chunk_latency=3)
+        control = StreamControl(first_chunk_timeout=0.3)
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in Chat(llm=RoutingLLM(backends=[slow])).agenerate_stream("hi", control=control)]
+        assert chunks == [] and control.stop_reason == "timeout"
+        assert time.perf_counter() - start < 1
+
+    asyncio.run(run())
+
+
+def test_async_timeout_closes_a_coalesced_stream():
+    async def run():
+        slow, _ = stub_llm(text=LONG, first_chunk_latency=3)
+        coalescing = CoalescingLLM(llm=slow)
+        control = StreamControl(first_chunk_timeout=0.3)
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in Chat(llm=coalescing).agenerate_stream("hi", control=control)]
+        assert chunks == [] and control.stop_reason == "timeout"
+        assert time.perf_counter() - start < 1
+        assert coalescing._astreams == {}
+
+    asyncio.run(run())
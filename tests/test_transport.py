@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from src.transport import ThreadedTransport, default_transport
+from tests.test_fanout import stub_llm
+
+PROMPT = {"messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]}
+
+
+def test_threaded_streams_run_concurrently():
+    async def run():
+        llm, runtime = stub_llm(text="x" * 40, first_chunk_latency=0.5, chunk_latency=0.01)
+        llm.async_transport = ThreadedTransport(runtime)
+
+        async def one():
+            return "".join([chunk async for chunk in llm.agenerate_stream_deltas(PROMPT)])
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[one() for _ in range(64)])
+        assert responses == ["x" * 40] * 64
+        # The default executor has only a few workers; waiting for them would take seconds.
+        assert time.perf_counter() - start < 2
+
+    asyncio.run(run())
+
+
+def test_threaded_stream_closed_early():
+    async def run():
+        llm, runtime = stub_llm(text="x" * 400, chunk_latency=0.01)
+        llm.async_transport = ThreadedTransport(runtime)
+        stream = llm.agenerate_stream_deltas(PROMPT)
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        assert runtime.streams_closed_early == 1
+
+    asyncio.run(run())
+
+
+def test_transports_are_shared():
+    _, runtime = stub_llm()
+    assert default_transport("us-west-2", runtime) is default_transport("us-west-2", runtime)
+    assert default_transport("us-west-2", runtime) is not default_transport("us-west-2", runtime, max_pool_connections=10)